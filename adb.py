@@ -0,0 +1,67 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+# sqlite3 calls block, so coroutine handlers hand them to this many threads.
+# Each thread keeps its own pooled connection; SQLite only has one writer, so
+# a handful of threads keeps it busy no matter how many handlers are waiting.
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '4'))
+
+
+class AsyncDatabase:
+    """Runs blocking database work on a small dedicated thread pool for coroutines.
+
+    Anything that opens a transaction must run as one call, so the whole
+    block stays on a single thread and connection.
+    """
+
+    def __init__(self, threads: int = ASYNC_DB_THREADS):
+        self.threads = threads
+        self._executor = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='adb')
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) on a database thread and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(), functools.partial(fn, *args, **kwargs))
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(db.fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(db.fetchall, sql, params)
+
+    async def execute(self, sql: str, params=()) -> int:
+        """Execute a single autocommitted statement; returns its rowcount."""
+        return await self.run(lambda: db.execute(sql, params).rowcount)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+database = AsyncDatabase()
+
+
+async def run(fn, *args, **kwargs):
+    return await database.run(fn, *args, **kwargs)
+
+
+async def fetchone(sql: str, params=()):
+    return await database.fetchone(sql, params)
+
+
+async def fetchall(sql: str, params=()):
+    return await database.fetchall(sql, params)
+
+
+async def execute(sql: str, params=()) -> int:
+    return await database.execute(sql, params)
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut, Unauthorized
+from telegram.ext import TypeHandler
+
+import metrics
+from keyed import KeyedQueue, KeyedStats
+
+logger = logging.getLogger(__name__)
+
+# Handlers running at once; the rest wait on a semaphore, not on threads.
+ASYNC_MAX_INFLIGHT = int(os.getenv('ASYNC_MAX_INFLIGHT', '10000'))
+# Keep-alive connections to the Bot API; requests beyond this wait for a free one.
+ASYNC_HTTP_CONNECTIONS = int(os.getenv('ASYNC_HTTP_CONNECTIONS', '100'))
+API_TIMEOUT = 10
+
+
+class _StaleConnection(Exception):
+    """A kept-alive connection was closed by the server before it answered."""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one origin, opened on demand up to max_connections.
+
+    Reusing connections saves a TCP and TLS handshake on every Bot API call.
+    """
+
+    def __init__(self, url: str, max_connections: int):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.https = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.https else 80)
+        self.max_connections = max_connections
+        self._ssl = ssl.create_default_context() if self.https else None
+        self._idle = []  # [(reader, writer)]
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def post(self, path: str, body: bytes, content_type: str = 'application/json'):
+        """POST body to path; returns (status, response body)."""
+        request = (
+            f'POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n'
+        ).encode('latin-1') + body
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                reader, writer = self._idle.pop() if reused else await asyncio.open_connection(
+                    self.host, self.port, ssl=self._ssl)
+                try:
+                    writer.write(request)
+                    status, response, keep_alive = await self._read_response(reader)
+                except (_StaleConnection, ConnectionResetError, BrokenPipeError):
+                    writer.close()
+                    # The server dropped an idle connection before reading the request; try a fresh one
+                    if reused:
+                        continue
+                    raise NetworkError("Connection closed by server")
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, response
+
+    @staticmethod
+    async def _read_response(reader):
+        line = await reader.readline()
+        if not line:
+            raise _StaleConnection()
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, bytes(body), keep_alive
+
+    def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+class AsyncBot:
+    """The Bot API methods the coroutine handlers use, called without blocking a thread.
+
+    Errors are raised as the same telegram.error types the synchronous Bot
+    raises, so handlers catch them the same way.
+    """
+
+    def __init__(self, token: str, base_url: str = 'https://api.telegram.org/bot',
+                 max_connections: int = ASYNC_HTTP_CONNECTIONS, timeout: float = API_TIMEOUT):
+        self.token = token
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._path = urlsplit(base_url).path
+        self._pool = ConnectionPool(base_url, max_connections)
+        self._series = {}  # method -> (latency histogram, error counter)
+
+    async def call(self, method: str, **params):
+        if not metrics.METRICS_ENABLED:
+            return await self._call(method, **params)
+        series = self._series.get(method)
+        if series is None:
+            series = self._series[method] = metrics.api_call(method)
+        # Timed by sample like the sync Bot's calls (see metrics.TimedRequest); failures always count
+        sampled = random.random() < metrics.METRICS_SAMPLE_RATE
+        start = time.perf_counter()
+        try:
+            return await self._call(method, **params)
+        except Exception:
+            series[1].inc()
+            raise
+        finally:
+            if sampled:
+                series[0].observe(time.perf_counter() - start, 1 / metrics.METRICS_SAMPLE_RATE)
+
+    async def _call(self, method: str, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        markup = params.pop('reply_markup', None)
+        body = json.dumps(params)
+        if markup is not None:
+            # Markups are usually pre-serialized JSON (see render.py); spliced in as they are
+            if not isinstance(markup, str):
+                markup = markup.to_json()
+            body = f'{body[:-1]}, "reply_markup": {markup}}}'
+        try:
+            status, body = await asyncio.wait_for(
+                self._pool.post(f'{self._path}{self.token}/{method}', body.encode()),
+                self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise TimedOut()
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            raise NetworkError(str(e) or type(e).__name__)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise NetworkError(f"Invalid server response ({status})")
+        if data.get('ok'):
+            return data['result']
+
+        description = data.get('description', 'Unknown error')
+        retry_after = (data.get('parameters') or {}).get('retry_after')
+        if retry_after is not None:
+            raise RetryAfter(retry_after)
+        if status in (401, 403):
+            raise Unauthorized(description)
+        if status == 400:
+            raise BadRequest(description)
+        raise NetworkError(f"{description} ({status})")
+
+    async def send_message(self, chat_id, text: str, reply_markup=None, parse_mode: str = None):
+        return await self.call('sendMessage', chat_id=chat_id, text=text,
+                               reply_markup=reply_markup, parse_mode=parse_mode)
+
+    async def edit_message_text(self, text: str, chat_id, message_id, reply_markup=None):
+        return await self.call('editMessageText', chat_id=chat_id, message_id=message_id,
+                               text=text, reply_markup=reply_markup)
+
+    async def answer_callback_query(self, callback_query_id: str, text: str = None):
+        return await self.call('answerCallbackQuery', callback_query_id=callback_query_id, text=text)
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+class AsyncContext:
+    """Per-update context handed to coroutine handlers."""
+
+    __slots__ = ('bot', 'args', 'match')
+
+    def __init__(self, bot: AsyncBot, args: list = None, match=None):
+        self.bot = bot
+        self.args = args or []
+        self.match = match
+
+
+class _Turn:
+    """An update's place in the per-key queues; ready resolves when it may run."""
+
+    __slots__ = ('keys', 'ready', 'queued_at')
+
+    def __init__(self, keys, ready: asyncio.Future):
+        self.keys = tuple(dict.fromkeys(keys))
+        self.ready = ready
+        self.queued_at = time.perf_counter()
+
+
+class AsyncDispatcher:
+    """Routes updates to coroutine handlers on one event loop thread.
+
+    Updates arrive from any thread through submit(); each becomes a task,
+    so thousands of slow interactions wait on I/O instead of holding threads.
+    With keys, updates sharing a key run one at a time in arrival order.
+    """
+
+    def __init__(self, bot: AsyncBot, max_inflight: int = ASYNC_MAX_INFLIGHT, keys=None):
+        self.bot = bot
+        self.max_inflight = max_inflight
+        self.keys = keys
+        self._order = KeyedQueue()
+        self._ordering = KeyedStats()
+        self._commands = {}
+        self._callback_queries = []  # [(compiled pattern, handler)]
+        self._text = None
+        self._loop = None
+        self._thread = None
+        self._tasks = set()
+        self._slots = None
+        self._started = threading.Event()
+        self._series = {}  # handler name -> (latency, queue wait, error) series
+        self.handled = 0
+        self.failed = 0
+
+    def add_command(self, command: str, handler) -> None:
+        self._commands[command.lower()] = handler
+
+    def add_callback_query(self, pattern: str, handler) -> None:
+        self._callback_queries.append((re.compile(pattern), handler))
+
+    def add_text(self, handler) -> None:
+        """Handle plain text messages that aren't commands."""
+        self._text = handler
+
+    def route(self, update: Update):
+        """Return (handler, context) for update, or None if nothing handles it."""
+        if update.callback_query is not None:
+            data = update.callback_query.data or ''
+            for pattern, handler in self._callback_queries:
+                match = pattern.match(data)
+                if match:
+                    return handler, AsyncContext(self.bot, match=match)
+            return None
+        message = update.message
+        if message is None or not message.text:
+            return None
+        entities = message.entities or []
+        if message.text.startswith('/') and any(e.type == 'bot_command' and e.offset == 0 for e in entities):
+            words = message.text.split()
+            handler = self._commands.get(words[0][1:].split('@')[0].lower())
+            return (handler, AsyncContext(self.bot, args=words[1:])) if handler else None
+        if self._text is not None:
+            return self._text, AsyncContext(self.bot)
+        return None
+
+    async def dispatch(self, update: Update) -> None:
+        received_at = time.perf_counter()
+        routed = self.route(update)
+        if routed is None:
+            return
+        handler, context = routed
+        if self.keys is None:
+            await self._handle(handler, update, context, received_at)
+            return
+
+        # Runs on the loop thread only, so the ordering queue needs no lock
+        turn = _Turn(self.keys(update), self._loop.create_future())
+        immediate = self._order.add(turn)
+        self._ordering.queued(len(self._tasks), max(self._order.depth(key) for key in turn.keys))
+        if not immediate:
+            await turn.ready
+        self._ordering.started(0.0 if immediate else time.perf_counter() - turn.queued_at, 0.0)
+        try:
+            await self._handle(handler, update, context, received_at)
+        finally:
+            self._ordering.completed += 1
+            for waiting in self._order.done(turn):
+                waiting.ready.set_result(None)
+
+    def _handler_series(self, name: str):
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = metrics.handler_series(name)
+        return series
+
+    async def _handle(self, handler, update: Update, context: AsyncContext, received_at: float) -> None:
+        async with self._slots:
+            series = self._handler_series(handler.__name__) if metrics.METRICS_ENABLED else None
+            start = time.perf_counter()
+            if series:
+                series[1].observe(start - received_at)
+            try:
+                await handler(update, context)
+                self.handled += 1
+            except Exception:
+                self.failed += 1
+                if series:
+                    series[2].inc()
+                logger.exception("Async handler %s failed on update %s", handler.__name__, update.update_id)
+            finally:
+                if series:
+                    series[0].observe(time.perf_counter() - start)
+
+    def submit(self, update: Update) -> None:
+        """Schedule update on the event loop; safe to call from any thread."""
+        self._loop.call_soon_threadsafe(self._spawn, update)
+
+    def _spawn(self, update: Update) -> None:
+        task = self._loop.create_task(self.dispatch(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def attach(self, dispatcher) -> None:
+        """Forward every update the PTB dispatcher receives, from polling or the webhook, to this loop."""
+        dispatcher.add_handler(TypeHandler(Update, lambda update, context: self.submit(update)))
+
+    def run_coroutine(self, coroutine):
+        """Run coroutine on the event loop from another thread; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='async-dispatcher', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _drain(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        self.bot.close()
+
+    def stop(self) -> None:
+        """Let in-flight handlers finish, then stop the loop."""
+        if self._thread is None:
+            return
+        self.run_coroutine(self._drain()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def ordering_stats(self) -> dict:
+        """Per-key queue depth and wait times; only meaningful when keys is set."""
+        return self._ordering.snapshot(len(self._tasks), len(self._order))
@@ -0,0 +1,232 @@
+import logging
+import os
+from collections import defaultdict
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Raw rows folded into the summaries per transaction; each chunk holds the
+# write lock only for its own upserts
+ANALYTICS_CHUNK_ROWS = int(os.getenv('ANALYTICS_CHUNK_ROWS', '5000'))
+ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+
+GAMES = 'game_sessions'
+TRANSACTIONS = 'token_transactions'
+
+
+def _day(timestamp: str) -> str:
+    return timestamp[:10] if timestamp else ''
+
+
+class _Summary:
+    """Increments for one chunk of raw rows, applied to the summary tables together."""
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0, 0, 0, 0, 0])  # day -> games, decided, draws, staked, tokens_in, tokens_out
+        self.stakes = defaultdict(int)                       # (day, stake) -> games
+        self.flows = defaultdict(lambda: [0, 0, 0])          # (day, type) -> transactions, tokens_in, tokens_out
+        self.users = defaultdict(lambda: [0, 0, 0, 0, 0, 0, 0, ''])
+        # user_id -> games, wins, losses, draws, staked, tokens_in, tokens_out, last_active
+        self.active = set()                                  # (day, user_id)
+
+    def _touch(self, user_id, day: str) -> list:
+        user = self.users[user_id]
+        if day > user[7]:
+            user[7] = day
+        self.active.add((day, user_id))
+        return user
+
+    def add_game(self, player1_id, player2_id, stake, status, winner_id, created_at) -> None:
+        day = _day(created_at)
+        daily = self.daily[day]
+        daily[0] += 1
+        daily[1] += winner_id is not None
+        daily[2] += status == 'draw'
+        daily[3] += 2 * (stake or 0)
+        self.stakes[(day, stake or 0)] += 1
+        for user_id in (player1_id, player2_id):
+            user = self._touch(user_id, day)
+            user[0] += 1
+            user[4] += stake or 0
+            if winner_id is not None:
+                user[1 if user_id == winner_id else 2] += 1
+            elif status == 'draw':
+                user[3] += 1
+
+    def add_transaction(self, user_id, amount, transaction_type, timestamp) -> None:
+        day = _day(timestamp)
+        tokens_in, tokens_out = (amount, 0) if amount >= 0 else (0, -amount)
+        daily = self.daily[day]
+        daily[4] += tokens_in
+        daily[5] += tokens_out
+        flow = self.flows[(day, transaction_type)]
+        flow[0] += 1
+        flow[1] += tokens_in
+        flow[2] += tokens_out
+        user = self._touch(user_id, day)
+        user[5] += tokens_in
+        user[6] += tokens_out
+
+    def apply(self, conn) -> None:
+        conn.executemany(
+            """INSERT INTO daily_stats (day, games, decided, draws, staked, tokens_in, tokens_out)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (day) DO UPDATE SET
+                   games = games + excluded.games, decided = decided + excluded.decided,
+                   draws = draws + excluded.draws, staked = staked + excluded.staked,
+                   tokens_in = tokens_in + excluded.tokens_in, tokens_out = tokens_out + excluded.tokens_out""",
+            ((day, *values) for day, values in self.daily.items())
+        )
+        conn.executemany(
+            """INSERT INTO daily_stakes (day, stake, games) VALUES (?, ?, ?)
+               ON CONFLICT (day, stake) DO UPDATE SET games = games + excluded.games""",
+            ((day, stake, games) for (day, stake), games in self.stakes.items())
+        )
+        conn.executemany(
+            """INSERT INTO daily_token_flows (day, transaction_type, transactions, tokens_in, tokens_out)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (day, transaction_type) DO UPDATE SET
+                   transactions = transactions + excluded.transactions,
+                   tokens_in = tokens_in + excluded.tokens_in, tokens_out = tokens_out + excluded.tokens_out""",
+            ((day, transaction_type, *values) for (day, transaction_type), values in self.flows.items())
+        )
+        conn.executemany(
+            """INSERT INTO user_stats (user_id, games, wins, losses, draws, staked, tokens_in, tokens_out, last_active)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   games = games + excluded.games, wins = wins + excluded.wins,
+                   losses = losses + excluded.losses, draws = draws + excluded.draws,
+                   staked = staked + excluded.staked, tokens_in = tokens_in + excluded.tokens_in,
+                   tokens_out = tokens_out + excluded.tokens_out,
+                   last_active = MAX(last_active, excluded.last_active)""",
+            ((user_id, *values) for user_id, values in self.users.items())
+        )
+        conn.executemany("INSERT OR IGNORE INTO daily_players (day, user_id) VALUES (?, ?)", self.active)
+
+
+# source -> (query for the rows after a watermark, _Summary method folding one row in)
+_SOURCES = {
+    GAMES: ("SELECT id, player1_id, player2_id, stake, status, winner_id, created_at FROM game_sessions "
+            "WHERE id > ? ORDER BY id LIMIT ?", _Summary.add_game),
+    TRANSACTIONS: ("SELECT id, user_id, amount, transaction_type, timestamp FROM token_transactions "
+                   "WHERE id > ? ORDER BY id LIMIT ?", _Summary.add_transaction),
+}
+
+
+def watermark(source: str, pool=None) -> int:
+    """The id of the last row of source folded into the summaries."""
+    row = (pool or db.pool).connection().execute(
+        "SELECT last_id FROM analytics_watermarks WHERE source = ?", (source,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def refresh_source(source: str, chunk_rows: int = ANALYTICS_CHUNK_ROWS, pool=None) -> int:
+    """Fold the rows of source added since its watermark into the summaries; returns how many.
+
+    Both logs use AUTOINCREMENT ids and SQLite commits one writer at a
+    time, so rows become visible in id order and the watermark never
+    skips one. Each chunk is read outside any transaction, so writers
+    aren't held up by the scan, then applied together with its watermark
+    only if no other process folded it in meanwhile.
+    """
+    pool = pool or db.pool
+    query, fold = _SOURCES[source]
+    processed = 0
+    last_id = watermark(source, pool)
+    while True:
+        rows = pool.connection().execute(query, (last_id, chunk_rows)).fetchall()
+        if not rows:
+            return processed
+        summary = _Summary()
+        for row in rows:
+            fold(summary, *row[1:])
+        with pool.transaction() as conn:
+            if watermark(source, pool) != last_id:
+                # Another process got there first; carry on from where it is
+                last_id = watermark(source, pool)
+                continue
+            summary.apply(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO analytics_watermarks (source, last_id) VALUES (?, ?)", (source, rows[-1][0])
+            )
+        last_id = rows[-1][0]
+        processed += len(rows)
+        if len(rows) < chunk_rows:
+            return processed
+
+
+def refresh(pool=None) -> dict:
+    """Bring every summary up to date; returns the rows folded in per source."""
+    return {source: refresh_source(source, pool=pool) for source in _SOURCES}
+
+
+def refresh_analytics(context=None) -> None:
+    """Periodic job: fold new game and token rows into the summary tables."""
+    try:
+        processed = refresh()
+    except Exception:
+        logger.exception("Analytics refresh failed")
+        return
+    if any(processed.values()):
+        logger.debug("Analytics refreshed: %s", processed)
+
+
+def daily_report(day: str, pool=None) -> dict:
+    """Games, active players, stakes and token flows for one day (YYYY-MM-DD)."""
+    conn = (pool or db.pool).connection()
+    row = conn.execute(
+        "SELECT games, decided, draws, staked, tokens_in, tokens_out FROM daily_stats WHERE day = ?", (day,)
+    ).fetchone() or (0, 0, 0, 0, 0, 0)
+    return {
+        'day': day,
+        'active_players': conn.execute("SELECT COUNT(*) FROM daily_players WHERE day = ?", (day,)).fetchone()[0],
+        'games': row[0],
+        'decided': row[1],
+        'draws': row[2],
+        'staked': row[3],
+        'tokens_in': row[4],
+        'tokens_out': row[5],
+        'stakes': dict(conn.execute(
+            "SELECT stake, games FROM daily_stakes WHERE day = ? ORDER BY stake", (day,)
+        ).fetchall()),
+        'flows': {transaction_type: (tokens_in, tokens_out) for transaction_type, tokens_in, tokens_out in conn.execute(
+            "SELECT transaction_type, tokens_in, tokens_out FROM daily_token_flows WHERE day = ? ORDER BY transaction_type",
+            (day,)
+        )},
+    }
+
+
+def daily_active_players(since: str, pool=None) -> list:
+    """[(day, players)] from since (YYYY-MM-DD) on."""
+    return (pool or db.pool).connection().execute(
+        "SELECT day, COUNT(*) FROM daily_players WHERE day >= ? GROUP BY day ORDER BY day", (since,)
+    ).fetchall()
+
+
+def stake_distribution(since: str, pool=None) -> dict:
+    """{stake: games} over the days from since on; tournament matches have stake 0."""
+    return dict((pool or db.pool).connection().execute(
+        "SELECT stake, SUM(games) FROM daily_stakes WHERE day >= ? GROUP BY stake ORDER BY stake", (since,)
+    ).fetchall())
+
+
+def token_flows(since: str, pool=None) -> dict:
+    """{transaction_type: (tokens_in, tokens_out)} over the days from since on."""
+    return {transaction_type: (tokens_in, tokens_out) for transaction_type, tokens_in, tokens_out in
+            (pool or db.pool).connection().execute(
+                "SELECT transaction_type, SUM(tokens_in), SUM(tokens_out) FROM daily_token_flows "
+                "WHERE day >= ? GROUP BY transaction_type ORDER BY transaction_type", (since,)
+            )}
+
+
+def win_rate(user_id, pool=None):
+    """(wins, decided games, win rate) for user_id, or None if they haven't played."""
+    row = (pool or db.pool).connection().execute(
+        "SELECT wins, wins + losses FROM user_stats WHERE user_id = ? AND games > 0", (user_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    wins, decided = row
+    return wins, decided, wins / decided if decided else 0.0
@@ -0,0 +1,425 @@
+import asyncio
+
+from telegram import ParseMode, Update
+
+import adb
+import ledger
+import records
+import referrals
+import run
+import state
+from aio import AsyncContext, AsyncDispatcher
+
+
+async def reply(update: Update, context: AsyncContext, text: str, reply_markup=None, parse_mode: str = None):
+    return await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+
+async def edit(update: Update, context: AsyncContext, text: str, reply_markup=None):
+    message = update.callback_query.message
+    return await context.bot.edit_message_text(text, message.chat_id, message.message_id, reply_markup=reply_markup)
+
+
+async def answer(update: Update, context: AsyncContext):
+    return await context.bot.answer_callback_query(update.callback_query.id)
+
+
+async def get_user_data(user_id):
+    return await adb.run(run.get_user_data, user_id)
+
+
+async def state_call(fn, *args):
+    """Run a game state operation: inline in memory, on the database threads when shared through game.db."""
+    if state.store.shared:
+        return await adb.run(fn, *args)
+    return fn(*args)
+
+
+async def start(update: Update, context: AsyncContext) -> None:
+    user = update.effective_user
+    user_data = await get_user_data(user.id)
+    if not user_data:
+        await adb.run(run.create_user, user.id, 100)
+        user_data = await get_user_data(user.id)
+
+    await reply(update, context, run.welcome_message(user, user_data),
+                reply_markup=run.get_main_menu_keyboard(), parse_mode=ParseMode.HTML)
+
+
+async def handle_menu_choice(update: Update, context: AsyncContext) -> None:
+    handler = MENU_CHOICES.get(update.message.text)
+    if handler is None:
+        await reply(update, context, "Please use the menu buttons or commands.", reply_markup=run.get_main_menu_keyboard())
+        return
+    await handler(update, context)
+
+
+async def check_balance(update: Update, context: AsyncContext) -> None:
+    user_data = await get_user_data(update.effective_user.id)
+    await reply(update, context, f"💰 Your current balance is {user_data['tokens']} tokens.",
+                reply_markup=run.get_main_menu_keyboard())
+
+
+async def show_stats(update: Update, context: AsyncContext) -> None:
+    if update.effective_user.id not in run.ADMIN_USER_IDS:
+        await reply(update, context, "❌ This command is for admins only.")
+        return
+    # Gauges such as the outbox backlog query game.db
+    await reply(update, context, await adb.run(run.stats_message))
+
+
+async def start_battle(update: Update, context: AsyncContext) -> None:
+    user_id = update.effective_user.id
+    user_data = await get_user_data(user_id)
+
+    if not user_data:
+        if not await adb.run(run.create_user, user_id, 100):
+            await reply(update, context, "Error creating user account. Please try /start again.")
+            return
+        user_data = await get_user_data(user_id)
+        if not user_data:
+            await reply(update, context, "Error accessing user data. Please try again later.")
+            return
+
+    if user_data['tokens'] < 50:
+        await reply(
+            update, context,
+            "❌ You need at least 50 tokens to enter a battle.\n"
+            f"Your current balance: {user_data['tokens']} tokens\n"
+            "Try claiming your daily bonus or winning more tokens!",
+            reply_markup=run.get_main_menu_keyboard()
+        )
+        return
+
+    await reply(update, context, "⚔️ Welcome to Battle Mode!\n\nChoose your stake amount:",
+                reply_markup=run.get_stake_keyboard())
+
+
+async def handle_battle_stake(update: Update, context: AsyncContext) -> None:
+    query = update.callback_query
+    await answer(update, context)
+
+    user_id = query.from_user.id
+    stake = int(query.data.split('_')[1])
+    user_data = await get_user_data(user_id)
+
+    if not user_data:
+        await edit(update, context, "❌ Error: User data not found. Please try /start again.")
+        return
+
+    if user_data["tokens"] < stake:
+        await edit(
+            update, context,
+            f"❌ You don't have enough tokens for this stake ({stake} tokens required).\n"
+            f"Your current balance: {user_data['tokens']} tokens"
+        )
+        return
+
+    player_data = records.QueueEntry(
+        user_id, stake, query.from_user.username or query.from_user.first_name, user_data["rating"]
+    )
+
+    opponent, queued = await state_call(run.matchmaking_queue.pop_opponent_or_enqueue, player_data)
+
+    if opponent:
+        await start_battle_session(update, context, player_data, opponent)
+    elif not queued:
+        await edit(
+            update, context,
+            f"⌛ You're already waiting for an opponent at {stake} tokens.\n"
+            "The battle will start automatically when an opponent is found."
+        )
+    else:
+        await edit(
+            update, context,
+            f"⌛ Waiting for an opponent...\n"
+            f"Stake amount: {stake} tokens\n"
+            f"Your rating: {user_data['rating']}\n\n"
+            "The battle will start automatically when an opponent is found."
+        )
+
+
+async def start_battle_session(update: Update, context: AsyncContext,
+                               player1: records.QueueEntry, player2: records.QueueEntry) -> None:
+    try:
+        # The battle UI reaches both players through the outbox
+        await adb.run(run.begin_battle, player1, player2, player1.stake)
+    except ledger.LedgerError:
+        await edit(update, context, "❌ Battle cancelled: One of the players doesn't have enough tokens.")
+        return
+
+    try:
+        await edit(update, context, "✅ Battle started! Check your private messages with the bot.")
+    except Exception as e:
+        print(f"Error in start_battle_session: {e}")
+        await edit(update, context, "❌ An error occurred while starting the battle. Please try again.")
+
+
+async def handle_battle_move(update: Update, context: AsyncContext) -> None:
+    query = update.callback_query
+    await answer(update, context)
+
+    _, game_id, move = query.data.split('_')
+    game_id = int(game_id)
+    user_id = query.from_user.id
+
+    # One atomic update, so only the move that completes the game resolves it
+    outcome, game = await state_call(run.record_move, game_id, user_id, move)
+    if outcome == 'ended':
+        await edit(update, context, "❌ This battle has already ended or expired.")
+        return
+
+    if outcome == 'not_player':
+        await edit(update, context, "❌ You are not a participant in this battle.")
+        return
+
+    if outcome == 'already_moved':
+        await edit(update, context, f"✋ You've already chosen {game.move_of(user_id)}.\nWaiting for your opponent...")
+        return
+
+    await edit(update, context, f"✅ You chose {move}!\nWaiting for your opponent...")
+
+    if outcome == 'both_moved':
+        await resolve_battle(context, game_id)
+
+
+async def resolve_battle(context: AsyncContext, game_id: int) -> None:
+    game = await state_call(run.close_match, game_id)
+    if game is None:
+        return
+    p1_id, p2_id = game.player_ids
+
+    try:
+        await adb.run(run.settle_match, game_id, game)
+    except Exception as e:
+        print(f"Database error in resolve_battle: {e}")
+        await state_call(run.reopen_match, game_id, game)
+        await asyncio.gather(
+            context.bot.send_message(p1_id, "❌ An error occurred while resolving the battle."),
+            context.bot.send_message(p2_id, "❌ An error occurred while resolving the battle."),
+        )
+
+
+async def show_swap_options(update: Update, context: AsyncContext) -> None:
+    user_data = await get_user_data(update.effective_user.id)
+    min_swap = 1000
+
+    if user_data["tokens"] < min_swap:
+        await reply(
+            update, context,
+            f"❌ You need at least {min_swap} tokens to swap for crypto.\n"
+            f"Current balance: {user_data['tokens']} tokens"
+        )
+        return
+
+    await reply(
+        update, context,
+        "💱 Token Swap\n\n"
+        "Choose amount to swap for ETH:\n"
+        "(You'll need to provide your ETH address)",
+        reply_markup=run.get_swap_keyboard()
+    )
+
+
+async def claim_daily_bonus(update: Update, context: AsyncContext) -> None:
+    user_id = update.effective_user.id
+    if not await get_user_data(user_id):
+        await reply(update, context, "❌ Please start the bot first with /start")
+        return
+
+    new_balance = await adb.run(run.claim_daily, user_id)
+    if new_balance is None:
+        await reply(update, context, '❌ You already claimed your daily bonus today. Come back tomorrow!',
+                    reply_markup=run.get_main_menu_keyboard())
+        return
+
+    await reply(
+        update, context,
+        f'🎁 You claimed your daily bonus of {run.DAILY_BONUS} tokens.\n\nYour new balance is {new_balance} tokens.',
+        reply_markup=run.get_main_menu_keyboard()
+    )
+
+
+async def show_leaderboard(update: Update, context: AsyncContext) -> None:
+    column = 'rating' if context.args and context.args[0].lower() == 'rating' else 'tokens'
+    await reply(update, context, run.leaderboard_message(column, update.effective_user.id),
+                reply_markup=run.get_main_menu_keyboard())
+
+
+async def create_tournament(update: Update, context: AsyncContext) -> None:
+    user = update.effective_user
+    user_data = await get_user_data(user.id)
+
+    if not user_data:
+        await reply(update, context, "❌ Please start the bot first with /start")
+        return
+
+    if not (context.args and context.args[0].lower() == 'new'):
+        if user_data["tokens"] < run.TOURNAMENT_ENTRY_FEE:
+            await reply(update, context, "❌ You need 100 tokens to join the tournament!")
+            return
+        await state_call(run.request_tournament_seat, user.id, user.username or user.first_name)
+        await reply(update, context, run.FINDING_TOURNAMENT)
+        return
+
+    if user_data["tokens"] < 200:
+        await reply(update, context, "❌ You need at least 200 tokens to create a tournament!")
+        return
+
+    try:
+        tournament = await adb.run(run.open_tournament, user.id, user.username or user.first_name)
+    except ledger.InsufficientFunds:
+        await reply(update, context, "❌ You need at least 200 tokens to create a tournament!")
+        return
+
+    message, reply_markup = run.tournament_view(tournament, created=True)
+    await reply(update, context, message, reply_markup=reply_markup)
+
+
+async def handle_tournament_join(update: Update, context: AsyncContext) -> None:
+    query = update.callback_query
+    await answer(update, context)
+
+    tournament_id = int(query.data.split('_')[-1])
+    user = query.from_user
+    user_data = await get_user_data(user.id)
+
+    if not user_data:
+        await edit(update, context, "❌ Please start the bot first with /start")
+        return
+
+    if user_data["tokens"] < 100:
+        await edit(update, context, "❌ You need 100 tokens to join the tournament!")
+        return
+
+    # Hold the seat while the fee is charged, so concurrent joins can't overfill the tournament
+    refusal = await state_call(run.reserve_tournament_seat, tournament_id, user.id, user.username or user.first_name)
+    if refusal:
+        await edit(update, context, refusal)
+        return
+
+    try:
+        tournament = await adb.run(run.join_tournament, tournament_id, user.id)
+    except ledger.InsufficientFunds:
+        await edit(update, context, "❌ You need 100 tokens to join the tournament!")
+        return
+
+    message, reply_markup = run.tournament_view(tournament)
+    await edit(update, context, message, reply_markup=reply_markup)
+
+    if await state_call(run.claim_tournament_start, tournament_id):
+        # The round's move buttons reach the players through the outbox
+        await adb.run(run.start_tournament_round, tournament_id)
+
+
+async def show_character_classes(update: Update, context: AsyncContext) -> None:
+    user_data = await get_user_data(update.effective_user.id)
+
+    if not user_data:
+        await reply(update, context, "❌ Please start the bot first with /start")
+        return
+
+    message, reply_markup = run.character_classes_view(user_data)
+    await reply(update, context, message, reply_markup=reply_markup)
+
+
+async def handle_class_selection(update: Update, context: AsyncContext) -> None:
+    query = update.callback_query
+    await answer(update, context)
+
+    user_id = query.from_user.id
+    if not await get_user_data(user_id):
+        await edit(update, context, "❌ Please start the bot first with /start")
+        return
+
+    class_id = query.data.split('_')[-1]
+    char_class = run.CHARACTER_CLASSES.get(class_id)
+
+    if not char_class:
+        await edit(update, context, "❌ Invalid character class!")
+        return
+
+    try:
+        await adb.run(run.purchase_class, user_id, class_id)
+    except ledger.InsufficientFunds:
+        await edit(update, context, f"❌ Not enough tokens! You need {char_class['cost']} tokens.")
+        return
+
+    await edit(update, context, run.class_selected_message(char_class), reply_markup=run.get_main_menu_keyboard())
+
+
+async def show_referral_info(update: Update, context: AsyncContext) -> None:
+    user_id = update.effective_user.id
+    user_data = await get_user_data(user_id)
+
+    if not user_data:
+        await reply(update, context, "❌ Please start the bot first with /start")
+        return
+
+    referral_code = user_data.get('referral_code')
+    if not referral_code:
+        referral_code = await adb.run(referrals.ensure_code, user_id)
+
+    await reply(update, context, run.referral_info_message(user_data, referral_code),
+                reply_markup=run.get_main_menu_keyboard())
+
+
+async def handle_referral_code(update: Update, context: AsyncContext) -> None:
+    if len(context.args) != 1:
+        await reply(update, context, "❌ Please provide a referral code.\nUsage: /referral REF12345")
+        return
+
+    referral_code = context.args[0]
+    user_id = update.effective_user.id
+    user_data = await get_user_data(user_id)
+
+    if not user_data:
+        await reply(update, context, "❌ Please start the bot first with /start")
+        return
+
+    if user_data.get('used_referral'):
+        await reply(update, context, "❌ You have already used a referral code!")
+        return
+
+    outcome = await adb.run(referrals.redeem, user_id, referral_code)
+    if outcome == referrals.INVALID_CODE:
+        await reply(update, context, "❌ Invalid referral code!")
+        return
+    if outcome == referrals.ALREADY_USED:
+        await reply(update, context, "❌ You have already used a referral code!")
+        return
+    await adb.run(run.record_audit_event, user_id, 'referral_redeemed', referral_code)
+
+    await reply(update, context, f"✨ Referral code redeemed!\nYou received {run.REFERRAL_REWARDS['referee']} tokens!")
+
+
+MENU_CHOICES = {
+    "⚔️ Battle Mode": start_battle,
+    "💰 Check Balance": check_balance,
+    "🎁 Daily Bonus": claim_daily_bonus,
+    "🏆 Leaderboard": show_leaderboard,
+    "💱 Swap Tokens": show_swap_options,
+    "🏆 Tournament Mode": create_tournament,
+    "🎭 Character Classes": show_character_classes,
+    "👥 Referral Info": show_referral_info,
+}
+
+
+def register(dispatcher: AsyncDispatcher) -> None:
+    """The coroutine counterpart of run.register_handlers."""
+    dispatcher.add_command("start", start)
+    dispatcher.add_command("battle", start_battle)
+    dispatcher.add_command("balance", check_balance)
+    dispatcher.add_command("daily", claim_daily_bonus)
+    dispatcher.add_command("leaderboard", show_leaderboard)
+    dispatcher.add_command("swap", show_swap_options)
+    dispatcher.add_command("tournament", create_tournament)
+    dispatcher.add_command("referral", handle_referral_code)
+    dispatcher.add_command("classes", show_character_classes)
+    dispatcher.add_command("referralinfo", show_referral_info)
+    dispatcher.add_command("stats", show_stats)
+    dispatcher.add_callback_query('^stake_[0-9]+$', handle_battle_stake)
+    dispatcher.add_callback_query('^move_[0-9]+_[a-z]+$', handle_battle_move)
+    dispatcher.add_callback_query('^join_tournament_[0-9]+$', handle_tournament_join)
+    dispatcher.add_callback_query('^select_class_[a-z]+$', handle_class_selection)
+    dispatcher.add_text(handle_menu_choice)
@@ -0,0 +1,153 @@
+"""Ops questions from raw logs vs the incrementally maintained summary tables.
+
+game_sessions and token_transactions are filled with --games games and
+three token movements per game, spread over --days days. The ad-hoc
+queries scan the raw logs for daily active players, the stake
+distribution, token flows by type and the top win rates. analytics.refresh
+first backfills the summaries, then folds in --new games at a time as a
+live bot would between refreshes; its cost follows the new rows, not the
+size of the logs. Every summary answer is checked against the raw one.
+
+    python benchmarks/bench_analytics.py --games 1000000 --players 50000 --new 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STAKES = (50, 100, 200, 500)
+START = datetime(2026, 1, 1)
+
+RAW_ACTIVE = """
+    SELECT day, COUNT(DISTINCT user_id) FROM (
+        SELECT substr(created_at, 1, 10) AS day, player1_id AS user_id FROM game_sessions
+        UNION ALL SELECT substr(created_at, 1, 10), player2_id FROM game_sessions
+        UNION ALL SELECT substr(timestamp, 1, 10), user_id FROM token_transactions
+    ) WHERE day >= ? GROUP BY day ORDER BY day"""
+RAW_STAKES = """
+    SELECT stake, COUNT(*) FROM game_sessions WHERE substr(created_at, 1, 10) >= ? GROUP BY stake ORDER BY stake"""
+RAW_FLOWS = """
+    SELECT transaction_type, SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)) FROM token_transactions
+    WHERE substr(timestamp, 1, 10) >= ? GROUP BY transaction_type ORDER BY transaction_type"""
+RAW_WIN_RATES = """
+    SELECT user_id, SUM(won), COUNT(*) FROM (
+        SELECT player1_id AS user_id, winner_id = player1_id AS won FROM game_sessions WHERE winner_id IS NOT NULL
+        UNION ALL SELECT player2_id, winner_id = player2_id FROM game_sessions WHERE winner_id IS NOT NULL
+    ) GROUP BY user_id HAVING COUNT(*) >= 20 ORDER BY 1.0 * SUM(won) / COUNT(*) DESC, user_id LIMIT 10"""
+SUMMARY_WIN_RATES = """
+    SELECT user_id, wins, wins + losses FROM user_stats WHERE wins + losses >= 20
+    ORDER BY 1.0 * wins / (wins + losses) DESC, user_id LIMIT 10"""
+
+
+def generate(rng, first_game: int, games: int, players: int, days: int):
+    """(game rows, token rows) for games games played over days days."""
+    game_rows, token_rows = [], []
+    for n in range(first_game, first_game + games):
+        when = (START + timedelta(seconds=days * 86400 * n / (first_game + games + 1))).isoformat()
+        p1, p2 = rng.sample(range(1, players + 1), 2)
+        stake = rng.choice(STAKES)
+        roll = rng.random()
+        status, winner = ('draw', None) if roll < 0.1 else ('completed', p1 if roll < 0.55 else p2)
+        game_rows.append((p1, p2, stake, status, winner, when))
+        token_rows.append((p1, -stake, 'battle_stake', when))
+        token_rows.append((p2, -stake, 'battle_stake', when))
+        if winner is not None:
+            token_rows.append((winner, int(stake * 1.8), 'battle_payout', when))
+        else:
+            token_rows.append((p1, stake, 'battle_refund', when))
+    return game_rows, token_rows
+
+
+def insert(db, game_rows, token_rows):
+    db.executemany(
+        "INSERT INTO game_sessions (player1_id, player2_id, stake, status, winner_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        game_rows
+    )
+    db.executemany(
+        "INSERT INTO token_transactions (user_id, amount, transaction_type, timestamp) VALUES (?, ?, ?, ?)",
+        token_rows
+    )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--new', type=int, default=10000, help='games added between refreshes')
+    parser.add_argument('--refreshes', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'analytics.db')
+    import analytics
+    import db
+    import migrations
+
+    migrations.migrate(db.pool)
+    rng = random.Random(1)
+    insert(db, *generate(rng, 0, args.games, args.players, args.days))
+    since = (START + timedelta(days=args.days - 7)).date().isoformat()
+
+    raw = {}
+    raw['active players/day'], raw_active = timed(db.fetchall, RAW_ACTIVE, (since,))
+    raw['stake distribution'], raw_stakes = timed(db.fetchall, RAW_STAKES, (since,))
+    raw['token flows'], raw_flows = timed(db.fetchall, RAW_FLOWS, (since,))
+    raw['top win rates'], raw_rates = timed(db.fetchall, RAW_WIN_RATES)
+
+    _, backfill = timed(analytics.refresh)
+
+    added = args.games
+    incremental = []
+    for _ in range(args.refreshes):
+        insert(db, *generate(rng, added, args.new, args.players, args.days))
+        added += args.new
+        folded, seconds = timed(analytics.refresh)
+        incremental.append((sum(folded.values()), seconds))
+
+    summary = {}
+    summary['active players/day'], sum_active = timed(analytics.daily_active_players, since)
+    summary['stake distribution'], sum_stakes = timed(lambda: list(analytics.stake_distribution(since).items()))
+    summary['token flows'], sum_flows = timed(
+        lambda: [(t, i, o) for t, (i, o) in analytics.token_flows(since).items()])
+    summary['top win rates'], sum_rates = timed(db.fetchall, SUMMARY_WIN_RATES)
+
+    # The raw answers above predate the incremental batches; ask again for the check
+    expected = {
+        'active players/day': db.fetchall(RAW_ACTIVE, (since,)),
+        'stake distribution': db.fetchall(RAW_STAKES, (since,)),
+        'token flows': db.fetchall(RAW_FLOWS, (since,)),
+        'top win rates': db.fetchall(RAW_WIN_RATES),
+    }
+
+    print(f"{added} games, {len(db.fetchall('SELECT id FROM token_transactions'))} token rows, "
+          f"{args.players} players, {args.days} days; queries cover the last 7 days")
+    print(f"{'question':<20} {'raw ms':>9} {'summary ms':>11} {'same':>5}")
+    for name, raw_seconds, summary_seconds in (
+        ('active players/day', raw_active, sum_active),
+        ('stake distribution', raw_stakes, sum_stakes),
+        ('token flows', raw_flows, sum_flows),
+        ('top win rates', raw_rates, sum_rates),
+    ):
+        same = [tuple(row) for row in summary[name]] == [tuple(row) for row in expected[name]]
+        print(f"{name:<20} {raw_seconds * 1000:>9.1f} {summary_seconds * 1000:>11.2f} {'yes' if same else 'NO':>5}")
+    print(f"backfill   {backfill:.1f} s for {args.games} games")
+    for rows, seconds in incremental:
+        print(f"refresh    {rows:>7} new rows in {seconds * 1000:.0f} ms")
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
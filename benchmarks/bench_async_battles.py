@@ -0,0 +1,202 @@
+"""Concurrent battles per process: thread-pool handlers vs the asyncio stack.
+
+Every pair of players taps a stake, both get the battle message, then each
+taps a move; a battle is done when both have their result. All battles
+start at once against a stand-in Bot API that answers every call after a
+simulated network round trip, the cost that holds a worker thread in the
+thread-pool stack. Updates go straight onto the dispatcher's queue, so
+ingestion is not part of the measurement.
+
+    python benchmarks/bench_async_battles.py --battles 1000 --latency 0.05 --workers 8
+"""
+import argparse
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram_standin import StandInBotAPI, callback_update  # noqa: E402
+
+FIRST_USER_ID = 1
+STAKE = 50
+
+
+class BattleDriver:
+    """Plays every battle forward as the bot's replies arrive at the stand-in.
+
+    Players are paired by the matchmaker, so each game's two players are
+    read back from its battle message.
+    """
+
+    def __init__(self, players: int, first_user_id: int):
+        self.user_ids = range(first_user_id, first_user_id + players)
+        self.battles = players // 2
+        self.tapped = {}    # user_id -> perf_counter of their stake tap
+        self.games = {}     # game_id -> (user_id, user_id)
+        self.opened = {}    # first mover's user_id -> (game_id, the other player)
+        self.player_games = {}  # user_id -> both players of their game
+        self.results = {}   # user_id -> perf_counter of their result message
+        self.latencies = []
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._update_ids = itertools.count(1)
+        self.submit = None
+
+    def _push(self, user_id: int, data: str) -> None:
+        with self._lock:
+            update_id = next(self._update_ids)
+        self.submit(callback_update(update_id, user_id, data))
+
+    def start(self) -> None:
+        for user_id in self.user_ids:
+            self.tapped[user_id] = time.perf_counter()
+            self._push(user_id, f'stake_{STAKE}')
+
+    def on_message(self, method: str, chat_id: int, params: dict) -> None:
+        text = params.get('text', '')
+        if text.startswith('⚔️ Battle Started!'):
+            game_id = int(text.split('#', 1)[1].split()[0])
+            names = text.split('🆚 ', 1)[1].split('\n', 1)[0].split(' vs ')
+            players = tuple(sorted(int(name[len('Player'):]) for name in names))
+            with self._lock:
+                first_message = game_id not in self.games
+                self.games[game_id] = players
+                self.opened[players[0]] = (game_id, players[1])
+                for user_id in players:
+                    self.player_games[user_id] = players
+            # The lower id moves first; the other moves once that move has landed,
+            # so the two taps never race each other
+            if first_message:
+                self._push(players[0], f'move_{game_id}_rock')
+        elif text.startswith('✅ You chose'):
+            with self._lock:
+                opened = self.opened.pop(chat_id, None)
+            if opened is not None:
+                game_id, other = opened
+                self._push(other, f'move_{game_id}_scissors')
+        elif 'Your new balance' in text:
+            now = time.perf_counter()
+            with self._lock:
+                self.results[chat_id] = now
+                players = self.player_games.get(chat_id)
+                if players and all(user_id in self.results for user_id in players):
+                    self.latencies.append(now - max(self.tapped[user_id] for user_id in players))
+                if len(self.latencies) == self.battles:
+                    self.done.set()
+
+
+def bot_threads() -> int:
+    """Live threads, leaving out the stand-in server's per-connection threads."""
+    return sum(1 for thread in threading.enumerate() if 'process_request_thread' not in thread.name)
+
+
+def seed_players(db, count: int) -> None:
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, 1000, '', 0, 0, 1000)",
+        ((FIRST_USER_ID + i,) for i in range(count))
+    )
+
+
+def run_stack(stack: str, args) -> dict:
+    from telegram import Update
+    from telegram.ext import Updater
+
+    import aio
+    import async_handlers
+    import keyed
+    import outbox
+    import run
+
+    driver = BattleDriver(2 * args.battles, FIRST_USER_ID)
+    api = StandInBotAPI(latency=args.latency, on_message=driver.on_message)
+    updater = Updater(token=api.token, base_url=api.base_url, workers=args.workers, use_context=True)
+    async_dispatcher = None
+    if stack == 'asyncio':
+        async_dispatcher = aio.AsyncDispatcher(aio.AsyncBot(api.token, base_url=api.base_url), keys=run.handler_keys)
+        async_handlers.register(async_dispatcher)
+        async_dispatcher.start()
+        async_dispatcher.attach(updater.dispatcher)
+    else:
+        run.handler_executor = keyed.KeyedExecutor(args.workers, name='handlers')
+        run.register_handlers(updater.dispatcher)
+    outbox.sender.start(updater.bot, async_dispatcher)
+
+    driver.submit = lambda data: updater.dispatcher.update_queue.put(Update.de_json(data, updater.bot))
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, daemon=True)
+    dispatcher_thread.start()
+
+    peak_threads = bot_threads()
+    start = time.perf_counter()
+    driver.start()
+    while not driver.done.wait(0.05):
+        peak_threads = max(peak_threads, bot_threads())
+        if time.perf_counter() - start > args.timeout:
+            break
+    elapsed = time.perf_counter() - start
+
+    outbox.sender.stop()
+    if async_dispatcher is not None:
+        async_dispatcher.stop()
+    else:
+        run.handler_executor.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
+    api.close()
+
+    latencies = sorted(latency * 1000 for latency in driver.latencies)
+    return {
+        'completed': len(latencies),
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'peak_threads': peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--battles', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated Bot API round trip, seconds')
+    parser.add_argument('--workers', type=int, default=8, help='thread-pool stack worker threads')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--stacks', nargs='+', default=['threads', 'asyncio'])
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'battles.db')
+    import adb
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+
+    print(f"{args.battles} concurrent battles, {args.latency * 1000:.0f} ms Bot API round trip, "
+          f"{args.workers} workers (threads) / {adb.database.threads} db threads (asyncio)")
+    print(f"{'stack':<10} {'done':>6} {'battles/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'threads':>8}")
+    for stack in args.stacks:
+        db.execute("DELETE FROM users")
+        run.user_cache.cache.clear()
+        seed_players(db, 2 * args.battles)
+        result = run_stack(stack, args)
+        latencies = result['latencies']
+        if len(latencies) < 2:
+            print(f"{stack:<10} {result['completed']:>6} timed out")
+            continue
+        cuts = statistics.quantiles(latencies, n=100)
+        print(f"{stack:<10} {result['completed']:>6} {result['completed'] / result['elapsed']:>10.1f} "
+              f"{cuts[49]:>9.0f} {cuts[94]:>9.0f} {result['peak_threads']:>8}")
+
+    adb.database.shutdown()
+    writer.queue.stop()
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
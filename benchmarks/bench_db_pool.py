@@ -0,0 +1,88 @@
+"""Compare per-call sqlite3.connect against the pooled storage layer.
+
+Runs the same read/update mix on a worker-thread pool sized like the
+dispatcher's and prints ops/sec for each approach.
+
+    python benchmarks/bench_db_pool.py --threads 4 --ops 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db  # noqa: E402
+
+USER_COUNT = 1000
+SELECT_USER = "SELECT id, tokens, last_daily, wins, losses, rating, character_class, referral_code, referrals, used_referral FROM users WHERE id=?"
+UPDATE_TOKENS = "UPDATE users SET tokens=? WHERE id=?"
+
+
+def create_schema(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE users
+                    (id INTEGER PRIMARY KEY, tokens INTEGER DEFAULT 100, last_daily TEXT DEFAULT '',
+                     wins INTEGER DEFAULT 0, losses INTEGER DEFAULT 0, rating INTEGER DEFAULT 1000,
+                     character_class TEXT, referral_code TEXT, referrals INTEGER DEFAULT 0,
+                     used_referral INTEGER DEFAULT 0)''')
+    conn.executemany("INSERT INTO users (id) VALUES (?)", ((i,) for i in range(USER_COUNT)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_op(path, user_id):
+    # What every helper in run.py used to do: connect, query, close.
+    conn = sqlite3.connect(path, timeout=30)
+    row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+    conn.close()
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(UPDATE_TOKENS, (row[1] + 1, user_id))
+    conn.commit()
+    conn.close()
+
+
+def pooled_op(pool, user_id):
+    conn = pool.connection()
+    row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+    conn.execute(UPDATE_TOKENS, (row[1] + 1, user_id))
+
+
+def run(label, op, threads, ops):
+    ids = [random.randrange(USER_COUNT) for _ in range(ops)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(op, ids, chunksize=64))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {ops / elapsed:>10.0f} ops/sec  ({elapsed:.2f}s)")
+    return ops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4, help='worker threads (Updater default is 4)')
+    parser.add_argument('--ops', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        pooled_path = os.path.join(tmp, 'pooled.db')
+        create_schema(legacy_path)
+        create_schema(pooled_path)
+
+        print(f"{args.ops} read+update ops on {args.threads} threads")
+        legacy = run('connect-per-call (legacy)', lambda uid: legacy_op(legacy_path, uid), args.threads, args.ops)
+
+        pool = db.ConnectionPool(pooled_path)
+        pooled = run('pooled WAL connections', lambda uid: pooled_op(pool, uid), args.threads, args.ops)
+        pool.close_all()
+
+        print(f"speedup: {pooled / legacy:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Applying special-event modifiers to a battle reward: per-call scan vs the precompiled pipeline.
+
+The scan is the old apply_event_modifiers: every call walks the active
+events, drops ended ones, and substring-matches the effect against each
+event's display name. The pipeline indexes the active events by effect
+when the set changes and caches one composed function per (effect,
+events, class), so a call is a dict lookup; it also applies the winner's
+class perk, which the scan never did. Both run with every event active,
+against the same in-process event map.
+
+    python benchmarks/bench_event_modifiers.py --calls 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import modifiers  # noqa: E402
+
+CLASSES = (None, 'warrior', 'mage', 'rogue')
+
+
+def scan_apply(active_events: dict, events: dict, value: int, event_type: str) -> int:
+    current_time = datetime.now()
+    running = {}
+    for event_id, event in list(active_events.items()):
+        if current_time > event['end_time']:
+            active_events.pop(event_id)
+        else:
+            running[event_id] = event
+    for event_id, event in running.items():
+        if event_type in event['name'].lower():
+            value = events[event_id]['modifier'](value)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GAME_DB_PATH', ':memory:')
+    import run
+
+    active = {
+        event_id: {'name': event['name'], 'description': event['description'],
+                   'end_time': datetime.now() + event['duration']}
+        for event_id, event in run.SPECIAL_EVENTS.items()
+    }
+    pipeline = modifiers.ModifierPipeline(run.SPECIAL_EVENTS, run.CHARACTER_CLASSES)
+    pipeline.refresh(active)
+    rng = random.Random(1)
+    stakes = [rng.randrange(50, 501) for _ in range(1024)]
+    classes = [rng.choice(CLASSES) for _ in range(1024)]
+
+    start = time.perf_counter()
+    for i in range(args.calls):
+        scan_apply(active, run.SPECIAL_EVENTS, stakes[i & 1023], 'reward')
+    scan = (time.perf_counter() - start) / args.calls
+
+    start = time.perf_counter()
+    for i in range(args.calls):
+        pipeline.apply(stakes[i & 1023], modifiers.BATTLE_REWARD, classes[i & 1023])
+    compiled = (time.perf_counter() - start) / args.calls
+
+    assert scan_apply(active, run.SPECIAL_EVENTS, 90, 'reward') == pipeline.apply(90, modifiers.BATTLE_REWARD) == 180
+    assert pipeline.apply(90, modifiers.BATTLE_REWARD, 'warrior') == 216
+
+    print(f"{len(active)} active events, {args.calls} calls")
+    print(f"scan      {scan * 1e6:>7.2f} µs/call")
+    print(f"pipeline  {compiled * 1e6:>7.2f} µs/call  ({scan / compiled:.1f}x, incl. class perks)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Load simulation: the real run.py handlers driven by fake updates, with latency percentiles and baselines.
+
+N simulated users go through start, claim_daily_bonus, handle_battle_stake,
+handle_battle_move (whose completing tap runs resolve_battle) and
+handle_tournament_join. Each phase submits every user's update at once
+through handler_keys and the keyed executor, as the dispatcher does, so
+latency is from submission to the handler returning, queueing included.
+Updates are real telegram.Update objects bound to a stub Bot that answers
+every API call in-process, after --api-latency seconds.
+
+With --baseline FILE, the first run saves its results there and later
+runs fail (exit status 1) when a handler's throughput drops, or its p95
+latency grows, by more than --tolerance; --update-baseline overwrites it.
+
+    python benchmarks/bench_handlers.py --users 2000 --workers 4 --baseline benchmarks/baseline_handlers.json
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram_standin import TOKEN, callback_update, command_update  # noqa: E402
+
+MOVES = ('rock', 'paper', 'scissors')
+STAKE = 50
+TOURNAMENT_SIZE = 8
+# Compared against the baseline; p99 is reported but too noisy to gate on
+GATED = ('throughput', 'p95_ms')
+
+
+class StubRequest:
+    """Stands in for the Bot's HTTP client: answers every Bot API call in-process and counts them by method."""
+
+    def __init__(self, api_latency: float):
+        self.api_latency = api_latency
+        self.calls = collections.Counter()
+        self._calls_lock = threading.Lock()
+
+    def post(self, url: str, data=None, timeout=None):
+        with self._calls_lock:
+            self.calls[url.rsplit('/', 1)[-1]] += 1
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        return True
+
+
+def stub_bot(api_latency: float):
+    """A real Bot on a StubRequest, instrumented the way run.main instruments updater.bot."""
+    import metrics
+    from telegram import Bot
+
+    calls = StubRequest(api_latency)
+    bot = Bot(TOKEN, request=calls)
+    metrics.instrument_bot(bot)
+    return bot, calls
+
+
+class Recorder:
+    """Latencies per handler, from submission to return."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.walls = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies[name].append(seconds)
+
+    def results(self) -> dict:
+        results = {}
+        for name, samples in self.latencies.items():
+            samples = sorted(samples)
+            results[name] = {
+                'calls': len(samples),
+                'throughput': len(samples) / self.walls[name] if self.walls[name] else 0.0,
+                'p50_ms': percentile(samples, 0.50) * 1000,
+                'p95_ms': percentile(samples, 0.95) * 1000,
+                'p99_ms': percentile(samples, 0.99) * 1000,
+            }
+        return results
+
+
+def percentile(samples: list, q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def drive(run, bot, recorder: Recorder, name: str, callback, updates: list, wall_name: str = None) -> None:
+    """Submit every update at once through the keyed executor and wait for all of them.
+
+    Callbacks are wrapped as run.serialized wraps them, so handler metrics
+    are part of what's measured unless METRICS_ENABLED=0.
+    """
+    import metrics
+    from telegram import Update
+
+    updates = [Update.de_json(update, bot) for update in updates]
+    context = SimpleNamespace(bot=bot, args=[], dispatcher=SimpleNamespace(run_async=lambda fn, *a: fn(*a)))
+    handler = metrics.timed_handler(callback)
+
+    def timed(update, submitted):
+        if handler is callback:
+            callback(update, context)
+        else:
+            handler(update, context, submitted)
+        recorder.record(name, time.perf_counter() - submitted)
+
+    start = time.perf_counter()
+    for update in updates:
+        run.handler_executor.submit(run.handler_keys(update), timed, update, time.perf_counter())
+    run.handler_executor.wait_idle()
+    recorder.walls[wall_name or name] += time.perf_counter() - start
+
+
+def simulate(run, bot, users: int) -> Recorder:
+    recorder = Recorder()
+    ids = iter(range(1, 10 ** 9))
+    user_ids = list(range(1, users + 1))
+
+    drive(run, bot, recorder, 'start', run.start,
+          [command_update(next(ids), user_id, '/start') for user_id in user_ids])
+    drive(run, bot, recorder, 'claim_daily_bonus', run.claim_daily_bonus,
+          [command_update(next(ids), user_id, '/daily') for user_id in user_ids])
+    drive(run, bot, recorder, 'handle_battle_stake', run.handle_battle_stake,
+          [callback_update(next(ids), user_id, f'stake_{STAKE}') for user_id in user_ids])
+    # Taps that found nobody waiting are paired by the next matchmaking tick
+    for player1, player2 in run.matchmaking_queue.match_batch():
+        run.begin_battle(player1, player2, player1.stake)
+
+    # resolve_battle runs inside the move handler that completed the match
+    resolve_battle = run.resolve_battle
+
+    def timed_resolve(context, game_id):
+        start = time.perf_counter()
+        resolve_battle(context, game_id)
+        recorder.record('resolve_battle', time.perf_counter() - start)
+    run.resolve_battle = timed_resolve
+    try:
+        taps = [
+            callback_update(next(ids), user_id, f'move_{game_id}_{MOVES[(game_id + user_id) % 3]}')
+            for game_id, match in run.active_matches.items() if match.tournament_id is None
+            for user_id in match.player_ids
+        ]
+        drive(run, bot, recorder, 'handle_battle_move', run.handle_battle_move, taps)
+        recorder.walls['resolve_battle'] = recorder.walls['handle_battle_move']
+    finally:
+        run.resolve_battle = resolve_battle
+
+    joins = []
+    for creator in range(1, users + 1, TOURNAMENT_SIZE):
+        tournament = run.open_tournament(creator, f'Player{creator}')
+        joins.extend(callback_update(next(ids), user_id, f'join_tournament_{tournament.id}')
+                     for user_id in range(creator + 1, min(creator + TOURNAMENT_SIZE, users + 1)))
+    drive(run, bot, recorder, 'handle_tournament_join', run.handle_tournament_join, joins)
+    return recorder
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions beyond tolerance, as readable lines."""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            regressions.append(f"{name}: not measured")
+            continue
+        if current['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput']:.0f}/s vs {base['throughput']:.0f}/s baseline")
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f} ms vs {base['p95_ms']:.1f} ms baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4, help='keyed executor threads (BOT_WORKERS)')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory', help='STATE_BACKEND')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds per stub Bot API call')
+    parser.add_argument('--baseline', help='JSON file to compare against, saved there if missing')
+    parser.add_argument('--update-baseline', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed regression, as a fraction')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'handlers.db')
+    os.environ['STATE_BACKEND'] = args.backend
+    os.environ['BOT_WORKERS'] = str(args.workers)
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+    bot, calls = stub_bot(args.api_latency)
+    results = simulate(run, bot, args.users).results()
+    run.handler_executor.stop()
+    writer.queue.stop()
+
+    print(f"{args.users} users, {args.workers} workers, STATE_BACKEND={args.backend}, "
+          f"api latency {args.api_latency * 1000:g} ms, {sum(calls.calls.values())} Bot API calls")
+    print(f"{'handler':<24} {'calls':>6} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, result in results.items():
+        print(f"{name:<24} {result['calls']:>6} {result['throughput']:>8.0f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    db.pool.close_all()
+    tmp.cleanup()
+
+    if not args.baseline:
+        return
+    config = {'users': args.users, 'workers': args.workers, 'backend': args.backend, 'api_latency': args.api_latency}
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': config, 'handlers': results}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['config'] != config:
+        sys.exit(f"baseline {args.baseline} was recorded with {baseline['config']}, not {config}")
+    regressions = compare(results, {name: {key: base[key] for key in GATED} for name, base in baseline['handlers'].items()},
+                          args.tolerance)
+    if regressions:
+        print(f"regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"within {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
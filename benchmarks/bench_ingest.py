@@ -0,0 +1,117 @@
+"""Update ingestion: long polling vs the webhook server, side by side.
+
+A local stand-in Bot API holds the replayed /start traffic. In polling mode
+the bot fetches it with getUpdates; in webhook mode the stand-in posts it to
+webhook.WebhookServer in batches. Latency runs from an update being queued
+at the stand-in to the bot's reply arriving back there, through the real
+handlers and database.
+
+    python benchmarks/bench_ingest.py --updates 2000 --rate 500 --workers 8 --batch 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram_standin import StandInBotAPI, command_update  # noqa: E402
+
+
+def replay(api, first_user_id, count, rate):
+    """Queue count /start updates at rate per second (0 = all at once); returns {chat_id: queued_at}."""
+    queued = {}
+    start = time.perf_counter()
+    for i in range(count):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        user_id = first_user_id + i
+        queued[user_id] = time.perf_counter()
+        api.push(command_update(user_id, user_id, '/start'))
+    return queued
+
+
+def report(mode, api, queued):
+    latencies = sorted((api.reply_time(chat_id) - at) * 1000 for chat_id, at in queued.items())
+    elapsed = max(api.reply_time(chat_id) for chat_id in queued) - min(queued.values())
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{mode:<10} {len(queued) / elapsed:>10.0f} {cuts[49]:>9.1f} {cuts[94]:>9.1f} {cuts[98]:>9.1f}")
+
+
+def run_polling(run, args, first_user_id):
+    from telegram.ext import Updater
+
+    api = StandInBotAPI()
+    updater = Updater(token=api.token, base_url=api.base_url, workers=args.workers, use_context=True)
+    run.register_handlers(updater.dispatcher)
+    updater.start_polling(poll_interval=0.0, timeout=1)
+    queued = replay(api, first_user_id, args.updates, args.rate)
+    ok = api.wait_for_replies(queued)
+    api.close()
+    updater.stop()
+    return api, queued, ok
+
+
+def run_webhook(run, args, first_user_id):
+    import webhook
+    from telegram.ext import Updater
+
+    api = StandInBotAPI()
+    updater = Updater(token=api.token, base_url=api.base_url, workers=args.workers, use_context=True)
+    run.register_handlers(updater.dispatcher)
+    server = webhook.WebhookServer(updater.bot, updater.dispatcher.update_queue, port=0, max_batch=args.batch)
+    server.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, daemon=True)
+    dispatcher_thread.start()
+    api.start_pushing(f'http://127.0.0.1:{server.port}{server.path}',
+                      batch_size=args.batch, connections=args.connections)
+    queued = replay(api, first_user_id, args.updates, args.rate)
+    ok = api.wait_for_replies(queued)
+    api.close()
+    server.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
+    return api, queued, ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500, help='updates per second; 0 replays a single burst')
+    parser.add_argument('--workers', type=int, default=8, help='dispatcher handler threads')
+    parser.add_argument('--batch', type=int, default=50, help='updates per webhook request')
+    parser.add_argument('--connections', type=int, default=4, help='concurrent webhook deliveries')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'ingest.db')
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+
+    print(f"{args.updates} updates at {args.rate or 'burst'}/s, {args.workers} workers, "
+          f"webhook batch {args.batch} x {args.connections} connections")
+    print(f"{'mode':<10} {'updates/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    # Disjoint user ranges so both modes take the same new-user path
+    for offset, (mode, runner) in enumerate((('polling', run_polling), ('webhook', run_webhook))):
+        api, queued, ok = runner(run, args, 1 + offset * 1000000)
+        if not ok:
+            print(f"{mode:<10} timed out waiting for replies")
+            continue
+        report(mode, api, queued)
+
+    writer.queue.stop()
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
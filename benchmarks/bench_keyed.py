@@ -0,0 +1,146 @@
+"""Double taps under three execution models: sequential, unordered pool, keyed executor.
+
+Every joiner taps "Join Tournament" twice in quick succession, across
+many tournaments at once. The sequential dispatcher is safe but runs one
+handler at a time; an unordered worker pool lets both taps of a user pass
+the membership check and pay twice; the keyed executor orders each user's
+and each tournament's taps while running different users in parallel.
+
+    python benchmarks/bench_keyed.py --tournaments 50 --latency 0.02 --workers 8
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram_standin import StandInBotAPI, callback_update  # noqa: E402
+
+JOINERS = 7  # plus the creator fills a tournament
+START_TOKENS = 1000
+
+
+def seed(db, run, tournaments: int) -> list:
+    """Create each tournament's creator and joiners; returns [(tournament_id, [joiner ids])]."""
+    users = tournaments * (JOINERS + 1)
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, ?, '', 0, 0, 1000)",
+        ((user_id, START_TOKENS) for user_id in range(1, users + 1))
+    )
+    lobbies = []
+    for t in range(tournaments):
+        creator = 1 + t * (JOINERS + 1)
+        tournament = run.open_tournament(creator)
+        lobbies.append((tournament.id, list(range(creator + 1, creator + 1 + JOINERS))))
+    return lobbies
+
+
+def run_model(model: str, args) -> dict:
+    from telegram import Update
+    from telegram.ext import Updater
+
+    import db
+    import keyed
+    import run
+    import writer
+
+    db.execute("DELETE FROM users")
+    run.active_tournaments.clear()
+    run.active_matches.clear()
+    run.user_cache.cache.clear()
+    lobbies = seed(db, run, args.tournaments)
+    writer.queue.flush()
+
+    taps = 2 * JOINERS * len(lobbies)
+    replies = threading.Semaphore(0)
+    api = StandInBotAPI(latency=args.latency,
+                        on_message=lambda method, chat_id, params: method == 'editMessageText' and replies.release())
+    updater = Updater(token=api.token, base_url=api.base_url, workers=args.workers, use_context=True)
+    run.handler_executor = keyed.KeyedExecutor(args.workers, name='handlers')
+    if model == 'keyed':
+        run.register_handlers(updater.dispatcher)
+    else:
+        run.register_handlers(updater.dispatcher, wrap=lambda callback: callback)
+        if model == 'unordered':
+            for handlers in updater.dispatcher.handlers.values():
+                for handler in handlers:
+                    handler.run_async = True
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, daemon=True)
+    dispatcher_thread.start()
+
+    update_ids = itertools.count(1)
+    start = time.perf_counter()
+    for tournament_id, joiners in lobbies:
+        for user_id in joiners:
+            for _ in range(2):
+                data = callback_update(next(update_ids), user_id, f'join_tournament_{tournament_id}')
+                updater.dispatcher.update_queue.put(Update.de_json(data, updater.bot))
+    answered = sum(replies.acquire(timeout=args.timeout) for _ in range(taps))
+    elapsed = time.perf_counter() - start
+
+    run.handler_executor.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
+    api.close()
+
+    joiners = [user_id for _, users in lobbies for user_id in users]
+    charged_twice = sum(
+        1 for user_id in joiners
+        if db.fetchone("SELECT tokens FROM users WHERE id = ?", (user_id,))[0] < START_TOKENS - 100
+    )
+    return {
+        'answered': answered,
+        'taps': taps,
+        'elapsed': elapsed,
+        'charged_twice': charged_twice,
+        'stats': run.handler_executor.stats() if model == 'keyed' else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tournaments', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated Bot API round trip, seconds')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--models', nargs='+', default=['sequential', 'unordered', 'keyed'])
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'keyed.db')
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+
+    print(f"{args.tournaments} tournaments x {JOINERS} joiners tapping twice, "
+          f"{args.latency * 1000:.0f} ms Bot API round trip, {args.workers} workers")
+    print(f"{'model':<12} {'taps/s':>8} {'charged twice':>14}")
+    keyed_stats = None
+    for model in args.models:
+        result = run_model(model, args)
+        if result['answered'] < result['taps']:
+            print(f"{model:<12} timed out after {result['answered']}/{result['taps']} replies")
+            continue
+        print(f"{model:<12} {result['taps'] / result['elapsed']:>8.0f} {result['charged_twice']:>14}")
+        keyed_stats = result['stats'] or keyed_stats
+
+    if keyed_stats:
+        print("\nkeyed executor:", ", ".join(
+            f"{name}={value:.1f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in keyed_stats.items()
+        ))
+
+    writer.queue.stop()
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
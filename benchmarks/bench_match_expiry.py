@@ -0,0 +1,77 @@
+"""Finding expired battles each second: scanning every live match vs the timer wheel.
+
+N live battles have move deadlines spread evenly over the next timeout
+window, so about N / timeout of them expire per one-second tick. The scan
+checks every match's deadline each tick, as a sweep over active_matches
+would; the wheel only touches the slot that is due.
+
+    python benchmarks/bench_match_expiry.py --matches 10000 100000 300000 --ticks 30
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from records import Match, QueueEntry  # noqa: E402
+from timers import TimerWheel  # noqa: E402
+
+TIMEOUT = 120
+START = 1.7e9
+
+
+def live_matches(count: int) -> dict:
+    return {
+        game_id: Match(game_id, QueueEntry(2 * game_id - 1, 50), QueueEntry(2 * game_id, 50), 50,
+                       START - TIMEOUT + TIMEOUT * game_id / count)
+        for game_id in range(1, count + 1)
+    }
+
+
+def run_scan(matches: dict, ticks: int):
+    live = dict(matches)
+    expired = 0
+    start = time.perf_counter()
+    for tick in range(1, ticks + 1):
+        now = START + tick
+        due = [game_id for game_id, match in live.items() if match.started_at + TIMEOUT <= now]
+        for game_id in due:
+            del live[game_id]
+        expired += len(due)
+    return (time.perf_counter() - start) / ticks, expired
+
+
+def run_wheel(matches: dict, ticks: int):
+    now = [START]
+    wheel = TimerWheel(clock=lambda: now[0])
+    start = time.perf_counter()
+    for game_id, match in matches.items():
+        wheel.schedule(game_id, match.started_at + TIMEOUT)
+    schedule = (time.perf_counter() - start) / len(matches)
+    expired = 0
+    start = time.perf_counter()
+    for tick in range(1, ticks + 1):
+        now[0] = START + tick
+        expired += len(wheel.advance())
+    return (time.perf_counter() - start) / ticks, expired, schedule
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--ticks', type=int, default=30, help='one-second ticks timed')
+    args = parser.parse_args()
+
+    print(f"deadlines spread over {TIMEOUT} s, {args.ticks} ticks")
+    print(f"{'live':>8} {'expired':>8} {'scan ms/tick':>13} {'wheel ms/tick':>14} {'schedule µs':>12}")
+    for count in args.matches:
+        matches = live_matches(count)
+        scan, scanned = run_scan(matches, args.ticks)
+        wheel, expired, schedule = run_wheel(matches, args.ticks)
+        assert scanned == expired, (scanned, expired)
+        print(f"{count:>8} {expired:>8} {scan * 1000:>13.2f} {wheel * 1000:>14.3f} {schedule * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Memory held per live match: the old nested dicts vs records.Match.
+
+Fills active_matches with N concurrent battles, both players queued with a
+username and rating and one move made, and measures the bytes traced for
+the matches and everything they reference. "Before" rebuilds the dict shape
+matches had before the slotted records: a match dict holding two player
+dicts, a moves dict and an ISO timestamp string.
+
+    python benchmarks/bench_match_memory.py --matches 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STAKE = 50
+
+
+def player_dict(user_id: int) -> dict:
+    return {"user_id": user_id, "stake": STAKE, "username": f"Player{user_id}", "rating": 1000 + user_id % 400}
+
+
+def dict_match(game_id: int) -> dict:
+    p1, p2 = 2 * game_id - 1, 2 * game_id
+    return {
+        "player1": player_dict(p1),
+        "player2": player_dict(p2),
+        "stake": STAKE,
+        "moves": {p1: 'rock'},
+        "started_at": datetime.now().isoformat(),
+    }
+
+
+def record_match(run, game_id: int):
+    p1, p2 = 2 * game_id - 1, 2 * game_id
+    match = run.records.Match(
+        game_id,
+        run.records.QueueEntry(p1, STAKE, f"Player{p1}", 1000 + p1 % 400),
+        run.records.QueueEntry(p2, STAKE, f"Player{p2}", 1000 + p2 % 400),
+        STAKE, 1.7e9 + game_id
+    )
+    match.record_move(p1, 'rock')
+    return match
+
+
+def measure(matches: int, build, store: dict) -> int:
+    """Bytes still allocated after adding matches built by build(game_id) to store."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for game_id in range(1, matches + 1):
+        store[game_id] = build(game_id)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, default=100000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'memory.db')
+    os.environ['STATE_BACKEND'] = 'memory'
+    import run
+
+    # The same in-process map shape as active_matches, so both sides pay for the table
+    dict_bytes = measure(args.matches, dict_match, {})
+    run.active_matches.clear()
+    record_bytes = measure(args.matches, lambda game_id: record_match(run, game_id), run.active_matches)
+
+    print(f"{args.matches} live matches")
+    print(f"{'shape':<14} {'total MB':>9} {'bytes/match':>12}")
+    for name, used in (('nested dicts', dict_bytes), ('records.Match', record_bytes)):
+        print(f"{name:<14} {used / 1e6:>9.1f} {used / args.matches:>12.0f}")
+    print(f"saved {1 - record_bytes / dict_bytes:.0%}")
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
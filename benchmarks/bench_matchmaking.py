@@ -0,0 +1,92 @@
+"""Opponent lookup with 100k queued players: linear list scan vs MatchmakingEngine.
+
+    python benchmarks/bench_matchmaking.py --queued 100000 --lookups 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from matchmaking import MAX_RATING_WINDOW, MatchmakingEngine  # noqa: E402
+from records import QueueEntry  # noqa: E402
+
+STAKES = (50, 100, 200, 500)
+
+
+def make_player(user_id):
+    return QueueEntry(user_id, random.choice(STAKES), f"user{user_id}", int(random.gauss(1000, 200)))
+
+
+def legacy_lookup(queue, player):
+    # The old handle_battle_stake loop: first exact-stake entry, popped from the middle.
+    for i, p in enumerate(queue):
+        if p.stake == player.stake and p.user_id != player.user_id:
+            return queue.pop(i)
+    return None
+
+
+def rating_aware_lookup(queue, player):
+    # What the linear queue would need to do to honour rating: scan every entry.
+    best, best_gap = None, None
+    for i, p in enumerate(queue):
+        if p.stake == player.stake and p.user_id != player.user_id:
+            gap = abs(p.rating - player.rating)
+            if best_gap is None or gap < best_gap:
+                best, best_gap = i, gap
+    return queue.pop(best) if best is not None else None
+
+
+def time_linear(lookup, queued, arrivals):
+    queue = list(queued)
+    start = time.perf_counter()
+    for player in arrivals:
+        if lookup(queue, player) is None:
+            queue.append(player)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queued', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    queued = [make_player(i) for i in range(args.queued)]
+    arrivals = [make_player(args.queued + i) for i in range(args.lookups)]
+
+    # The exhaustive scan is too slow to run for every arrival; sample 2%.
+    rating_lookups = max(1, args.lookups // 50)
+    first_fit = time_linear(legacy_lookup, queued, arrivals)
+    rating_scan = time_linear(rating_aware_lookup, queued, arrivals[:rating_lookups])
+
+    engine = MatchmakingEngine(base_window=MAX_RATING_WINDOW)
+    start = time.perf_counter()
+    for player in queued:
+        engine.enqueue(player)
+    fill = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gaps = []
+    for player in arrivals:
+        opponent = engine.pop_opponent(player)
+        if opponent is None:
+            engine.enqueue(player)
+        else:
+            gaps.append(abs(opponent.rating - player.rating))
+    indexed = time.perf_counter() - start
+
+    print(f"{args.queued} queued players, {args.lookups} arrivals")
+    print(f"linear first-fit (legacy) {args.lookups / first_fit:>10.0f} lookups/sec  (ignores rating)")
+    print(f"linear closest-rating     {rating_lookups / rating_scan:>10.0f} lookups/sec")
+    print(f"matchmaking engine        {args.lookups / indexed:>10.0f} lookups/sec")
+    print(f"engine fill               {args.queued / fill:>10.0f} enqueues/sec")
+    if gaps:
+        print(f"engine mean rating gap    {sum(gaps) / len(gaps):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
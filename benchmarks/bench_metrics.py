@@ -0,0 +1,115 @@
+"""Cost of the hot-path instrumentation: per statement, per observation, and end to end.
+
+The micro part times a primary-key SELECT on a plain sqlite3 connection
+and on a metrics.TimedConnection (which times METRICS_SAMPLE_RATE of
+them), and Histogram.observe on its own. The end-to-end part runs
+bench_handlers.py with METRICS_ENABLED=1 and =0 back to back, --rounds
+times, switching which goes first. Run-to-run noise is larger than the
+cost measured, so each round's pair gives one overhead figure and the
+median of those is reported, per handler and for all of them together.
+
+    python benchmarks/bench_metrics.py --rounds 9 --users 2000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import metrics  # noqa: E402
+
+
+def per_call(function, calls: int) -> float:
+    """Best of five runs of calls calls, in microseconds per call."""
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e6
+
+
+def statement_cost(path: str, calls: int) -> dict:
+    results = {}
+    for name, factory in (('plain', sqlite3.Connection), ('timed', metrics.TimedConnection)):
+        conn = sqlite3.connect(path, isolation_level=None, factory=factory)
+        results[name] = per_call(lambda: conn.execute("SELECT tokens FROM users WHERE id = ?", (4242,)).fetchone(),
+                                 calls)
+        conn.close()
+    histogram = metrics.Histogram()
+    results['observe'] = per_call(lambda: histogram.observe(0.0003), calls)
+    return results
+
+
+def handler_run(enabled: bool, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        out = f.name
+    env = dict(os.environ, METRICS_ENABLED='1' if enabled else '0')
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'bench_handlers.py'), '--users', str(args.users),
+         '--workers', str(args.workers), '--backend', args.backend, '--api-latency', str(args.api_latency),
+         '--baseline', out, '--update-baseline'],
+        env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    with open(out) as f:
+        results = json.load(f)['handlers']
+    os.unlink(out)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=9)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds per stub Bot API call')
+    parser.add_argument('--calls', type=int, default=100000, help='statements per micro run')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'metrics.db')
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, tokens INTEGER)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", ((n, 100) for n in range(10000)))
+    conn.close()
+    micro = statement_cost(path, args.calls)
+    tmp.cleanup()
+    print(f"primary-key SELECT  plain {micro['plain']:.2f} µs, timed {micro['timed']:.2f} µs "
+          f"(+{micro['timed'] - micro['plain']:.2f} µs); Histogram.observe {micro['observe']:.2f} µs")
+
+    throughput = {True: {}, False: {}}
+    overheads = {}
+    for n in range(args.rounds):
+        paired = {}
+        for enabled in ((True, False) if n % 2 else (False, True)):
+            results = handler_run(enabled, args)
+            paired[enabled] = {name: result['throughput'] for name, result in results.items()}
+            # resolve_battle runs inside handle_battle_move, so its time is already counted there
+            phases = [result for name, result in results.items() if name != 'resolve_battle']
+            paired[enabled]['all handlers'] = (sum(result['calls'] for result in phases) /
+                                               sum(result['calls'] / result['throughput'] for result in phases))
+        for name, off in paired[False].items():
+            throughput[False].setdefault(name, []).append(off)
+            throughput[True].setdefault(name, []).append(paired[True][name])
+            overheads.setdefault(name, []).append(1 - paired[True][name] / off)
+
+    print(f"{args.users} users, {args.workers} workers, STATE_BACKEND={args.backend}, "
+          f"api latency {args.api_latency * 1000:g} ms, sample rate {metrics.METRICS_SAMPLE_RATE:g}, "
+          f"median of {args.rounds} rounds")
+    print(f"{'handler':<24} {'off per s':>10} {'on per s':>10} {'overhead':>9}")
+    for name, off in throughput[False].items():
+        print(f"{name:<24} {statistics.median(off):>10.0f} {statistics.median(throughput[True][name]):>10.0f} "
+              f"{statistics.median(overheads[name]):>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
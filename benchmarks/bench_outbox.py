@@ -0,0 +1,149 @@
+"""Battle resolution with results sent inline vs queued in the outbox.
+
+Finished games are resolved by a pool of handler threads. Inline, each
+resolution settles the payout and then sends both players' results
+itself, so every resolution pays two Bot API round trips. With the
+outbox, the results are queued in the payout's transaction and sent by
+the outbox sender, so resolution costs only local database time. A share
+of sends can fail with 502 to show retries; every result must still
+arrive exactly once.
+
+    python benchmarks/bench_outbox.py --battles 1000 --latency 0.05 --workers 8 --failure-rate 0.05
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram_standin import StandInBotAPI  # noqa: E402
+
+STAKE = 50
+
+
+def open_games(db, run, battles: int) -> dict:
+    """Seed two players per battle and open each game with both moves made; returns {game_id: game}."""
+    db.execute("DELETE FROM users")
+    run.user_cache.cache.clear()
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, 1000, '', 0, 0, 1000)",
+        ((user_id,) for user_id in range(1, 2 * battles + 1))
+    )
+    games = {}
+    for battle in range(1, battles + 1):
+        p1, p2 = 2 * battle - 1, 2 * battle
+        game_id = run.match_ids.next()
+        game = run.open_match(game_id,
+                              run.records.QueueEntry(p1, STAKE, f"Player{p1}", 1000),
+                              run.records.QueueEntry(p2, STAKE, f"Player{p2}", 1000),
+                              STAKE)
+        game.record_move(p1, 'rock')
+        game.record_move(p2, 'scissors')
+        games[game_id] = run.active_matches.pop(game_id)
+    return games
+
+
+def resolve_inline(run, bot, game_id: int, game) -> None:
+    """The pre-outbox path: settle, then send both results from the resolving thread."""
+    result_message, p1_tokens, p2_tokens = run.settle_battle(game)
+    for user_id, tokens in zip(game.player_ids, (p1_tokens, p2_tokens)):
+        bot.send_message(user_id, result_message + f"\n\nYour new balance is {tokens} tokens.",
+                         reply_markup=run.get_main_menu_keyboard())
+
+
+def run_mode(mode: str, args) -> dict:
+    from telegram import Bot
+
+    import db
+    import outbox
+    import run
+
+    games = open_games(db, run, args.battles)
+    delivered = Counter()
+    done = threading.Event()
+
+    def on_message(method, chat_id, params):
+        delivered[chat_id] += 1
+        if len(delivered) == 2 * args.battles:
+            done.set()
+
+    api = StandInBotAPI(latency=args.latency, on_message=on_message,
+                        failure_rate=args.failure_rate if mode == 'outbox' else 0.0)
+    bot = Bot(api.token, base_url=api.base_url)
+    if mode == 'outbox':
+        outbox.sender.start(bot)
+
+    def resolve(game_id):
+        start = time.perf_counter()
+        if mode == 'outbox':
+            run.settle_and_notify_battle(game_id, games[game_id])
+        else:
+            resolve_inline(run, bot, game_id, games[game_id])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as handlers:
+        latencies = sorted(latency * 1000 for latency in handlers.map(resolve, games))
+    resolved = time.perf_counter() - start
+    done.wait(args.timeout)
+    elapsed = time.perf_counter() - start
+
+    stats = None
+    if mode == 'outbox':
+        outbox.sender.stop()
+        stats = outbox.sender.stats()
+    api.close()
+    return {
+        'latencies': latencies,
+        'resolved': resolved,
+        'elapsed': elapsed,
+        'delivered': sum(1 for count in delivered.values() if count),
+        'duplicates': sum(count - 1 for count in delivered.values() if count > 1),
+        'failures': api.failures,
+        'stats': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--battles', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated Bot API round trip, seconds')
+    parser.add_argument('--workers', type=int, default=8, help='handler threads resolving battles')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='share of outbox sends answered with 502')
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'outbox.db')
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+
+    print(f"{args.battles} battles resolved by {args.workers} threads, "
+          f"{args.latency * 1000:.0f} ms Bot API round trip, {args.failure_rate:.0%} outbox sends failing")
+    print(f"{'mode':<8} {'resolve p50':>12} {'resolve p95':>12} {'resolved/s':>11} "
+          f"{'all sent in':>12} {'delivered':>10} {'dupes':>6} {'502s':>5}")
+    for mode in ('inline', 'outbox'):
+        result = run_mode(mode, args)
+        cuts = statistics.quantiles(result['latencies'], n=100)
+        print(f"{mode:<8} {cuts[49]:>10.1f}ms {cuts[94]:>10.1f}ms {args.battles / result['resolved']:>11.0f} "
+              f"{result['elapsed']:>11.1f}s {result['delivered']:>10} {result['duplicates']:>6} {result['failures']:>5}")
+        if result['stats']:
+            print(f"         outbox: {result['stats']}")
+
+    writer.queue.stop()
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
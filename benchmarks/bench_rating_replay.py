@@ -0,0 +1,104 @@
+"""Recomputing every rating from game history: row-by-row migrations vs the vectorized replay.
+
+game_sessions is filled with random decided games between --players
+players, whose activity falls off with rank (--skew) as on a live bot;
+the busiest players' games set how many waves the replay needs. Three ways
+to recompute every rating with a new formula:
+
+  sql      a migration walking game_sessions and applying each result
+           with ratings.rate_result and two UPDATEs, as play does; timed
+           on the first --sql-games games and extrapolated
+  python   the same walk with ratings in a dict and no SQL (its best case)
+  replay   rating_replay.recompute_ratings, including reading the history
+           and writing every rating back
+
+python and replay must end on identical ratings.
+
+    python benchmarks/bench_rating_replay.py --games 1000000 --players 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--sql-games', type=int, default=50000, help='games timed for the sql migration')
+    parser.add_argument('--k', type=float, default=32)
+    parser.add_argument('--skew', type=float, default=0.7,
+                        help='activity ~ rank ** -skew; at 0.7 the busiest of 20000 players has 1.6%% of all games')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'history.db')
+    import db
+    import migrations
+    import ratings
+    import rating_replay
+
+    migrations.migrate(db.pool)
+    rng = random.Random(1)
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, 100, '', 0, 0, 1000)",
+        ((user_id,) for user_id in range(1, args.players + 1))
+    )
+    weights = [rank ** -args.skew for rank in range(1, args.players + 1)]
+    games = []
+    for p1, p2 in zip(rng.choices(range(1, args.players + 1), weights, k=args.games),
+                      rng.choices(range(1, args.players + 1), weights, k=args.games)):
+        if p1 == p2:
+            p2 = p2 % args.players + 1
+        games.append((p1, p2, 50, 'completed', rng.choice((p1, p2)), ''))
+    db.executemany(
+        "INSERT INTO game_sessions (player1_id, player2_id, stake, status, winner_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        games
+    )
+
+    start = time.perf_counter()
+    for p1, p2, _, _, winner, _ in games[:args.sql_games]:
+        loser = p2 if winner == p1 else p1
+        with db.transaction() as c:
+            change = ratings.rate_result(winner, loser, args.k)
+            c.execute("UPDATE users SET rating = rating + ? WHERE id = ?", (change, winner))
+            c.execute("UPDATE users SET rating = rating - ? WHERE id = ?", (change, loser))
+    sql = (time.perf_counter() - start) * args.games / min(args.sql_games, args.games)
+
+    start = time.perf_counter()
+    rows = db.fetchall("SELECT player1_id, player2_id, winner_id FROM game_sessions WHERE winner_id IS NOT NULL ORDER BY id")
+    rating = {}
+    for p1, p2, winner in rows:
+        loser = p2 if winner == p1 else p1
+        change = ratings.rating_change(rating.get(winner, ratings.INITIAL_RATING),
+                                       rating.get(loser, ratings.INITIAL_RATING), args.k)
+        rating[winner] = rating.get(winner, ratings.INITIAL_RATING) + change
+        rating[loser] = rating.get(loser, ratings.INITIAL_RATING) - change
+    python = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = rating_replay.recompute_ratings(args.k, write=True)
+    replay = time.perf_counter() - start
+
+    stored = dict(db.fetchall("SELECT id, rating FROM users"))
+    mismatched = sum(1 for user_id, value in rating.items() if stored[user_id] != value)
+    waves = int(rating_replay.waves(*rating_replay.load_history()).max()) + 1
+
+    print(f"{result['games']} games, {result['players']} players, skew {args.skew:g}, K={args.k:g}, {waves} waves")
+    print(f"sql         {sql:>7.2f} s  (extrapolated from {min(args.sql_games, args.games)} games)")
+    print(f"python      {python:>7.2f} s  (ratings in a dict, nothing written)")
+    print(f"replay      {replay:>7.2f} s  (load {result['load_seconds']:.2f} s, "
+          f"replay {result['replay_seconds']:.2f} s, then every rating written)")
+    print(f"mismatched  {mismatched:>7} ratings, python vs replay")
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Referral redemption at 1M users: unindexed lookup vs the unique index.
+
+Builds a users table with a referral code for every user, then times the
+old full-scan lookup and the full single-transaction redemption.
+
+    python benchmarks/bench_referrals.py --users 1000000 --redemptions 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--redemptions', type=int, default=2000)
+    parser.add_argument('--scans', type=int, default=20, help='unindexed lookups to time')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'referrals.db')
+    os.environ['WRITE_BEHIND_MODE'] = 'sync'
+    import db
+    import referrals
+
+    conn = db.get_db()
+    conn.execute('''CREATE TABLE users
+                    (id INTEGER PRIMARY KEY, tokens INTEGER DEFAULT 100, last_daily TEXT DEFAULT '',
+                     wins INTEGER DEFAULT 0, losses INTEGER DEFAULT 0, rating INTEGER DEFAULT 1000,
+                     character_class TEXT, referral_code TEXT, referrals INTEGER DEFAULT 0,
+                     used_referral INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE token_transactions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, amount INTEGER,
+                     transaction_type TEXT, timestamp TEXT)''')
+    start = time.perf_counter()
+    db.executemany(
+        "INSERT INTO users (id, referral_code) VALUES (?, ?)",
+        ((user_id, referrals.generate_referral_code(user_id)) for user_id in range(1, args.users + 1))
+    )
+    print(f"populated {args.users} users in {time.perf_counter() - start:.1f}s")
+
+    codes = [referrals.generate_referral_code(random.randint(1, args.users)) for _ in range(args.redemptions)]
+
+    start = time.perf_counter()
+    for code in codes[:args.scans]:
+        db.fetchone("SELECT id FROM users WHERE referral_code = ?", (code,))
+    scan = (time.perf_counter() - start) / args.scans
+
+    start = time.perf_counter()
+    conn.execute("CREATE UNIQUE INDEX idx_users_referral_code ON users (referral_code)")
+    index_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for code in codes:
+        db.fetchone("SELECT id FROM users WHERE referral_code = ?", (code,))
+    lookup = (time.perf_counter() - start) / len(codes)
+
+    # Referees are fresh users so every redemption succeeds
+    db.executemany("INSERT INTO users (id) VALUES (?)", ((-i,) for i in range(1, len(codes) + 1)))
+    start = time.perf_counter()
+    outcomes = [referrals.redeem(-i, code) for i, code in enumerate(codes, 1)]
+    redeem = (time.perf_counter() - start) / len(codes)
+
+    print(f"unindexed lookup     {scan * 1000:>10.2f} ms")
+    print(f"unique index build   {index_build:>10.2f} s")
+    print(f"indexed lookup       {lookup * 1000:>10.3f} ms")
+    print(f"full redemption      {redeem * 1000:>10.3f} ms  ({1 / redeem:.0f}/s, "
+          f"{outcomes.count(referrals.REDEEMED)}/{len(outcomes)} redeemed)")
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Reply markup build cost: building telegram objects per reply vs the render cache.
+
+"Before" runs each keyboard's original builder and serializes the result,
+which is what every reply paid when the markup objects were built per
+request and turned into JSON by the Bot. "After" is the cached or
+templated JSON that the handlers now send.
+
+    python benchmarks/bench_render.py --number 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def cases(run) -> list:
+    """(name, before, after) callables producing the same reply markup JSON."""
+    player1 = run.records.QueueEntry(1, 50, "Player1")
+    player2 = run.records.QueueEntry(2, 50, "Player2")
+    tournament = run.records.Tournament(42, 1, 100, "")
+    tournament.players.extend([2, 3])
+    tournament.prize_pool = 300
+    game_ids = iter(range(1000000, 10 ** 9))
+
+    def battle_start_before():
+        game_id = next(game_ids)
+        message = run.battle_start_view(game_id, player1, player2, 50)[0]
+        return message, run.battle_move_keyboard.build(game_id).to_json()
+
+    return [
+        ('main menu', lambda: run.get_main_menu_keyboard.__wrapped__().to_json(), run.get_main_menu_keyboard),
+        ('stake keyboard', lambda: run.get_stake_keyboard.__wrapped__().to_json(), run.get_stake_keyboard),
+        ('class list', lambda: run.class_list_view.__wrapped__('mage'),
+         lambda: run.character_classes_view({'character_class': 'mage'})),
+        ('battle start', battle_start_before,
+         lambda: run.battle_start_view(next(game_ids), player1, player2, 50)),
+        ('tournament view', lambda: (run.tournament_view(tournament)[0], run.tournament_keyboard.build(42).to_json()),
+         lambda: run.tournament_view(tournament)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='builds timed per case')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'render.db')
+    import run
+
+    print(f"{'reply':<16} {'before µs':>10} {'after µs':>9} {'speedup':>8}")
+    for name, before, after in cases(run):
+        assert str(before()) and str(after())
+        before_us = min(timeit.repeat(before, number=args.number, repeat=3)) / args.number * 1e6
+        after_us = min(timeit.repeat(after, number=args.number, repeat=3)) / args.number * 1e6
+        print(f"{name:<16} {before_us:>10.2f} {after_us:>9.2f} {before_us / after_us:>7.1f}x")
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
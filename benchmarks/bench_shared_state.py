@@ -0,0 +1,130 @@
+"""Several bot processes sharing game state through game.db (STATE_BACKEND=sqlite).
+
+Every process runs the real matchmaking and move-recording code against the
+same database file. Players are spread round-robin across processes and
+all tap a stake at once, so most opponents are waiting in another process;
+then every process taps both moves of every open match, so each move
+races its duplicates. Consistent means every player ends up in exactly one
+battle and every match is resolved exactly once.
+
+    python benchmarks/bench_shared_state.py --players 2000 --processes 1 2 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STAKE = 50
+
+
+def worker(db_path: str, index: int, processes: int, players: int, barrier, results) -> None:
+    os.environ['GAME_DB_PATH'] = db_path
+    os.environ['STATE_BACKEND'] = 'sqlite'
+    import records
+    import run
+
+    mine = range(1 + index, players + 1, processes)
+    barrier.wait()
+    start = time.perf_counter()
+    pairs = []
+    for user_id in mine:
+        player = records.QueueEntry(user_id, STAKE, f"Player{user_id}", 1000)
+        opponent, _ = run.matchmaking_queue.pop_opponent_or_enqueue(player)
+        if opponent:
+            run.open_match(run.match_ids.next(), player, opponent, STAKE)
+            pairs.append((user_id, opponent.user_id))
+    matchmaking = time.perf_counter() - start
+
+    barrier.wait()
+    games = [(game_id, *game.player_ids) for game_id, game in run.active_matches.items()]
+    taps = [(game_id, user_id) for game_id, p1, p2 in games for user_id in (p1, p2)]
+    random.Random(index).shuffle(taps)
+    barrier.wait()
+    start = time.perf_counter()
+    outcomes = {}
+    for game_id, user_id in taps:
+        outcome, _ = run.record_move(game_id, user_id, 'rock')
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome == 'both_moved' and run.active_matches.pop(game_id) is not None:
+            outcomes['resolved'] = outcomes.get('resolved', 0) + 1
+    moves = time.perf_counter() - start
+
+    results.put({
+        'pairs': pairs,
+        'matchmaking': matchmaking,
+        'taps': len(taps),
+        'moves': moves,
+        'outcomes': outcomes,
+    })
+
+
+def run_processes(processes: int, players: int) -> dict:
+    tmp = tempfile.TemporaryDirectory()
+    db_path = os.path.join(tmp.name, 'shared.db')
+    os.environ['GAME_DB_PATH'] = db_path
+    os.environ['STATE_BACKEND'] = 'sqlite'
+    import db
+    import migrations
+
+    pool = db.ConnectionPool(db_path)
+    migrations.migrate(pool)
+    pool.close_all()
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [
+        context.Process(target=worker, args=(db_path, index, processes, players, barrier, results))
+        for index in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    reports = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    pool = db.ConnectionPool(db_path)
+    left_waiting = pool.connection().execute("SELECT COUNT(*) FROM matchmaking_entries").fetchone()[0]
+    pool.close_all()
+    tmp.cleanup()
+
+    paired = [user_id for report in reports for pair in report['pairs'] for user_id in pair]
+    outcomes = {}
+    for report in reports:
+        for outcome, count in report['outcomes'].items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+    return {
+        'paired': len(paired),
+        'double_booked': len(paired) - len(set(paired)),
+        'left_waiting': left_waiting,
+        'battles': len(paired) // 2,
+        'matchmaking': max(report['matchmaking'] for report in reports),
+        'taps': sum(report['taps'] for report in reports),
+        'moves': max(report['moves'] for report in reports),
+        'resolved': outcomes.get('resolved', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f"{args.players} players at one stake and rating, shared through one game.db")
+    print(f"{'processes':>9} {'queue ops/s':>12} {'double-booked':>14} {'left waiting':>13} "
+          f"{'move taps/s':>12} {'battles':>8} {'resolved':>9}")
+    for processes in args.processes:
+        result = run_processes(processes, args.players)
+        print(f"{processes:>9} {args.players / result['matchmaking']:>12.0f} {result['double_booked']:>14} "
+              f"{result['left_waiting']:>13} {result['taps'] / result['moves']:>12.0f} "
+              f"{result['battles']:>8} {result['resolved']:>9}")
+
+
+if __name__ == '__main__':
+    main()
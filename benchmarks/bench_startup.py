@@ -0,0 +1,70 @@
+"""Startup cost of setup_database() as the database grows.
+
+For each size, builds a database with that many users and a matching
+transaction history, reopens it cold and times the migration check. The
+leaderboard rebuild, which now runs in the background, is timed alongside.
+
+    python benchmarks/bench_startup.py --sizes 0 100000 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db  # noqa: E402
+import leaderboard  # noqa: E402
+import migrations  # noqa: E402
+
+
+def populate(pool, users):
+    with pool.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO users (id, tokens, rating) VALUES (?, ?, ?)",
+            ((i, 100 + i % 977, 1000 + i % 389) for i in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO token_transactions (user_id, amount, transaction_type, timestamp) VALUES (?, 50, 'daily_bonus', '')",
+            ((i,) for i in range(1, users + 1))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'db size':>10} {'first run':>11} {'restart':>10} {'board load':>11}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'game.db')
+            pool = db.ConnectionPool(path)
+            start = time.perf_counter()
+            migrations.migrate(pool)
+            first_run = time.perf_counter() - start
+            populate(pool, size)
+            pool.close_all()
+
+            # Cold restart: new connection, schema already current
+            pool = db.ConnectionPool(path)
+            start = time.perf_counter()
+            migrations.migrate(pool)
+            restart = time.perf_counter() - start
+
+            db.pool, saved = pool, db.pool
+            start = time.perf_counter()
+            leaderboard.Leaderboard('tokens').load()
+            board_load = time.perf_counter() - start
+            db.pool = saved
+            pool.close_all()
+
+            megabytes = os.path.getsize(path) / 1e6
+            print(f"{size:>10} {megabytes:>8.1f}MB {first_run * 1000:>9.1f}ms {restart * 1000:>8.2f}ms "
+                  f"{board_load * 1000:>9.0f}ms")
+    print("restart is the blocking startup cost; board load runs on a background thread")
+
+
+if __name__ == '__main__':
+    main()
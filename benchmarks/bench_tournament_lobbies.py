@@ -0,0 +1,130 @@
+"""How long players wait for their tournament to start: one lobby per request vs fullest-first quick join.
+
+Players ask for a tournament at random times (a Poisson stream in virtual
+seconds). Before: a share of them open a new tournament with /tournament
+and the rest join one of the open lobbies they were shown, picked at
+random. After: every request is queued and fill_tournament_lobbies seats
+it in the fullest open lobby once a second. Both sides go through the
+real run.py functions; the wait is from the request until the player's
+bracket starts, counted only for tournaments that filled in the run.
+
+    python benchmarks/bench_tournament_lobbies.py --players 20000 --rate 20 --creator-share 0.3
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+START_TOKENS = 1000
+
+
+def arrivals(players: int, rate: float, seed: int) -> list:
+    rng = random.Random(seed)
+    now, times = 0.0, []
+    for _ in range(players):
+        now += rng.expovariate(rate)
+        times.append(now)
+    return times
+
+
+def run_before(run, times: list, first_user: int, creator_share: float, seed: int):
+    """Each request opens a tournament or joins a random open one; full ones start at once."""
+    rng = random.Random(seed)
+    open_ids, started = [], {}
+    for user_id, arrived in enumerate(times, start=first_user):
+        tournament_id = None
+        if open_ids and rng.random() >= creator_share:
+            tournament_id = rng.choice(open_ids)
+            assert run.reserve_tournament_seat(tournament_id, user_id) is None
+            run.join_tournament(tournament_id, user_id)
+        else:
+            tournament_id = run.open_tournament(user_id).id
+            open_ids.append(tournament_id)
+        if run.claim_tournament_start(tournament_id):
+            run.start_tournament_round(tournament_id)
+            open_ids.remove(tournament_id)
+            started[tournament_id] = arrived
+    for tournament_id in open_ids:
+        run.tournament_lobbies.remove(tournament_id)
+    return started, len(open_ids)
+
+
+def run_after(run, times: list, first_user: int, tick: float):
+    """Every request is queued and seated by the once-a-tick fill job."""
+    started = {}
+    # Seating runs on the handler executor, so a start is spotted by the status it leaves behind
+    done = {tournament_id for tournament_id, tournament in run.active_tournaments.items()
+            if tournament.status != 'registering'}
+    pending = iter(enumerate(times, start=first_user))
+    user_id, arrived = next(pending)
+    now = 0.0
+    while user_id is not None:
+        now += tick
+        while user_id is not None and arrived <= now:
+            run.request_tournament_seat(user_id)
+            user_id, arrived = next(pending, (None, None))
+        run.fill_tournament_lobbies()
+        run.handler_executor.wait_idle()
+        for tournament_id, tournament in run.active_tournaments.items():
+            if tournament.status != 'registering' and tournament_id not in done:
+                done.add(tournament_id)
+                started[tournament_id] = now
+    return started, len(run.tournament_lobbies)
+
+
+def waits(run, times: list, first_user: int, started: dict) -> list:
+    return [
+        start - times[user_id - first_user]
+        for tournament_id, start in started.items()
+        for user_id in run.active_tournaments.get(tournament_id).entrants
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=20, help='tournament requests per second')
+    parser.add_argument('--creator-share', type=float, default=0.3,
+                        help='before: share of requests that open a new tournament')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'lobbies.db')
+    os.environ['STATE_BACKEND'] = 'memory'
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+    # Separate players for each side, so nobody is still seated from the other run
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, ?, '', 0, 0, 1000)",
+        ((user_id, START_TOKENS) for user_id in range(1, 2 * args.players + 1))
+    )
+
+    times = arrivals(args.players, args.rate, args.seed)
+    print(f"{args.players} players, {args.rate:g} requests/s, creator share {args.creator_share:g} before")
+    print(f"{'':<8} {'started':>8} {'open':>6} {'median s':>9} {'p95 s':>8} {'max s':>8}")
+    for side, first_user in (('before', 1), ('after', args.players + 1)):
+        if side == 'before':
+            started, still_open = run_before(run, times, first_user, args.creator_share, args.seed)
+        else:
+            started, still_open = run_after(run, times, first_user, run.TOURNAMENT_FILL_TICK_SECONDS)
+        waited = sorted(waits(run, times, first_user, started))
+        p95 = waited[int(len(waited) * 0.95)]
+        print(f"{side:<8} {len(started):>8} {still_open:>6} {statistics.median(waited):>9.1f} "
+              f"{p95:>8.1f} {waited[-1]:>8.1f}")
+    run.handler_executor.stop()
+    writer.queue.stop()
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Many simultaneous 8-player tournaments played to the end through the bracket engine.
+
+Every tournament is created and filled through the real run.py functions,
+then handler threads tap both moves of every live tournament match at once,
+as players would. Each result is reported to its bracket as it lands, so
+the rounds of different tournaments overlap; draws are replayed. Consistent
+means every tournament paid out its whole prize pool exactly once (so the
+total token supply is unchanged) and every entrant got the final results.
+
+    python benchmarks/bench_tournaments.py --tournaments 10000 --workers 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+PLAYERS = 8
+START_TOKENS = 1000
+MOVES = ('rock', 'paper', 'scissors')
+
+
+def fill(run, tournaments: int) -> list:
+    """Create every tournament and seat its other seven players; returns the tournament ids."""
+    ids = []
+    for t in range(tournaments):
+        creator = 1 + t * PLAYERS
+        tournament = run.open_tournament(creator, f"Player{creator}")
+        for user_id in range(creator + 1, creator + PLAYERS):
+            assert run.reserve_tournament_seat(tournament.id, user_id, f"Player{user_id}") is None
+            run.join_tournament(tournament.id, user_id)
+        ids.append(tournament.id)
+    return ids
+
+
+def play(run, game_id: int, rng: random.Random) -> int:
+    """Tap both moves of one match, as its two players would; returns 1 if it resolved here."""
+    game = run.active_matches.get(game_id)
+    if game is None:
+        return 0
+    for user_id in game.player_ids:
+        outcome, _ = run.record_move(game_id, user_id, rng.choice(MOVES))
+        if outcome == 'both_moved':
+            run.resolve_battle(None, game_id)
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tournaments', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=8, help='handler threads tapping moves')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory', help='STATE_BACKEND')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['GAME_DB_PATH'] = os.path.join(tmp.name, 'tournaments.db')
+    os.environ['STATE_BACKEND'] = args.backend
+    import db
+    import run
+    import writer
+
+    run.setup_database()
+    writer.queue.start()
+    users = args.tournaments * PLAYERS
+    db.executemany(
+        "INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, ?, '', 0, 0, 1000)",
+        ((user_id, START_TOKENS) for user_id in range(1, users + 1))
+    )
+
+    start = time.perf_counter()
+    ids = fill(run, args.tournaments)
+    seated = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for tournament_id in ids:
+        assert run.claim_tournament_start(tournament_id)
+        run.start_tournament_round(tournament_id)
+    started = time.perf_counter() - start
+
+    local = threading.local()
+
+    def tap(game_id):
+        if not hasattr(local, 'rng'):
+            local.rng = random.Random(threading.get_ident())
+        return play(run, game_id, local.rng)
+
+    # Every live match is tapped in each wave; a match paired by a result in
+    # this wave is played in the next, whatever state other tournaments are in
+    waves = resolved = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as handlers:
+        while True:
+            live = list(run.active_matches.keys())
+            if not live:
+                break
+            waves += 1
+            resolved += sum(handlers.map(tap, live, chunksize=64))
+    played = time.perf_counter() - start
+    writer.queue.stop()
+
+    conn = db.pool.connection()
+    supply = conn.execute("SELECT SUM(tokens) FROM users").fetchone()[0]
+    finals = conn.execute("SELECT COUNT(*) FROM outbox WHERE dedup_key LIKE 'tournament:%:end:%'").fetchone()[0]
+    prizes = conn.execute(
+        "SELECT COUNT(*), SUM(amount) FROM token_transactions WHERE transaction_type = 'tournament_prize'"
+    ).fetchone()
+
+    print(f"{args.tournaments} tournaments x {PLAYERS} players, {args.workers} threads, STATE_BACKEND={args.backend}")
+    print(f"seated     {users / seated:>9.0f} joins/s     ({seated:.1f} s)")
+    print(f"round 1    {args.tournaments / started:>9.0f} starts/s    ({started:.1f} s)")
+    print(f"played     {resolved / played:>9.0f} matches/s   ({resolved} matches incl. replayed draws, "
+          f"{waves} waves, {played:.1f} s)")
+    print(f"unsettled  {len(run.active_tournaments):>9}")
+    print(f"prizes     {prizes[0]:>9} paid, {prizes[1]} tokens of {args.tournaments * PLAYERS * 100} in pools")
+    print(f"supply     {supply - users * START_TOKENS:>+9} tokens vs start")
+    print(f"finals     {finals:>9} result messages queued for {users} entrants")
+    db.pool.close_all()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Local stand-in for the Telegram Bot API, used to replay traffic at the bot.
+
+Queued updates are served to getUpdates (polling) or pushed to a webhook
+URL in batches, so both ingestion modes see the same traffic. Replies to
+sendMessage/editMessageText are timestamped per chat for latency reporting,
+and an optional per-call latency stands in for the round trip to Telegram.
+A failure rate answers that share of sends with 502 Bad Gateway, to
+exercise retries.
+"""
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+TOKEN = '123456:standin'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Conquest', 'username': 'conquest_bot'}
+
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    """A private-chat message update; commands get their bot_command entity."""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'Player{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """An inline button tap on a message in the user's private chat."""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'Player{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': '',
+            },
+        },
+    }
+
+
+class _APIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        api = self.server.api
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        params = json.loads(body) if body else {}
+        if api.should_fail(method):
+            status, payload = 502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+        else:
+            status, payload = 200, {'ok': True, 'result': api.call(method, params)}
+        payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _APIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the async client opens many connections at once
+
+
+class StandInBotAPI:
+    def __init__(self, token: str = TOKEN, latency: float = 0.0, on_message=None,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.token = token
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failures = 0
+        self._random = random.Random(seed)
+        self.on_message = on_message  # on_message(method, chat_id, params) after each send/edit
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._message_ids = itertools.count(1)
+        self._replied = {}  # chat_id -> perf_counter of the first reply
+        self._replies = threading.Condition()
+        self._closing = False
+        self._pushers = []
+        self._httpd = _APIServer(('127.0.0.1', 0), _APIHandler)
+        self._httpd.api = self
+        threading.Thread(target=self._httpd.serve_forever, name='standin-api', daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._httpd.server_address[1]}/bot'
+
+    def push(self, update: dict) -> None:
+        with self._cond:
+            self._pending.append(update)
+            self._cond.notify_all()
+
+    def reply_time(self, chat_id: int):
+        return self._replied.get(chat_id)
+
+    def wait_for_replies(self, chat_ids, timeout: float = 60) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._replies:
+            while not all(chat_id in self._replied for chat_id in chat_ids):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._replies.wait(remaining)
+        return True
+
+    def should_fail(self, method: str) -> bool:
+        if method != 'sendMessage' or not self.failure_rate:
+            return False
+        with self._replies:
+            if self._random.random() >= self.failure_rate:
+                return False
+            self.failures += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return True
+
+    def call(self, method: str, params: dict):
+        if self.latency and method != 'getUpdates':
+            time.sleep(self.latency)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            offset = params.get('offset')
+            return self._get_updates(None if offset is None else int(offset),
+                                     int(params.get('limit', 100)), float(params.get('timeout', 0)))
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            with self._replies:
+                self._replied.setdefault(chat_id, time.perf_counter())
+                self._replies.notify_all()
+            if self.on_message is not None:
+                self.on_message(method, chat_id, params)
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        return True  # deleteWebhook, setWebhook, answerCallbackQuery, ...
+
+    def _get_updates(self, offset, limit: int, timeout: float) -> list:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Updates below the offset have been acknowledged
+            while offset is not None and self._pending and self._pending[0]['update_id'] < offset:
+                self._pending.popleft()
+            while not self._pending and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(itertools.islice(self._pending, limit))
+
+    def start_pushing(self, url: str, batch_size: int = 100, connections: int = 4, secret_token: str = None) -> None:
+        """Deliver queued updates to a webhook, like Telegram does with max_connections."""
+        for i in range(connections):
+            thread = threading.Thread(target=self._push_loop, args=(url, batch_size, secret_token),
+                                      name=f'standin-push-{i}', daemon=True)
+            thread.start()
+            self._pushers.append(thread)
+
+    def _push_loop(self, url: str, batch_size: int, secret_token: str) -> None:
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port)
+        headers = {'Content-Type': 'application/json'}
+        if secret_token:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if self._closing:
+                    break
+                batch = [self._pending.popleft() for _ in range(min(batch_size, len(self._pending)))]
+            body = json.dumps(batch if batch_size > 1 else batch[0])
+            conn.request('POST', parts.path, body=body, headers=headers)
+            conn.getresponse().read()
+        conn.close()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for thread in self._pushers:
+            thread.join()
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,90 @@
+import random
+
+from records import Match, QueueEntry, Tournament
+
+# Prize pool shares: the winner, the runner-up, and the semi-finalists
+# (the losers of the round before the final), who split theirs
+WINNER_SHARE = 0.7
+RUNNER_UP_SHARE = 0.2
+SEMIFINAL_SHARE = 0.1
+
+# record_result outcomes
+STALE = 'stale'
+RECORDED = 'recorded'
+ROUND_COMPLETE = 'round_complete'
+FINISHED = 'finished'
+
+
+def matches_needed(tournament: Tournament) -> int:
+    """How many match ids the next round will use."""
+    return len(tournament.players) // 2
+
+
+def pair_round(tournament: Tournament, match_ids: list, now: float, rng=random) -> list:
+    """Start the next round by pairing the remaining players at random; returns its matches.
+
+    match_ids must hold matches_needed(tournament) fresh ids. An odd player
+    out gets a bye into the following round.
+    """
+    players = list(tournament.players)
+    if len(players) < 2:
+        return []
+    if not tournament.entrants:
+        tournament.entrants = tuple(players)
+    tournament.round += 1
+    rng.shuffle(players)
+    matches = [
+        Match(match_id, QueueEntry(p1, 0, tournament.name_of(p1)), QueueEntry(p2, 0, tournament.name_of(p2)), 0, now,
+              tournament_id=tournament.id, round=tournament.round)
+        for match_id, p1, p2 in zip(match_ids, players[0::2], players[1::2])
+    ]
+    tournament.pending = {match.id for match in matches}
+    tournament.advancing = [players[-1]] if len(players) % 2 else []
+    tournament.eliminated.append([])
+    tournament.matches.extend(tournament.pending)
+    return matches
+
+
+def replace_match(tournament: Tournament, match_id: int, replay_id: int) -> bool:
+    """Swap an unfinished match for its replay, e.g. after a draw; False if it wasn't pending."""
+    if match_id not in tournament.pending:
+        return False
+    tournament.pending.discard(match_id)
+    tournament.pending.add(replay_id)
+    tournament.matches.append(replay_id)
+    return True
+
+
+def record_result(tournament: Tournament, match_id: int, winner_id, loser_id) -> str:
+    """Record one match of the current round; returns what the tournament needs next.
+
+    RECORDED while other matches of the round are still running,
+    ROUND_COMPLETE when the next round can be paired, FINISHED once one
+    player is left, and STALE for a match that isn't pending (already
+    reported, or replaced). Exactly one result completes each round.
+    """
+    if match_id not in tournament.pending:
+        return STALE
+    tournament.pending.discard(match_id)
+    tournament.advancing.append(winner_id)
+    tournament.eliminated[-1].append(loser_id)
+    if tournament.pending:
+        return RECORDED
+    tournament.players, tournament.advancing = tournament.advancing, []
+    if len(tournament.players) == 1:
+        tournament.status = "finished"
+        return FINISHED
+    return ROUND_COMPLETE
+
+
+def payouts(tournament: Tournament) -> list:
+    """[(user_id, prize, place)] for a finished tournament, where place is 1, 2 or 3 (semi-finalist)."""
+    pool = tournament.prize_pool
+    prizes = [(tournament.players[0], int(pool * WINNER_SHARE), 1)]
+    rounds = tournament.eliminated
+    if rounds and rounds[-1]:
+        prizes.extend((user_id, int(pool * RUNNER_UP_SHARE), 2) for user_id in rounds[-1])
+    if len(rounds) >= 2 and rounds[-2]:
+        share = int(pool * SEMIFINAL_SHARE / len(rounds[-2]))
+        prizes.extend((user_id, share, 3) for user_id in rounds[-2])
+    return prizes
@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from telegram.error import RetryAfter, TelegramError, Unauthorized
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second across all chats.
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '30'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+CHUNK_SIZE = 500
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a send is allowed."""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = self.clock()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for a while, e.g. after Telegram's RetryAfter."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self.clock() + seconds)
+            self._tokens = 0
+            self._updated = self._blocked_until
+
+
+bucket = TokenBucket(BROADCAST_RATE)
+_executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast')
+progress = {}  # broadcast id -> live counters for running broadcasts
+_progress_lock = threading.Lock()
+
+
+def start(bot, text: str) -> int:
+    """Create a broadcast to every user and send it in the background; returns its id."""
+    broadcast_id = db.execute(
+        "INSERT INTO broadcasts (message, last_user_id, sent, failed, status, created_at) VALUES (?, 0, 0, 0, 'running', ?)",
+        (text, datetime.now().isoformat())
+    ).lastrowid
+    _spawn(bot, broadcast_id)
+    return broadcast_id
+
+
+def resume_pending(bot) -> list:
+    """Restart broadcasts interrupted by a shutdown from their last checkpoint."""
+    pending = [row[0] for row in db.fetchall("SELECT id FROM broadcasts WHERE status = 'running'")]
+    for broadcast_id in pending:
+        _spawn(bot, broadcast_id)
+    return pending
+
+
+def _spawn(bot, broadcast_id: int) -> None:
+    threading.Thread(target=_run_thread, args=(bot, broadcast_id), name=f'broadcast-{broadcast_id}',
+                     daemon=True).start()
+
+
+def _run_thread(bot, broadcast_id: int) -> None:
+    try:
+        run(bot, broadcast_id)
+    finally:
+        # The thread ends with the broadcast, so its pooled connection goes with it
+        db.pool.close_thread()
+
+
+def run(bot, broadcast_id: int) -> dict:
+    """Send a broadcast chunk by chunk, checkpointing after each chunk.
+
+    Delivery is at-least-once: a restart resends the chunk that was in
+    flight when the process stopped.
+    """
+    text, last_user_id, sent, failed = db.fetchone(
+        "SELECT message, last_user_id, sent, failed FROM broadcasts WHERE id = ?", (broadcast_id,)
+    )
+    stats = progress[broadcast_id] = {'sent': sent, 'failed': failed, 'retried': 0, 'started': time.monotonic()}
+
+    while True:
+        # Keyset pagination streams recipients without holding a read open
+        chunk = [row[0] for row in db.fetchall(
+            "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (last_user_id, CHUNK_SIZE)
+        )]
+        if not chunk:
+            break
+        for delivered in _executor.map(lambda user_id: _send(bot, user_id, text, stats), chunk):
+            stats['sent' if delivered else 'failed'] += 1
+        last_user_id = chunk[-1]
+        db.execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ? WHERE id = ?",
+            (last_user_id, stats['sent'], stats['failed'], broadcast_id)
+        )
+
+    elapsed = time.monotonic() - stats['started']
+    attempted = stats['sent'] + stats['failed'] - sent - failed  # this run only, not the resumed part
+    db.execute(
+        "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?",
+        (datetime.now().isoformat(), broadcast_id)
+    )
+    stats['elapsed'] = elapsed
+    logger.info(
+        "Broadcast %d finished: %d sent, %d failed, %d retried in %.1fs (%.1f msg/s)",
+        broadcast_id, stats['sent'], stats['failed'], stats['retried'], elapsed,
+        attempted / elapsed if elapsed else 0.0
+    )
+    return progress.pop(broadcast_id)
+
+
+def _send(bot, user_id: int, text: str, stats: dict) -> bool:
+    for _ in range(MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            bot.send_message(user_id, text)
+            return True
+        except RetryAfter as e:
+            # Flood limit hit: hold every sender, not just this one
+            bucket.pause(e.retry_after)
+            with _progress_lock:
+                stats['retried'] += 1
+        except Unauthorized:
+            return False  # user blocked the bot
+        except TelegramError as e:
+            logger.warning("Broadcast to %s failed: %s", user_id, e)
+            return False
+    return False
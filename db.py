@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv('GAME_DB_PATH', 'game.db')
+
+# Applied to every new connection. WAL lets readers run alongside the single
+# writer, and synchronous=NORMAL is durable across app crashes in WAL mode.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),       # ~16 MB page cache per connection
+    ('mmap_size', 268435456),     # 256 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+)
+
+# Number of prepared statements sqlite3 keeps per connection.
+STATEMENT_CACHE_SIZE = 256
+
+# Every outermost transaction is timed; statements only by sample (see metrics.TimedConnection)
+_transaction_seconds = metrics.transaction_histogram() if metrics.METRICS_ENABLED else None
+
+
+class ConnectionPool:
+    """One persistent SQLite connection per worker thread."""
+
+    def __init__(self, path: str = DB_PATH, pragmas=PRAGMAS, statement_cache_size: int = STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.pragmas = pragmas
+        self.statement_cache_size = statement_cache_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,  # transactions are managed by transaction()
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            # times a sample of statements for the sqlite_statement_seconds histogram
+            factory=(metrics.TimedConnection if metrics.METRICS_ENABLED and metrics.METRICS_SAMPLE_RATE > 0
+                     else sqlite3.Connection),
+        )
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block in one write transaction; nested blocks join the outer one."""
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        self._local.pending = []
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            pending = self._local.pending
+            self._local.depth = 0
+            self._local.pending = []
+            if _transaction_seconds is not None:
+                _transaction_seconds.observe(time.perf_counter() - start)
+        for callback in pending:
+            callback()
+
+    def in_transaction(self) -> bool:
+        return bool(getattr(self._local, 'depth', 0))
+
+    def after_commit(self, callback) -> None:
+        """Run callback once the current transaction commits, or now if there is none."""
+        if not self.in_transaction():
+            callback()
+            return
+        self._local.pending.append(callback)
+
+    def close_thread(self) -> None:
+        """Close the calling thread's connection, e.g. before a short-lived thread exits."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self) -> None:
+        """Close every connection handed out by this pool."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+
+pool = ConnectionPool()
+
+
+def get_db() -> sqlite3.Connection:
+    return pool.connection()
+
+
+def transaction():
+    return pool.transaction()
+
+
+def after_commit(callback) -> None:
+    pool.after_commit(callback)
+
+
+def fetchone(sql: str, params=()):
+    return pool.connection().execute(sql, params).fetchone()
+
+
+def fetchall(sql: str, params=()):
+    return pool.connection().execute(sql, params).fetchall()
+
+
+def execute(sql: str, params=()) -> sqlite3.Cursor:
+    """Execute a single statement; it autocommits unless inside transaction()."""
+    return pool.connection().execute(sql, params)
+
+
+def executemany(sql: str, seq_of_params) -> sqlite3.Cursor:
+    with pool.transaction() as conn:
+        return conn.executemany(sql, seq_of_params)
@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedQueue:
+    """Per-key FIFO ordering for tasks that each hold one or more keys.
+
+    A task is runnable once it is at the head of the queue of every key it
+    holds. Queues are filled in submission order, so the oldest pending
+    task is always runnable and two tasks can never wait on each other.
+    Not thread-safe; callers serialize add() and done().
+    """
+
+    def __init__(self):
+        self._queues = {}  # key -> deque of tasks
+
+    def add(self, task) -> bool:
+        """Queue task behind earlier tasks on its keys; returns True if it can run now."""
+        for key in task.keys:
+            self._queues.setdefault(key, deque()).append(task)
+        return self._runnable(task)
+
+    def done(self, task) -> list:
+        """Release task's keys; returns the tasks that became runnable."""
+        heads = []
+        for key in task.keys:
+            pending = self._queues[key]
+            pending.popleft()
+            if pending:
+                heads.append(pending[0])
+            else:
+                del self._queues[key]
+        ready = []
+        for head in heads:
+            if head not in ready and self._runnable(head):
+                ready.append(head)
+        return ready
+
+    def _runnable(self, task) -> bool:
+        return all(self._queues[key][0] is task for key in task.keys)
+
+    def depth(self, key) -> int:
+        pending = self._queues.get(key)
+        return len(pending) if pending else 0
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+
+class KeyedStats:
+    """Queue depth and wait-time counters shared by the thread and asyncio executors."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.max_key_depth = 0
+        self.key_wait_total = 0.0
+        self.key_wait_max = 0.0
+        self.contended = 0  # tasks that had to wait behind another task on one of their keys
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+
+    def queued(self, depth: int, key_depth: int) -> None:
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, depth)
+        self.max_key_depth = max(self.max_key_depth, key_depth)
+
+    def started(self, key_wait: float, pool_wait: float) -> None:
+        self.key_wait_total += key_wait
+        self.key_wait_max = max(self.key_wait_max, key_wait)
+        if key_wait > 0:
+            self.contended += 1
+        self.pool_wait_total += pool_wait
+        self.pool_wait_max = max(self.pool_wait_max, pool_wait)
+
+    def snapshot(self, depth: int, active_keys: int) -> dict:
+        started = max(self.completed + self.failed, 1)
+        return {
+            'depth': depth,
+            'active_keys': active_keys,
+            'max_depth': self.max_depth,
+            'max_key_depth': self.max_key_depth,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'contended': self.contended,
+            'key_wait_avg_ms': self.key_wait_total / started * 1000,
+            'key_wait_max_ms': self.key_wait_max * 1000,
+            'pool_wait_avg_ms': self.pool_wait_total / started * 1000,
+            'pool_wait_max_ms': self.pool_wait_max * 1000,
+        }
+
+
+class KeyedTask:
+    __slots__ = ('keys', 'fn', 'args', 'submitted_at', 'ready_at')
+
+    def __init__(self, keys, fn, args, submitted_at):
+        self.keys = tuple(dict.fromkeys(keys))
+        self.fn = fn
+        self.args = args
+        self.submitted_at = submitted_at
+        self.ready_at = None
+
+
+class KeyedExecutor:
+    """Thread pool that runs tasks in order per key and in parallel across keys.
+
+    Workers only ever pick up runnable tasks, so a burst of taps from one
+    user queues behind that user without tying up the rest of the pool.
+    """
+
+    def __init__(self, workers: int = 8, name: str = 'keyed', clock=time.perf_counter):
+        self.workers = workers
+        self.name = name
+        self.clock = clock
+        self.counters = KeyedStats()
+        self._order = KeyedQueue()
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._threads = []
+
+    def submit(self, keys, fn, *args) -> None:
+        """Run fn(*args) after every earlier task that shares one of keys."""
+        task = KeyedTask(keys, fn, args, self.clock())
+        with self._lock:
+            if not self._threads:
+                self._start()
+            self._pending += 1
+            runnable = self._order.add(task)
+            self.counters.queued(self._pending, max(self._order.depth(key) for key in task.keys))
+        if runnable:
+            task.ready_at = task.submitted_at
+            self._ready.put(task)
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            task = self._ready.get()
+            if task is None:
+                return
+            started = self.clock()
+            ok = True
+            try:
+                task.fn(*task.args)
+            except Exception:
+                ok = False
+                logger.exception("Keyed task %s failed", getattr(task.fn, '__name__', task.fn))
+            with self._lock:
+                self.counters.started(task.ready_at - task.submitted_at, started - task.ready_at)
+                if ok:
+                    self.counters.completed += 1
+                else:
+                    self.counters.failed += 1
+                self._pending -= 1
+                ready = self._order.done(task)
+                if not self._pending:
+                    self._idle.notify_all()
+            now = self.clock()
+            for waiting in ready:
+                waiting.ready_at = now
+                self._ready.put(waiting)
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until every submitted task has finished."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self) -> None:
+        """Finish queued tasks, then stop the workers."""
+        self.wait_idle()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._ready.put(None)
+        for thread in threads:
+            thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self.counters.snapshot(self._pending, len(self._order))
@@ -0,0 +1,262 @@
+import logging
+import os
+import random
+import threading
+
+import db
+import state
+
+logger = logging.getLogger(__name__)
+
+# Rendered messages are cached for boards up to this many rows; a score
+# change only invalidates them when it moves someone into, out of or
+# within this range.
+WATCHED_TOP_N = 10
+
+# Boards only hear about this process's writes; with a shared state store
+# they're rebuilt from the users indexes this often to pick up the other
+# processes' changes (0 never rebuilds)
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', '30' if state.store.shared else '0'))
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, key, priority):
+        self.key = key
+        self.priority = priority
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _resize(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _merge(a, b):
+    """Join two treaps where every key in a sorts before every key in b."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _resize(a)
+        return a
+    b.left = _merge(a, b.left)
+    _resize(b)
+    return b
+
+
+def _split(node, key):
+    """Split into (keys < key, keys >= key)."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _resize(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _resize(node)
+    return left, node
+
+
+def _delete(node, key):
+    if node is None:
+        return None
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    elif node.key < key:
+        node.right = _delete(node.right, key)
+    else:
+        return _merge(node.left, node.right)
+    _resize(node)
+    return node
+
+
+class OrderStatisticTree:
+    """Treap with subtree sizes: insert, delete and rank in O(log n) expected."""
+
+    def __init__(self):
+        self.root = None
+
+    def __len__(self) -> int:
+        return _size(self.root)
+
+    def insert(self, key) -> None:
+        left, right = _split(self.root, key)
+        self.root = _merge(_merge(left, _Node(key, random.random())), right)
+
+    def delete(self, key) -> None:
+        self.root = _delete(self.root, key)
+
+    def rank(self, key) -> int:
+        """Number of keys strictly smaller than key."""
+        count = 0
+        node = self.root
+        while node is not None:
+            if node.key < key:
+                count += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def first(self, n: int) -> list:
+        """The n smallest keys in order."""
+        result, stack, node = [], [], self.root
+        while (stack or node is not None) and len(result) < n:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node.key)
+            node = node.right
+        return result
+
+    def build(self, sorted_keys: list) -> None:
+        """Replace the contents with already-sorted keys in O(n).
+
+        Built nodes get priorities above 1 that decrease with depth, so the
+        heap order holds and later random inserts (priority < 1) settle
+        below them.
+        """
+        def build(lo, hi, depth):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            node = _Node(sorted_keys[mid], 1.0 + 1.0 / (depth + 1))
+            node.left = build(lo, mid, depth + 1)
+            node.right = build(mid + 1, hi, depth + 1)
+            _resize(node)
+            return node
+        self.root = build(0, len(sorted_keys), 0)
+
+
+class Leaderboard:
+    """In-memory ranking of users by one users column, highest first."""
+
+    def __init__(self, column: str):
+        self.column = column
+        self._tree = OrderStatisticTree()
+        self._scores = {}
+        self._lock = threading.Lock()
+        self._rendered = {}  # (n, style) -> cached message text
+        self._version = 0    # bumped whenever the watched top of the board changes
+        self._pending = None  # scores committed while load() is reading, replayed after
+
+    def load(self) -> None:
+        """Rebuild from the database; the column index returns rows presorted.
+
+        Safe to run while updates are flowing: changes that arrive during
+        the read are replayed on top of the rebuilt tree.
+        """
+        with self._lock:
+            self._pending = {}
+        rows = db.fetchall(f"SELECT id, {self.column} FROM users ORDER BY {self.column} DESC, id")
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._scores = {user_id: score for user_id, score in rows}
+            self._tree.build([(-score, user_id) for user_id, score in rows])
+            self._invalidate()
+        for user_id, score in pending.items():
+            self.update(user_id, score)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def update(self, user_id, score) -> None:
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = score
+            old = self._scores.get(user_id)
+            if old == score:
+                return
+            touches_top = False
+            if old is not None:
+                old_key = (-old, user_id)
+                touches_top = self._tree.rank(old_key) < WATCHED_TOP_N
+                self._tree.delete(old_key)
+            new_key = (-score, user_id)
+            self._tree.insert(new_key)
+            self._scores[user_id] = score
+            if touches_top or self._tree.rank(new_key) < WATCHED_TOP_N:
+                self._invalidate()
+
+    def remove(self, user_id) -> None:
+        with self._lock:
+            score = self._scores.pop(user_id, None)
+            if score is not None:
+                if self._tree.rank((-score, user_id)) < WATCHED_TOP_N:
+                    self._invalidate()
+                self._tree.delete((-score, user_id))
+
+    def _invalidate(self) -> None:
+        self._rendered.clear()
+        self._version += 1
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they aren't ranked."""
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            return self._tree.rank((-score, user_id)) + 1
+
+    def top(self, n: int) -> list:
+        """[(user_id, score)] for the n highest scores."""
+        with self._lock:
+            return [(user_id, -negative) for negative, user_id in self._tree.first(n)]
+
+    def render(self, n: int, style: str, build) -> str:
+        """Return build(top(n)), cached until the top of the board changes."""
+        cache_key = (n, style)
+        with self._lock:
+            text = self._rendered.get(cache_key)
+            version = self._version
+        if text is None:
+            text = build(self.top(n))
+            with self._lock:
+                if n <= WATCHED_TOP_N and version == self._version:
+                    self._rendered[cache_key] = text
+        return text
+
+
+boards = {
+    'tokens': Leaderboard('tokens'),
+    'rating': Leaderboard('rating'),
+}
+
+
+def load_all() -> None:
+    for board in boards.values():
+        board.load()
+
+
+def load_all_in_background() -> threading.Thread:
+    """Build the boards off the startup path; ranks fill in once loading finishes."""
+    thread = threading.Thread(target=load_all, name='leaderboard-load', daemon=True)
+    thread.start()
+    return thread
+
+
+def refresh_boards(context=None) -> None:
+    """Periodic job: rebuild every board from the database."""
+    try:
+        load_all()
+    except Exception:
+        logger.exception("Leaderboard refresh failed")
+
+
+def record(user_id, fields: dict) -> None:
+    """Feed committed users changes into the boards."""
+    for column, board in boards.items():
+        if column in fields:
+            board.update(user_id, fields[column])
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import db
+import user_cache
+import writer
+
+# token_transactions.transaction_type values
+BATTLE_STAKE = 'battle_stake'
+BATTLE_PAYOUT = 'battle_payout'
+BATTLE_REFUND = 'battle_refund'
+DAILY_BONUS = 'daily_bonus'
+REFERRAL_REWARD = 'referral_reward'
+REFERRAL_BONUS = 'referral_bonus'
+TOURNAMENT_FEE = 'tournament_fee'
+TOURNAMENT_PRIZE = 'tournament_prize'
+CLASS_PURCHASE = 'class_purchase'
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, user_id, amount):
+        super().__init__(f"User {user_id} cannot cover {amount} tokens")
+        self.user_id = user_id
+        self.amount = amount
+
+
+class UnknownUser(LedgerError):
+    def __init__(self, user_id):
+        super().__init__(f"User {user_id} does not exist")
+        self.user_id = user_id
+
+
+def journal(user_id, amount, transaction_type):
+    """Append a token_transactions row (group-committed unless writer is in sync mode)."""
+    writer.submit(
+        "INSERT INTO token_transactions (user_id, amount, transaction_type, timestamp) VALUES (?, ?, ?, ?)",
+        (user_id, amount, transaction_type, datetime.now().isoformat())
+    )
+
+
+def credit(user_id, amount, transaction_type) -> int:
+    """Add tokens to a balance and journal it; returns the new balance."""
+    with db.transaction() as conn:
+        row = conn.execute(
+            "UPDATE users SET tokens = tokens + ? WHERE id = ? RETURNING tokens",
+            (amount, user_id)
+        ).fetchone()
+        if row is None:
+            raise UnknownUser(user_id)
+        journal(user_id, amount, transaction_type)
+        user_cache.write_through(user_id, tokens=row[0])
+    return row[0]
+
+
+def debit(user_id, amount, transaction_type) -> int:
+    """Remove tokens only if the balance covers them; returns the new balance.
+
+    Raises InsufficientFunds (rolling back the enclosing transaction when
+    uncaught) instead of letting the balance go negative.
+    """
+    with db.transaction() as conn:
+        row = conn.execute(
+            "UPDATE users SET tokens = tokens - ? WHERE id = ? AND tokens >= ? RETURNING tokens",
+            (amount, user_id, amount)
+        ).fetchone()
+        if row is None:
+            if conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is None:
+                raise UnknownUser(user_id)
+            raise InsufficientFunds(user_id, amount)
+        journal(user_id, -amount, transaction_type)
+        user_cache.write_through(user_id, tokens=row[0])
+    return row[0]
+
+
+def balance(user_id):
+    row = db.fetchone("SELECT tokens FROM users WHERE id = ?", (user_id,))
+    return row[0] if row else None
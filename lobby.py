@@ -0,0 +1,123 @@
+import threading
+
+import db
+
+# Lobbies offered per lookup; more only matter when a player is already
+# seated in the fullest ones
+CANDIDATES = 4
+
+
+class LobbyIndex:
+    """Open tournaments by entry fee and fill level, so a player can be seated in the fullest.
+
+    Fill levels are bounded by the tournament size, so every operation is
+    constant time; within a level, lobbies are offered in the order they
+    reached it. The index is a hint: seats are still taken through the
+    tournament's own atomic update, which has the final say.
+    """
+
+    def __init__(self, capacity: int = 8):
+        self.capacity = capacity
+        self._levels = {}   # entry_fee -> [{tournament_id: None} per fill level]
+        self._entries = {}  # tournament_id -> (entry_fee, fill)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tournament_id) -> bool:
+        return tournament_id in self._entries
+
+    def add(self, tournament_id: int, entry_fee: int, fill: int) -> None:
+        with self._lock:
+            self._remove(tournament_id)
+            self._insert(tournament_id, entry_fee, fill)
+
+    def update(self, tournament_id: int, fill: int) -> None:
+        """Move a listed lobby to a new fill level; a full one is delisted, an unlisted one left alone."""
+        with self._lock:
+            entry = self._remove(tournament_id)
+            if entry is not None:
+                self._insert(tournament_id, entry[0], fill)
+
+    def remove(self, tournament_id: int) -> None:
+        with self._lock:
+            self._remove(tournament_id)
+
+    def _insert(self, tournament_id: int, entry_fee: int, fill: int) -> None:
+        if not 0 < fill < self.capacity:
+            return
+        levels = self._levels.setdefault(entry_fee, [{} for _ in range(self.capacity)])
+        levels[fill][tournament_id] = None
+        self._entries[tournament_id] = (entry_fee, fill)
+
+    def _remove(self, tournament_id: int):
+        entry = self._entries.pop(tournament_id, None)
+        if entry is not None:
+            entry_fee, fill = entry
+            del self._levels[entry_fee][fill][tournament_id]
+        return entry
+
+    def fullest(self, entry_fee: int, limit: int = CANDIDATES) -> list:
+        """Up to limit open lobbies at entry_fee, fullest first."""
+        found = []
+        with self._lock:
+            levels = self._levels.get(entry_fee)
+            if not levels:
+                return found
+            for level in reversed(levels):
+                for tournament_id in level:
+                    found.append(tournament_id)
+                    if len(found) == limit:
+                        return found
+        return found
+
+
+class SharedLobbyIndex:
+    """LobbyIndex kept in game.db, for several bot processes sharing one set of lobbies.
+
+    The (entry_fee, fill) index makes finding the fullest lobbies an
+    O(log n) lookup.
+    """
+
+    def __init__(self, capacity: int = 8, pool=None):
+        self.capacity = capacity
+        self.pool = pool or db.pool
+
+    def __len__(self) -> int:
+        return self.pool.connection().execute("SELECT COUNT(*) FROM tournament_lobbies").fetchone()[0]
+
+    def __contains__(self, tournament_id) -> bool:
+        return self.pool.connection().execute(
+            "SELECT 1 FROM tournament_lobbies WHERE tournament_id = ?", (tournament_id,)
+        ).fetchone() is not None
+
+    def add(self, tournament_id: int, entry_fee: int, fill: int) -> None:
+        if not 0 < fill < self.capacity:
+            self.remove(tournament_id)
+            return
+        self.pool.connection().execute(
+            "INSERT OR REPLACE INTO tournament_lobbies (tournament_id, entry_fee, fill) VALUES (?, ?, ?)",
+            (tournament_id, entry_fee, fill)
+        )
+
+    def update(self, tournament_id: int, fill: int) -> None:
+        """Move a listed lobby to a new fill level; a full one is delisted, an unlisted one left alone."""
+        if not 0 < fill < self.capacity:
+            self.remove(tournament_id)
+            return
+        self.pool.connection().execute(
+            "UPDATE tournament_lobbies SET fill = ? WHERE tournament_id = ?", (fill, tournament_id)
+        )
+
+    def remove(self, tournament_id: int) -> None:
+        self.pool.connection().execute("DELETE FROM tournament_lobbies WHERE tournament_id = ?", (tournament_id,))
+
+    def fullest(self, entry_fee: int, limit: int = CANDIDATES) -> list:
+        """Up to limit open lobbies at entry_fee, fullest first."""
+        rows = self.pool.connection().execute(
+            "SELECT tournament_id FROM tournament_lobbies WHERE entry_fee = ? "
+            "ORDER BY fill DESC, tournament_id LIMIT ?",
+            (entry_fee, limit)
+        ).fetchall()
+        return [tournament_id for tournament_id, in rows]
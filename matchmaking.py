@@ -0,0 +1,301 @@
+import bisect
+import itertools
+import json
+import threading
+import time
+
+import db
+from records import QueueEntry
+
+# Allowed rating gap between opponents: starts at BASE_RATING_WINDOW and
+# grows by RATING_WINDOW_GROWTH points per second the waiting player has
+# been queued, up to MAX_RATING_WINDOW.
+BASE_RATING_WINDOW = 100
+RATING_WINDOW_GROWTH = 10
+MAX_RATING_WINDOW = 1000
+
+# Neighbours examined on each side of the arriving player's rating.
+NEIGHBOUR_PROBES = 8
+
+
+class MatchmakingEngine:
+    """Per-stake queues kept sorted by rating, so finding an opponent is a bisect.
+
+    Each user has at most one queue entry; re-queueing at another stake
+    moves the entry instead of adding a second one.
+    """
+
+    def __init__(self, base_window=BASE_RATING_WINDOW, window_growth=RATING_WINDOW_GROWTH,
+                 max_window=MAX_RATING_WINDOW, clock=time.monotonic):
+        self.base_window = base_window
+        self.window_growth = window_growth
+        self.max_window = max_window
+        self.clock = clock
+        self._buckets = {}   # stake -> sorted [(rating, seq, user_id)]
+        self._entries = {}   # user_id -> QueueEntry, in enqueue order
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._entries
+
+    def window(self, waited: float) -> float:
+        return min(self.max_window, self.base_window + waited * self.window_growth)
+
+    def get(self, user_id):
+        return self._entries.get(user_id)
+
+    def enqueue(self, player: QueueEntry) -> bool:
+        """Queue a player; returns False if they are already waiting at this stake."""
+        user_id = player.user_id
+        with self._lock:
+            existing = self._entries.get(user_id)
+            if existing is not None:
+                if existing.stake == player.stake:
+                    return False
+                self._remove(user_id)
+            player.seq = next(self._seq)
+            player.enqueued_at = self.clock()
+            bisect.insort(self._buckets.setdefault(player.stake, []), (player.rating, player.seq, user_id))
+            self._entries[user_id] = player
+            return True
+
+    def remove(self, user_id):
+        """Drop a user's queue entry; returns their entry if they were queued."""
+        with self._lock:
+            return self._remove(user_id)
+
+    def _remove(self, user_id):
+        player = self._entries.pop(user_id, None)
+        if player is None:
+            return None
+        bucket = self._buckets[player.stake]
+        del bucket[bisect.bisect_left(bucket, (player.rating, player.seq, user_id))]
+        if not bucket:
+            del self._buckets[player.stake]
+        return player
+
+    def pop_opponent(self, player: QueueEntry):
+        """Remove and return the closest-rated queued opponent at the player's stake.
+
+        A candidate qualifies when the rating gap fits its own window, which
+        widens the longer it has waited. Returns None if nobody qualifies.
+        """
+        with self._lock:
+            bucket = self._buckets.get(player.stake)
+            if not bucket:
+                return None
+            now = self.clock()
+            best = self._closest(bucket, player.rating, player.user_id, now)
+            if best is None:
+                return None
+            return self._remove(best)
+
+    def pop_opponent_or_enqueue(self, player: QueueEntry):
+        """Pop an opponent for player, or queue them if there is none; returns (opponent, queued).
+
+        A matched player leaves any queue they were waiting in at another
+        stake. queued is False when they were already waiting at this stake.
+        """
+        with self._lock:
+            opponent = self.pop_opponent(player)
+            if opponent is not None:
+                self._remove(player.user_id)
+                return opponent, False
+            return None, self.enqueue(player)
+
+    def match_batch(self):
+        """Pair every compatible neighbour in every stake queue; returns [(player1, player2)].
+
+        Adjacent entries in rating order are paired when their gap fits the
+        window of whichever of the two has waited longer. One pass per tick.
+        """
+        pairs = []
+        with self._lock:
+            now = self.clock()
+            for stake in list(self._buckets):
+                bucket = self._buckets[stake]
+                remaining = []
+                i = 0
+                while i < len(bucket):
+                    if i + 1 < len(bucket):
+                        (r1, _, u1), (r2, _, u2) = bucket[i], bucket[i + 1]
+                        oldest = min(self._entries[u1].enqueued_at, self._entries[u2].enqueued_at)
+                        if r2 - r1 <= self.window(now - oldest):
+                            pairs.append((self._entries.pop(u1), self._entries.pop(u2)))
+                            i += 2
+                            continue
+                    remaining.append(bucket[i])
+                    i += 1
+                if remaining:
+                    self._buckets[stake] = remaining
+                else:
+                    del self._buckets[stake]
+        return pairs
+
+    def expire(self, timeout: float):
+        """Remove entries queued for longer than timeout seconds; returns their entries."""
+        with self._lock:
+            cutoff = self.clock() - timeout
+            expired = []
+            # _entries is in enqueue order, so stale entries are all at the front
+            for user_id, player in self._entries.items():
+                if player.enqueued_at > cutoff:
+                    break
+                expired.append(user_id)
+            return [self._remove(user_id) for user_id in expired]
+
+    def _closest(self, bucket, rating, user_id, now):
+        index = bisect.bisect_left(bucket, (rating,))
+        best, best_gap = None, None
+        for step in (-1, 1):
+            position = index - 1 if step < 0 else index
+            for _ in range(NEIGHBOUR_PROBES):
+                if not 0 <= position < len(bucket):
+                    break
+                candidate_rating, _, candidate_id = bucket[position]
+                position += step
+                gap = abs(candidate_rating - rating)
+                if gap > self.max_window or (best_gap is not None and gap >= best_gap):
+                    break
+                if candidate_id == user_id:
+                    continue
+                if gap <= self.window(now - self._entries[candidate_id].enqueued_at):
+                    best, best_gap = candidate_id, gap
+        return best
+
+
+class SharedMatchmakingEngine:
+    """MatchmakingEngine over the matchmaking_entries table, for several bot processes.
+
+    Same interface and pairing rules; each operation runs in one write
+    transaction, so two processes can never pop the same opponent. Queue
+    times use the wall clock, which every process shares.
+    """
+
+    def __init__(self, base_window=BASE_RATING_WINDOW, window_growth=RATING_WINDOW_GROWTH,
+                 max_window=MAX_RATING_WINDOW, clock=time.time, pool=None):
+        self.base_window = base_window
+        self.window_growth = window_growth
+        self.max_window = max_window
+        self.clock = clock
+        self.pool = pool or db.pool
+
+    def __len__(self) -> int:
+        return self.pool.connection().execute("SELECT COUNT(*) FROM matchmaking_entries").fetchone()[0]
+
+    def __contains__(self, user_id) -> bool:
+        return self.get(user_id) is not None
+
+    def window(self, waited: float) -> float:
+        return min(self.max_window, self.base_window + waited * self.window_growth)
+
+    def get(self, user_id):
+        row = self.pool.connection().execute(
+            "SELECT player, enqueued_at FROM matchmaking_entries WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return self._load(*row) if row else None
+
+    @staticmethod
+    def _load(row: str, enqueued_at: float) -> QueueEntry:
+        player = QueueEntry(*json.loads(row))
+        player.enqueued_at = enqueued_at
+        return player
+
+    def enqueue(self, player: QueueEntry) -> bool:
+        """Queue a player; returns False if they are already waiting at this stake."""
+        with self.pool.transaction() as conn:
+            existing = conn.execute(
+                "SELECT stake FROM matchmaking_entries WHERE user_id = ?", (player.user_id,)
+            ).fetchone()
+            if existing is not None and existing[0] == player.stake:
+                return False
+            player.enqueued_at = self.clock()
+            conn.execute(
+                "INSERT OR REPLACE INTO matchmaking_entries (user_id, stake, rating, player, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (player.user_id, player.stake, player.rating, json.dumps(player.as_row()), player.enqueued_at)
+            )
+            return True
+
+    def remove(self, user_id):
+        """Drop a user's queue entry; returns their entry if they were queued."""
+        row = self.pool.connection().execute(
+            "DELETE FROM matchmaking_entries WHERE user_id = ? RETURNING player, enqueued_at", (user_id,)
+        ).fetchone()
+        return self._load(*row) if row else None
+
+    def pop_opponent(self, player: QueueEntry):
+        """Remove and return the closest-rated queued opponent at the player's stake, or None."""
+        rating = player.rating
+        with self.pool.transaction() as conn:
+            now = self.clock()
+            # The nearest neighbours on each side, as the in-process engine probes them
+            candidates = conn.execute(
+                """SELECT user_id, rating, enqueued_at FROM
+                       (SELECT user_id, rating, enqueued_at FROM matchmaking_entries
+                        WHERE stake = ? AND rating <= ? AND rating >= ? AND user_id != ?
+                        ORDER BY rating DESC LIMIT ?)
+                   UNION ALL
+                   SELECT user_id, rating, enqueued_at FROM
+                       (SELECT user_id, rating, enqueued_at FROM matchmaking_entries
+                        WHERE stake = ? AND rating > ? AND rating <= ? AND user_id != ?
+                        ORDER BY rating LIMIT ?)""",
+                (player.stake, rating, rating - self.max_window, player.user_id, NEIGHBOUR_PROBES,
+                 player.stake, rating, rating + self.max_window, player.user_id, NEIGHBOUR_PROBES)
+            ).fetchall()
+            best, best_gap = None, None
+            for candidate_id, candidate_rating, enqueued_at in candidates:
+                gap = abs(candidate_rating - rating)
+                if (best_gap is None or gap < best_gap) and gap <= self.window(now - enqueued_at):
+                    best, best_gap = candidate_id, gap
+            if best is None:
+                return None
+            return self.remove(best)
+
+    def pop_opponent_or_enqueue(self, player: QueueEntry):
+        """Pop an opponent for player, or queue them if there is none; returns (opponent, queued).
+
+        One transaction, so two players arriving together in different
+        processes can't both miss each other and wait.
+        """
+        with self.pool.transaction():
+            opponent = self.pop_opponent(player)
+            if opponent is not None:
+                self.remove(player.user_id)
+                return opponent, False
+            return None, self.enqueue(player)
+
+    def match_batch(self):
+        """Pair every compatible neighbour in every stake queue; returns [(player1, player2)]."""
+        pairs = []
+        with self.pool.transaction() as conn:
+            now = self.clock()
+            rows = conn.execute(
+                "SELECT user_id, stake, rating, player, enqueued_at FROM matchmaking_entries "
+                "ORDER BY stake, rating, enqueued_at"
+            ).fetchall()
+            i = 0
+            while i + 1 < len(rows):
+                (_, s1, r1, p1, t1), (_, s2, r2, p2, t2) = rows[i], rows[i + 1]
+                if s1 == s2 and r2 - r1 <= self.window(now - min(t1, t2)):
+                    pairs.append((self._load(p1, t1), self._load(p2, t2)))
+                    i += 2
+                else:
+                    i += 1
+            conn.executemany(
+                "DELETE FROM matchmaking_entries WHERE user_id = ?",
+                ((player.user_id,) for pair in pairs for player in pair)
+            )
+        return pairs
+
+    def expire(self, timeout: float):
+        """Remove entries queued for longer than timeout seconds; returns their entries."""
+        rows = self.pool.connection().execute(
+            "DELETE FROM matchmaking_entries WHERE enqueued_at <= ? RETURNING player, enqueued_at",
+            (self.clock() - timeout,)
+        ).fetchall()
+        return [self._load(*row) for row in rows]
@@ -0,0 +1,388 @@
+import bisect
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 0 turns every timer off; handlers, SQL and Bot API calls then run unwrapped
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+# Prometheus text endpoint, at /metrics; port 0 disables it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+# Share of SQL statements and Bot API calls timed, picked at random; each
+# timed one counts for 1 / rate, so counts and sums still estimate all of
+# them. Handlers and transactions are always timed, and failures always
+# counted. 1 times everything; 0 no statements or API calls.
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '0.05'))
+# How often the refresh_gauges job reads the gauges that /metrics serves
+METRICS_GAUGE_REFRESH_SECONDS = int(os.getenv('METRICS_GAUGE_REFRESH_SECONDS', '5'))
+
+# Upper bounds in seconds, from a cached SQLite read to a slow Bot API call
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observations per latency bucket, plus their sum.
+
+    Each thread counts into its own shard, so observe() takes no lock and
+    handler threads never queue behind each other on a hot series; readers
+    add the shards up.
+    """
+
+    __slots__ = ('bounds', '_shards', '_local', '_lock')
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self._shards = []  # per thread: a count per bucket, the last one +Inf, then the sum
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self) -> list:
+        shard = self._local.shard = [0] * (len(self.bounds) + 1) + [0.0]
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def observe(self, value: float, weight: float = 1) -> None:
+        """Count value weight times; sampled observations pass 1 / their sampling rate."""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[bisect.bisect_left(self.bounds, value)] += weight
+        shard[-1] += value * weight
+
+    def snapshot(self):
+        """(counts per bucket, sum)."""
+        with self._lock:
+            shards = list(self._shards)
+        totals = [sum(column) for column in zip(*shards)] if shards else [0] * (len(self.bounds) + 1) + [0.0]
+        return totals[:-1], totals[-1]
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (the top bound if it's beyond them)."""
+        counts, _ = self.snapshot()
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.bounds, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class Counter:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Registry:
+    """Histograms, counters and callback gauges by name and labels, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._help = {}        # name -> (type, help)
+        self._series = {}      # (name, labels) -> Histogram or Counter
+        self._gauges = {}      # name -> fn returning a number or {labels: number}
+        self._gauge_values = {}  # the last refresh_gauges() reading, served by render()
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, cls, name: str, help: str, labels: dict):
+        key = (name, tuple(sorted(labels.items())))
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                self._help.setdefault(name, (kind, help))
+                series = self._series.setdefault(key, cls())
+        return series
+
+    def histogram(self, name: str, help: str, **labels) -> Histogram:
+        return self._get('histogram', Histogram, name, help, labels)
+
+    def counter(self, name: str, help: str, **labels) -> Counter:
+        return self._get('counter', Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, fn) -> None:
+        """Read fn() at every scrape; it returns a number, or {(('label', value), ...): number}."""
+        with self._lock:
+            self._help[name] = ('gauge', help)
+            self._gauges[name] = fn
+
+    def series(self, name: str) -> dict:
+        """{labels: Histogram or Counter} of one metric."""
+        with self._lock:
+            return {labels: series for (series_name, labels), series in self._series.items() if series_name == name}
+
+    def read_gauges(self) -> dict:
+        """{name: {labels: value}}; a gauge that fails to read is logged and left out."""
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = {}
+        for name, fn in gauges:
+            try:
+                value = fn()
+            except Exception:
+                logger.exception("Could not read gauge %s", name)
+                continue
+            values[name] = value if isinstance(value, dict) else {(): value}
+        return values
+
+    def refresh_gauges(self) -> dict:
+        """Read every gauge and keep the values for render(); returns them."""
+        values = self.read_gauges()
+        with self._lock:
+            self._gauge_values = values
+        return values
+
+    def render(self) -> str:
+        """Prometheus text, with the gauges as of the last refresh_gauges().
+
+        Scrapes run on short-lived server threads, which must not open the
+        per-thread database connections that reading some gauges takes.
+        """
+        lines = []
+        with self._lock:
+            helps = dict(self._help)
+            series = sorted(self._series.items(), key=lambda item: item[0])
+            gauges = self._gauge_values
+        written = set()
+        for (name, labels), metric in series:
+            kind, help = helps[name]
+            if name not in written:
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+                written.add(name)
+            if isinstance(metric, Counter):
+                lines.append(f'{name}{_labels(labels)} {metric.value}')
+                continue
+            counts, total = metric.snapshot()
+            cumulative = 0
+            for bound, count in zip(metric.bounds + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        for name, values in sorted(gauges.items()):
+            kind, help = helps[name]
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            for labels, value in values.items():
+                lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def handler_series(name: str):
+    """(run time histogram, queue wait histogram, error counter) for one handler."""
+    return (registry.histogram('bot_handler_seconds', "Handler run time", handler=name),
+            registry.histogram('bot_handler_queue_seconds', "Time from receiving an update to its handler starting",
+                               handler=name),
+            registry.counter('bot_handler_errors_total', "Handlers that raised", handler=name))
+
+
+def timed_handler(callback):
+    """callback(update, context), timing each run and counting failures under its name.
+
+    The wrapper also takes the time the update was queued, to record how
+    long it waited for a worker. Returns callback itself when metrics are off.
+    """
+    if not METRICS_ENABLED:
+        return callback
+    name = callback.__name__
+    latency, waited, errors = handler_series(name)
+
+    def timed(update, context, submitted_at: float = None):
+        start = time.perf_counter()
+        if submitted_at is not None:
+            waited.observe(start - submitted_at)
+        try:
+            return callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+    timed.__name__ = name
+    return timed
+
+
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+(\w+)', re.IGNORECASE)
+_sql_series = {}  # statement text -> Histogram
+
+
+def sql_histogram(sql: str) -> Histogram:
+    """The histogram for a statement, labelled by its verb and first table; looked up once per statement text."""
+    histogram = _sql_series.get(sql)
+    if histogram is None:
+        words = sql.split(None, 1)
+        table = _SQL_TABLE.search(sql)
+        histogram = _sql_series[sql] = registry.histogram(
+            'sqlite_statement_seconds', "SQLite execute() time, including the first step of a query",
+            op=words[0].upper() if words else '', table=table.group(1) if table else ''
+        )
+    return histogram
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection factory that times a random METRICS_SAMPLE_RATE share of statements.
+
+    Timing every statement cost handlers several percent of their
+    throughput; an unsampled statement only pays for the random() draw.
+    """
+
+    def execute(self, sql, parameters=()):
+        if random.random() >= METRICS_SAMPLE_RATE:
+            return sqlite3.Connection.execute(self, sql, parameters)
+        start = time.perf_counter()
+        try:
+            return sqlite3.Connection.execute(self, sql, parameters)
+        finally:
+            sql_histogram(sql).observe(time.perf_counter() - start, 1 / METRICS_SAMPLE_RATE)
+
+    def executemany(self, sql, seq_of_parameters):
+        if random.random() >= METRICS_SAMPLE_RATE:
+            return sqlite3.Connection.executemany(self, sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return sqlite3.Connection.executemany(self, sql, seq_of_parameters)
+        finally:
+            sql_histogram(sql).observe(time.perf_counter() - start, 1 / METRICS_SAMPLE_RATE)
+
+
+def transaction_histogram() -> Histogram:
+    return registry.histogram('sqlite_transaction_seconds',
+                              "Write transaction time, from BEGIN IMMEDIATE (lock wait included) to COMMIT or ROLLBACK")
+
+
+def api_call(method: str):
+    """(latency histogram, error counter) for one Bot API method."""
+    return (registry.histogram('telegram_api_seconds', "Bot API call time", method=method),
+            registry.counter('telegram_api_errors_total', "Bot API calls that raised", method=method))
+
+
+class TimedRequest:
+    """Wraps a Bot's telegram.utils.request.Request, timing a sample of API calls by method."""
+
+    def __init__(self, request):
+        self._request = request
+        self._series = {}  # url -> api_call() of its method
+
+    def _series_for(self, url: str):
+        series = self._series.get(url)
+        if series is None:
+            series = self._series[url] = api_call(url.rsplit('/', 1)[-1])
+        return series
+
+    def post(self, url: str, data=None, timeout=None):
+        if random.random() >= METRICS_SAMPLE_RATE:
+            try:
+                return self._request.post(url, data=data, timeout=timeout)
+            except Exception:
+                self._series_for(url)[1].inc()
+                raise
+        series = self._series_for(url)
+        start = time.perf_counter()
+        try:
+            return self._request.post(url, data=data, timeout=timeout)
+        except Exception:
+            series[1].inc()
+            raise
+        finally:
+            series[0].observe(time.perf_counter() - start, 1 / METRICS_SAMPLE_RATE)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+def instrument_bot(bot) -> None:
+    """Time every Bot API call bot makes, including send_message and edit_message_text."""
+    if METRICS_ENABLED and not isinstance(bot._request, TimedRequest):
+        bot._request = TimedRequest(bot._request)
+
+
+def refresh_gauges(context=None) -> None:
+    """Periodic job: read the gauges that /metrics serves."""
+    registry.refresh_gauges()
+
+
+def report(top: int = 8) -> str:
+    """A plain-text digest for the /stats command: slowest series by total time, and every gauge.
+
+    SQL and Bot API call counts are estimates when METRICS_SAMPLE_RATE is below 1.
+    """
+    sections = (
+        ("Handlers", 'bot_handler_seconds', 'handler'),
+        ("Handler queue wait", 'bot_handler_queue_seconds', 'handler'),
+        ("SQLite transactions", 'sqlite_transaction_seconds', None),
+        ("SQLite", 'sqlite_statement_seconds', None),
+        ("Bot API", 'telegram_api_seconds', 'method'),
+    )
+    lines = []
+    for title, name, label in sections:
+        rows = []
+        for labels, histogram in registry.series(name).items():
+            counts, total = histogram.snapshot()
+            calls = sum(counts)
+            if calls:
+                values = dict(labels)
+                what = values[label] if label else f"{values.get('op', 'all')} {values.get('table', '')}".strip()
+                rows.append((total, what, calls, histogram))
+        if not rows:
+            continue
+        lines.append(f"{title} (calls, p50/p95/p99 ms):")
+        for total, what, calls, histogram in sorted(rows, reverse=True)[:top]:
+            p50, p95, p99 = (histogram.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))
+            lines.append(f"  {what}: {calls:.0f}, ≤{p50:g}/≤{p95:g}/≤{p99:g}")
+    gauges = registry.read_gauges()
+    if gauges:
+        lines.append("Queues:")
+        for name, values in sorted(gauges.items()):
+            for labels, value in values.items():
+                lines.append(f"  {name}{_labels(labels)}: {value}")
+    return '\n'.join(lines) if lines else "No measurements yet."
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+    """Serve /metrics on a background thread; returns the server, or None when disabled."""
+    if not METRICS_ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", listen, server.server_address[1])
+    return server
@@ -0,0 +1,181 @@
+import logging
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# (version, description, statements). Applied in order, each in its own
+# transaction, and recorded in PRAGMA user_version. Never edit a shipped
+# migration; append a new one instead. Early steps use IF NOT EXISTS so a
+# database created before versioning (user_version 0) upgrades cleanly.
+MIGRATIONS = [
+    (1, "base tables", [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id INTEGER PRIMARY KEY,
+            tokens INTEGER DEFAULT 100,
+            last_daily TEXT DEFAULT '',
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            rating INTEGER DEFAULT 1000,
+            character_class TEXT,
+            referral_code TEXT,
+            referrals INTEGER DEFAULT 0,
+            used_referral INTEGER DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS game_sessions
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player1_id INTEGER,
+            player2_id INTEGER,
+            stake INTEGER,
+            status TEXT,
+            winner_id INTEGER,
+            created_at TEXT,
+            FOREIGN KEY (player1_id) REFERENCES users (id),
+            FOREIGN KEY (player2_id) REFERENCES users (id))''',
+        '''CREATE TABLE IF NOT EXISTS token_transactions
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            transaction_type TEXT,
+            timestamp TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id))''',
+    ]),
+    (2, "leaderboard and referral lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_users_tokens ON users (tokens DESC, id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_rating ON users (rating DESC, id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users (referral_code)",
+    ]),
+    (3, "broadcast checkpoints and audit events", [
+        '''CREATE TABLE IF NOT EXISTS broadcasts
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status TEXT,
+            created_at TEXT,
+            finished_at TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS audit_events
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            event TEXT,
+            detail TEXT,
+            created_at TEXT)''',
+    ]),
+    (4, "shared game state for multi-process deployments", [
+        '''CREATE TABLE IF NOT EXISTS shared_state
+           (namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB,
+            PRIMARY KEY (namespace, key)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS shared_queues
+           (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            namespace TEXT NOT NULL,
+            value BLOB)''',
+        "CREATE INDEX IF NOT EXISTS idx_shared_queues_namespace ON shared_queues (namespace, seq)",
+        '''CREATE TABLE IF NOT EXISTS matchmaking_entries
+           (user_id INTEGER PRIMARY KEY,
+            stake INTEGER NOT NULL,
+            rating INTEGER NOT NULL,
+            player TEXT NOT NULL,
+            enqueued_at REAL NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_matchmaking_entries_stake_rating ON matchmaking_entries (stake, rating)",
+        "CREATE INDEX IF NOT EXISTS idx_matchmaking_entries_enqueued_at ON matchmaking_entries (enqueued_at)",
+    ]),
+    (5, "notification outbox", [
+        '''CREATE TABLE IF NOT EXISTS outbox
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedup_key TEXT UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL)''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)",
+    ]),
+    (6, "id sequences for matches and tournaments", [
+        '''CREATE TABLE IF NOT EXISTS id_sequences
+           (name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL)''',
+    ]),
+    (7, "open tournament lobbies", [
+        '''CREATE TABLE IF NOT EXISTS tournament_lobbies
+           (tournament_id INTEGER PRIMARY KEY,
+            entry_fee INTEGER NOT NULL,
+            fill INTEGER NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_tournament_lobbies_fill ON tournament_lobbies (entry_fee, fill DESC, tournament_id)",
+    ]),
+    (8, "analytics summary tables", [
+        '''CREATE TABLE IF NOT EXISTS analytics_watermarks
+           (source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS daily_stats
+           (day TEXT PRIMARY KEY,
+            games INTEGER NOT NULL,
+            decided INTEGER NOT NULL,
+            draws INTEGER NOT NULL,
+            staked INTEGER NOT NULL,
+            tokens_in INTEGER NOT NULL,
+            tokens_out INTEGER NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS daily_players
+           (day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS daily_stakes
+           (day TEXT NOT NULL,
+            stake INTEGER NOT NULL,
+            games INTEGER NOT NULL,
+            PRIMARY KEY (day, stake)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS daily_token_flows
+           (day TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            transactions INTEGER NOT NULL,
+            tokens_in INTEGER NOT NULL,
+            tokens_out INTEGER NOT NULL,
+            PRIMARY KEY (day, transaction_type)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS user_stats
+           (user_id INTEGER PRIMARY KEY,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            draws INTEGER NOT NULL,
+            staked INTEGER NOT NULL,
+            tokens_in INTEGER NOT NULL,
+            tokens_out INTEGER NOT NULL,
+            last_active TEXT NOT NULL)''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(pool=None) -> int:
+    return (pool or db.pool).connection().execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(pool=None) -> list:
+    """Apply pending migrations; returns the versions applied.
+
+    Only reads the schema version when the database is current, so the
+    cost doesn't grow with the amount of data.
+    """
+    pool = pool or db.pool
+    version = current_version(pool)
+    if version > LATEST_VERSION:
+        raise RuntimeError(f"Database schema v{version} is newer than this code (v{LATEST_VERSION})")
+
+    applied = []
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        start = time.perf_counter()
+        with pool.transaction() as conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+        logger.info("Applied migration %d (%s) in %.1f ms", target, description, (time.perf_counter() - start) * 1000)
+        applied.append(target)
+    return applied
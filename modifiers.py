@@ -0,0 +1,87 @@
+import threading
+
+# What a modifier changes; every special event and class perk declares one
+BATTLE_REWARD = 'battle_reward'
+POWERUP_COST = 'powerup_cost'
+TOURNAMENT_FEE = 'tournament_fee'
+
+
+def _identity(value):
+    return value
+
+
+def compose(functions: tuple):
+    """One function applying each of functions in order; the identity for none."""
+    if not functions:
+        return _identity
+    if len(functions) == 1:
+        return functions[0]
+
+    def composed(value):
+        for function in functions:
+            value = function(value)
+        return value
+    return composed
+
+
+class ModifierPipeline:
+    """Composed event and class-perk modifiers, looked up by effect in O(1).
+
+    Active events are indexed by effect when the active set changes (see
+    refresh), and the function for each (effect, events, class) is composed
+    once and cached, so applying modifiers is a dict lookup and a call.
+    Events apply in SPECIAL_EVENTS order, then the class perk.
+    """
+
+    def __init__(self, events: dict, classes: dict):
+        self._events = {event_id: (event['effect'], event['modifier']) for event_id, event in events.items()}
+        self._perks = {class_id: (char_class['effect'], char_class['perk']) for class_id, char_class in classes.items()}
+        self._order = {event_id: index for index, event_id in enumerate(events)}
+        self._active = frozenset()
+        self._by_effect = {}     # effect -> active event ids having it, in order
+        self._current = {}       # (effect, class_id) -> function for the active events
+        self._composed = {}      # (effect, event ids, class_id) -> function, kept across refreshes
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> frozenset:
+        return self._active
+
+    def refresh(self, active_event_ids) -> bool:
+        """Switch to a new set of active events; False if it was already current."""
+        active = frozenset(event_id for event_id in active_event_ids if event_id in self._events)
+        if active == self._active:
+            return False
+        by_effect = {}
+        for event_id in sorted(active, key=self._order.__getitem__):
+            by_effect.setdefault(self._events[event_id][0], []).append(event_id)
+        with self._lock:
+            self._active = active
+            self._by_effect = {effect: tuple(event_ids) for effect, event_ids in by_effect.items()}
+            self._current = {}
+        return True
+
+    def modifier(self, effect: str, class_id: str = None):
+        """The function applying every active modifier for effect, with class_id's perk if it has that effect."""
+        function = self._current.get((effect, class_id))
+        if function is None:
+            function = self._build(effect, class_id)
+        return function
+
+    def apply(self, value: int, effect: str, class_id: str = None) -> int:
+        return self.modifier(effect, class_id)(value)
+
+    def _build(self, effect: str, class_id: str):
+        with self._lock:
+            event_ids = self._by_effect.get(effect, ())
+            perk = self._perks.get(class_id)
+            perk_applies = perk is not None and perk[0] == effect
+            key = (effect, event_ids, class_id if perk_applies else None)
+            function = self._composed.get(key)
+            if function is None:
+                functions = tuple(self._events[event_id][1] for event_id in event_ids)
+                if perk_applies:
+                    functions += (perk[1],)
+                function = self._composed[key] = compose(functions)
+            self._current[(effect, class_id)] = function
+            return function
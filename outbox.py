@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest, RetryAfter, TelegramError, Unauthorized
+
+import db
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+OUTBOX_POLL_MS = int(os.getenv('OUTBOX_POLL_MS', '500'))
+OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', '100'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+# Delivered rows are kept this long so a repeated dedup_key is still recognised
+OUTBOX_RETENTION_SECONDS = int(os.getenv('OUTBOX_RETENTION_SECONDS', '86400'))
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60.0
+# A claimed row that is neither sent nor rescheduled by then (its sender
+# died) becomes due again
+CLAIM_LEASE_SECONDS = 30.0
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def add(chat_id: int, text: str, reply_markup=None, dedup_key: str = None, pool=None) -> bool:
+    """Queue a message in the caller's transaction; returns False if dedup_key was already queued.
+
+    Nothing is sent until the transaction commits, and a rollback discards
+    the message along with the state change it announced.
+    """
+    pool = pool or db.pool
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = reply_markup.to_json()
+    now = time.time()
+    added = pool.connection().execute(
+        """INSERT OR IGNORE INTO outbox (dedup_key, chat_id, text, reply_markup, status, attempts, next_attempt_at, created_at)
+           VALUES (?, ?, ?, ?, ?, 0, ?, ?)""",
+        (dedup_key, chat_id, text, reply_markup, PENDING, now, now)
+    ).rowcount == 1
+    if added:
+        pool.after_commit(sender.wake)
+    return added
+
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait before retry number attempts, with jitter so retries don't line up."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxSender:
+    """Drains the outbox on a background thread, sending each claimed batch concurrently.
+
+    Sends go through a thread pool with the synchronous Bot, or all at once
+    on the asyncio runtime's event loop when started with its dispatcher.
+    Either way the outcome of a batch is written back from the sender
+    thread in one transaction. Delivery is at-least-once: a message whose
+    send succeeded but whose row wasn't marked sent before a crash goes out
+    again after the claim lease runs out.
+    """
+
+    def __init__(self, pool=None, workers: int = OUTBOX_WORKERS, poll_interval_ms: int = OUTBOX_POLL_MS,
+                 batch: int = OUTBOX_BATCH, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 retention_seconds: int = OUTBOX_RETENTION_SECONDS, clock=time.time):
+        self.pool = pool or db.pool
+        self.workers = workers
+        self.poll_interval = poll_interval_ms / 1000
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.clock = clock
+        self.bot = None
+        self.async_dispatcher = None
+        self._executor = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self, bot, async_dispatcher=None) -> None:
+        """Start sending with bot, or with async_dispatcher's AsyncBot on its event loop."""
+        if self.running:
+            return
+        self.bot = bot
+        self.async_dispatcher = async_dispatcher
+        self._stopped.clear()
+        if async_dispatcher is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox')
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop after the batch in flight; undelivered rows stay queued for the next start.
+
+        Call before stopping the async dispatcher it sends through.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _run(self) -> None:
+        last_purge = 0.0
+        while not self._stopped.is_set():
+            try:
+                if self.drain() < self.batch:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                if self.clock() - last_purge > 60:
+                    self.purge()
+                    last_purge = self.clock()
+            except Exception:
+                logger.exception("Outbox drain failed")
+                self._wakeup.wait(self.poll_interval)
+
+    def drain(self) -> int:
+        """Claim one batch of due messages and send it; returns the number claimed."""
+        rows = self.claim()
+        if rows:
+            self.record(rows, self._send_batch(rows))
+        return len(rows)
+
+    def claim(self) -> list:
+        """Take due rows, so no other sender thread or process picks them up until the lease ends."""
+        now = self.clock()
+        return self.pool.connection().execute(
+            """UPDATE outbox SET status = ?, next_attempt_at = ?
+               WHERE id IN (SELECT id FROM outbox
+                            WHERE status IN (?, ?) AND next_attempt_at <= ?
+                            ORDER BY next_attempt_at LIMIT ?)
+               RETURNING id, chat_id, text, reply_markup, attempts""",
+            (SENDING, now + CLAIM_LEASE_SECONDS, PENDING, SENDING, now, self.batch)
+        ).fetchall()
+
+    def _send_batch(self, rows) -> list:
+        """Send every row at once; returns None or the TelegramError raised, per row."""
+        if self.async_dispatcher is not None:
+            return self.async_dispatcher.run_coroutine(self._send_all(rows)).result()
+        return list(self._executor.map(self._send, rows))
+
+    def _send(self, row):
+        _, chat_id, text, reply_markup, _ = row
+        try:
+            self.bot.send_message(chat_id, text, reply_markup=reply_markup)
+        except TelegramError as e:
+            return e
+        return None
+
+    async def _send_all(self, rows) -> list:
+        bot = self.async_dispatcher.bot
+        results = await asyncio.gather(
+            *(bot.send_message(chat_id, text, reply_markup=reply_markup) for _, chat_id, text, reply_markup, _ in rows),
+            return_exceptions=True
+        )
+        errors = []
+        for result in results:
+            if isinstance(result, TelegramError):
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                errors.append(None)
+        return errors
+
+    def record(self, rows, errors) -> None:
+        """Mark each row sent, rescheduled with backoff, or failed for good."""
+        now = self.clock()
+        sent, retry, failed = [], [], []
+        for (message_id, _, _, _, attempts), error in zip(rows, errors):
+            attempts += 1
+            if error is None:
+                sent.append((SENT, attempts, now, message_id))
+            elif isinstance(error, RetryAfter):
+                retry.append((PENDING, attempts, now + error.retry_after, message_id))
+            elif isinstance(error, (Unauthorized, BadRequest)) or attempts >= self.max_attempts:
+                # Blocked bot, a malformed message, or out of attempts: retrying can't help
+                logger.warning("Dropping outbox message %d after %d attempts: %s", message_id, attempts, error)
+                failed.append((FAILED, attempts, message_id))
+            else:
+                retry.append((PENDING, attempts, now + backoff(attempts), message_id))
+        with self.pool.transaction() as conn:
+            conn.executemany("UPDATE outbox SET status = ?, attempts = ?, sent_at = ? WHERE id = ?", sent)
+            conn.executemany("UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ? WHERE id = ?", retry)
+            conn.executemany("UPDATE outbox SET status = ?, attempts = ? WHERE id = ?", failed)
+        with self._stats_lock:
+            self.sent += len(sent)
+            self.retried += len(retry)
+            self.failed += len(failed)
+
+    def purge(self) -> int:
+        """Delete delivered and abandoned rows older than the retention window."""
+        return self.pool.connection().execute(
+            "DELETE FROM outbox WHERE status IN (?, ?) AND created_at < ?",
+            (SENT, FAILED, self.clock() - self.retention_seconds)
+        ).rowcount
+
+    def stats(self) -> dict:
+        pending = self.pool.connection().execute(
+            "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)", (PENDING, SENDING)
+        ).fetchone()[0]
+        with self._stats_lock:
+            return {'pending': pending, 'sent': self.sent, 'retried': self.retried, 'failed': self.failed}
+
+
+sender = OutboxSender()
@@ -0,0 +1,32 @@
+import os
+
+import db
+
+INITIAL_RATING = 1000
+# Most a single result can move a rating; an even match moves it half as much
+ELO_K_FACTOR = float(os.getenv('ELO_K_FACTOR', '32'))
+# Rating gap at which the stronger player is expected to score 10x as often
+ELO_SCALE = 400.0
+
+
+def expected_score(rating: float, opponent_rating: float, scale: float = ELO_SCALE) -> float:
+    """The chance a player rated rating beats one rated opponent_rating."""
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / scale))
+
+
+def rating_change(winner_rating: int, loser_rating: int, k: float = ELO_K_FACTOR, scale: float = ELO_SCALE) -> int:
+    """Points the winner gains and the loser gives up, so ratings stay zero-sum.
+
+    Rounded half to even, like numpy.rint, so replay_history reproduces it.
+    """
+    return round(k * (1.0 - expected_score(winner_rating, loser_rating, scale)))
+
+
+def rate_result(winner_id, loser_id, k: float = ELO_K_FACTOR) -> int:
+    """The rating change for winner_id beating loser_id at their current ratings.
+
+    Call inside the transaction that applies it, so both ratings are read
+    and moved under one write lock.
+    """
+    rows = dict(db.fetchall("SELECT id, rating FROM users WHERE id IN (?, ?)", (winner_id, loser_id)))
+    return rating_change(rows.get(winner_id, INITIAL_RATING), rows.get(loser_id, INITIAL_RATING), k)
@@ -0,0 +1,136 @@
+import sys
+import threading
+
+import db
+
+# Canonical move strings, so a match holds shared references instead of
+# one copy per parsed callback
+MOVES = {move: sys.intern(move) for move in ('rock', 'paper', 'scissors')}
+
+
+class QueueEntry:
+    """A player waiting for an opponent at one stake, and their side of the match once paired."""
+
+    __slots__ = ('user_id', 'stake', 'username', 'rating', 'seq', 'enqueued_at')
+
+    def __init__(self, user_id: int, stake: int, username: str = None, rating: int = None):
+        self.user_id = user_id
+        self.stake = stake
+        self.username = username
+        self.rating = rating
+        self.seq = 0            # tie-break within a rating, set by the matchmaking engine
+        self.enqueued_at = 0.0  # set by the matchmaking engine
+
+    def as_row(self) -> list:
+        return [self.user_id, self.stake, self.username, self.rating]
+
+    def __repr__(self) -> str:
+        return f"QueueEntry({self.user_id}, stake={self.stake}, rating={self.rating})"
+
+
+class Match:
+    """One battle between two players; tournament matches carry their tournament and round."""
+
+    __slots__ = ('id', 'player1', 'player2', 'stake', 'started_at', 'move1', 'move2', 'tournament_id', 'round')
+
+    def __init__(self, match_id: int, player1: QueueEntry, player2: QueueEntry, stake: int, started_at: float,
+                 tournament_id: int = None, round: int = None):
+        self.id = match_id
+        self.player1 = player1
+        self.player2 = player2
+        self.stake = stake
+        self.started_at = started_at  # unix time
+        self.move1 = None
+        self.move2 = None
+        self.tournament_id = tournament_id
+        self.round = round
+
+    @property
+    def player_ids(self) -> tuple:
+        return self.player1.user_id, self.player2.user_id
+
+    def has_player(self, user_id) -> bool:
+        return user_id == self.player1.user_id or user_id == self.player2.user_id
+
+    def move_of(self, user_id):
+        return self.move1 if user_id == self.player1.user_id else self.move2
+
+    def record_move(self, user_id, move: str) -> None:
+        move = MOVES.get(move, move)
+        if user_id == self.player1.user_id:
+            self.move1 = move
+        else:
+            self.move2 = move
+
+    @property
+    def both_moved(self) -> bool:
+        return self.move1 is not None and self.move2 is not None
+
+    def __repr__(self) -> str:
+        return f"Match({self.id}, {self.player1.user_id} vs {self.player2.user_id}, stake={self.stake})"
+
+
+class Tournament:
+    """An elimination tournament; bracket.py moves it from round to round."""
+
+    __slots__ = ('id', 'creator', 'players', 'names', 'entry_fee', 'prize_pool', 'status', 'matches', 'round',
+                 'entrants', 'pending', 'advancing', 'eliminated', 'created_at')
+
+    def __init__(self, tournament_id: int, creator: int, entry_fee: int, created_at: str, creator_name: str = None):
+        self.id = tournament_id
+        self.creator = creator
+        self.players = [creator]   # everyone still in: seated players, then the current round's
+        self.names = {creator: creator_name} if creator_name else {}
+        self.entry_fee = entry_fee
+        self.prize_pool = entry_fee
+        self.status = "registering"
+        self.matches = []          # match ids of every round
+        self.round = 0
+        self.entrants = ()         # the players the first round started with
+        self.pending = set()       # this round's unfinished match ids
+        self.advancing = []        # this round's winners, and any bye
+        self.eliminated = []       # losers of each round so far
+        self.created_at = created_at
+
+    def name_of(self, user_id) -> str:
+        return self.names.get(user_id) or f"User {user_id}"
+
+    def __repr__(self) -> str:
+        return f"Tournament({self.id}, {len(self.players)} players, {self.status})"
+
+
+class IdAllocator:
+    """Monotonic ids from a named sequence in game.db, reserved a block at a time.
+
+    Each process reserves its own block with one upsert, so ids never
+    repeat across processes or restarts. Must be called outside a
+    transaction: a rolled-back reservation would hand out ids another
+    process can reserve again.
+    """
+
+    def __init__(self, name: str, block: int = 1000, pool=None):
+        self.name = name
+        self.block = block
+        self.pool = pool or db.pool
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        if self.pool.in_transaction():
+            raise RuntimeError(f"Allocate {self.name} ids outside a transaction")
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            allocated = self._next
+            self._next += 1
+            return allocated
+
+    def _reserve(self) -> None:
+        end = self.pool.connection().execute(
+            """INSERT INTO id_sequences (name, next_id) VALUES (?, ?)
+               ON CONFLICT (name) DO UPDATE SET next_id = next_id + ?
+               RETURNING next_id""",
+            (self.name, self.block + 1, self.block)
+        ).fetchone()[0]
+        self._next, self._end = end - self.block, end
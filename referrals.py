@@ -0,0 +1,87 @@
+import db
+import ledger
+import user_cache
+
+REFERRAL_REWARDS = {
+    'referrer': 200,  # Tokens for referring
+    'referee': 100    # Tokens for being referred
+}
+
+# Redemption outcomes
+REDEEMED = 'redeemed'
+INVALID_CODE = 'invalid_code'
+ALREADY_USED = 'already_used'
+
+_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def _base36(number: int) -> str:
+    digits = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = _ALPHABET[remainder] + digits
+        if not number:
+            return digits
+
+
+def _check_char(body: str) -> str:
+    return _ALPHABET[sum((i + 1) * _ALPHABET.index(ch) for i, ch in enumerate(body)) % 36]
+
+
+def generate_referral_code(user_id: int) -> str:
+    """Referral code derived from the user id, so no two users can share one.
+
+    The trailing check character lets obvious typos be rejected without a
+    database lookup. Codes of equal length have equal-length id parts, so
+    distinct ids always give distinct codes.
+    """
+    body = _base36(abs(user_id))
+    return f"REF{body}{_check_char(body)}"
+
+
+def looks_valid(code: str) -> bool:
+    """Cheap pre-check; codes issued before the current format are passed through."""
+    code = code.upper()
+    if not code.startswith('REF') or len(code) < 5:
+        return False
+    body, check = code[3:-1], code[-1]
+    if not all(ch in _ALPHABET for ch in code[3:]):
+        return False
+    # Old REF<id><4 digits> codes are all-digit; let the index decide those
+    return code[3:].isdigit() or _check_char(body) == check
+
+
+def ensure_code(user_id: int) -> str:
+    """Return the user's referral code, assigning one on first use."""
+    code = generate_referral_code(user_id)
+    db.execute("UPDATE users SET referral_code = ? WHERE id = ? AND referral_code IS NULL", (code, user_id))
+    row = db.fetchone("SELECT referral_code FROM users WHERE id = ?", (user_id,))
+    user_cache.write_through(user_id, referral_code=row[0])
+    return row[0]
+
+
+def redeem(user_id: int, code: str) -> str:
+    """Credit both sides of a referral in one transaction; returns an outcome constant."""
+    if not looks_valid(code):
+        return INVALID_CODE
+    with db.transaction() as conn:
+        referrer = conn.execute("SELECT id FROM users WHERE referral_code = ?", (code.upper(),)).fetchone()
+        if referrer is None or referrer[0] == user_id:
+            return INVALID_CODE
+        referrer_id = referrer[0]
+
+        # Marking the code as used is conditional, so a double tap redeems once
+        if not conn.execute(
+            "UPDATE users SET used_referral = 1 WHERE id = ? AND used_referral = 0", (user_id,)
+        ).rowcount:
+            return ALREADY_USED
+        user_cache.write_through(user_id, used_referral=1)
+
+        referrals = conn.execute(
+            "UPDATE users SET referrals = referrals + 1 WHERE id = ? RETURNING referrals", (referrer_id,)
+        ).fetchone()[0]
+        user_cache.write_through(referrer_id, referrals=referrals)
+
+        ledger.credit(referrer_id, REFERRAL_REWARDS['referrer'], ledger.REFERRAL_REWARD)
+        ledger.credit(user_id, REFERRAL_REWARDS['referee'], ledger.REFERRAL_BONUS)
+    return REDEEMED
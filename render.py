@@ -0,0 +1,57 @@
+import functools
+import json
+import threading
+
+# Reply markups go to the Bot API as pre-serialized JSON strings, which the
+# synchronous Bot, aio.AsyncBot and the outbox all pass through as they are.
+# Building them from telegram objects once, instead of per reply, takes the
+# object construction and to_json() off the hot path.
+
+# Private-use character standing in for the per-message value while a
+# template is serialized; json.dumps escapes it to a fixed sequence
+_SLOT = '\ue000'
+_SLOT_JSON = json.dumps(_SLOT)[1:-1]
+
+
+def serialize(markup) -> str:
+    return markup.to_json()
+
+
+def once(build):
+    """Decorate a markup builder that takes no arguments; it runs once and its JSON is reused."""
+    cached = []
+    lock = threading.Lock()
+
+    @functools.wraps(build)
+    def markup() -> str:
+        if not cached:
+            with lock:
+                if not cached:
+                    cached.append(serialize(build()))
+        return cached[0]
+    return markup
+
+
+class MarkupTemplate:
+    """A markup serialized once with a slot for one value, such as a game id.
+
+    render() splices the value into the precompiled JSON, so only values
+    that need no JSON escaping (ids and numbers) belong in the slot.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self._parts = None
+
+    def render(self, value) -> str:
+        parts = self._parts
+        if parts is None:
+            parts = self._parts = serialize(self.build(_SLOT)).split(_SLOT_JSON)
+        return str(value).join(parts)
+
+    __call__ = render
+
+
+def template(build):
+    """Decorate a one-argument markup builder to render from a MarkupTemplate."""
+    return functools.wraps(build)(MarkupTemplate(build))
@@ -1,12 +1,42 @@
+import functools
 import os
 import random
+import sys
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery
+from telegram.error import TelegramError
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters, CallbackContext
 from dotenv import load_dotenv
 import logging
 import sqlite3
+import time
 from datetime import datetime, timedelta
-from collections import defaultdict
+from typing import Optional
+
+import adb
+import aio
+import analytics
+import bracket
+import broadcast
+import keyed
+import db
+import leaderboard
+import ledger
+import lobby
+import matchmaking
+import metrics
+import migrations
+import modifiers
+import outbox
+import ratings
+import records
+import referrals
+import render
+import state
+import timers
+import user_cache
+import webhook
+import writer
+from db import transaction
 
 # Load environment variables and setup logging
 load_dotenv()
@@ -15,58 +45,25 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
 # Database functions
 def setup_database():
-    # Delete existing database if it exists
-    try:
-        os.remove('game.db')
-    except OSError:
-        pass
-
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY,
-                  tokens INTEGER DEFAULT 100,
-                  last_daily TEXT DEFAULT '',
-                  wins INTEGER DEFAULT 0,
-                  losses INTEGER DEFAULT 0,
-                  rating INTEGER DEFAULT 1000,
-                  character_class TEXT,
-                  referral_code TEXT,
-                  referrals INTEGER DEFAULT 0,
-                  used_referral INTEGER DEFAULT 0)''')
-    
-    # Game sessions table
-    c.execute('''CREATE TABLE IF NOT EXISTS game_sessions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  player1_id INTEGER,
-                  player2_id INTEGER,
-                  stake INTEGER,
-                  status TEXT,
-                  winner_id INTEGER,
-                  created_at TEXT,
-                  FOREIGN KEY (player1_id) REFERENCES users (id),
-                  FOREIGN KEY (player2_id) REFERENCES users (id))''')
-    
-    # Token transactions table
-    c.execute('''CREATE TABLE IF NOT EXISTS token_transactions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  amount INTEGER,
-                  transaction_type TEXT,
-                  timestamp TEXT,
-                  FOREIGN KEY (user_id) REFERENCES users (id))''')
-    
-    conn.commit()
-    conn.close()
+    """Bring game.db up to the latest schema; existing data is kept."""
+    start = time.perf_counter()
+    applied = migrations.migrate()
+    logging.info(
+        "Database ready at schema v%d in %.1f ms (%d migrations applied)",
+        migrations.LATEST_VERSION, (time.perf_counter() - start) * 1000, len(applied)
+    )
+
+def record_audit_event(user_id, event, detail=''):
+    writer.submit(
+        "INSERT INTO audit_events (user_id, event, detail, created_at) VALUES (?, ?, ?, ?)",
+        (user_id, event, detail, datetime.now().isoformat())
+    )
 
 def get_user_data(user_id):
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    c.execute("SELECT id, tokens, last_daily, wins, losses, rating, character_class, referral_code, referrals, used_referral FROM users WHERE id=?", (user_id,))
-    user = c.fetchone()
-    conn.close()
+    return user_cache.cache.load(user_id, lambda: load_user_row(user_id))
+
+def load_user_row(user_id):
+    user = db.fetchone("SELECT id, tokens, last_daily, wins, losses, rating, character_class, referral_code, referrals, used_referral FROM users WHERE id=?", (user_id,))
     if user is None:
         return None
     return {
@@ -82,32 +79,20 @@ def get_user_data(user_id):
         "used_referral": user[9]
     }
 
-def update_user_data(user_id, tokens, last_daily=None, wins=None, losses=None, rating=None, character_class=None, referrals=None, used_referral=None):
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    if last_daily and wins and losses and rating:
-        c.execute("UPDATE users SET tokens=?, last_daily=?, wins=?, losses=?, rating=? WHERE id=?", (tokens, last_daily, wins, losses, rating, user_id))
-    elif last_daily:
-        c.execute("UPDATE users SET tokens=?, last_daily=? WHERE id=?", (tokens, last_daily, user_id))
-    elif character_class:
-        c.execute("UPDATE users SET tokens=?, character_class=? WHERE id=?", (tokens, character_class, user_id))
-    elif referrals is not None:
-        c.execute("UPDATE users SET tokens=?, referrals=? WHERE id=?", (tokens, referrals, user_id))
-    elif used_referral is not None:
-        c.execute("UPDATE users SET tokens=?, used_referral=? WHERE id=?", (tokens, used_referral, user_id))
-    else:
-        c.execute("UPDATE users SET tokens=? WHERE id=?", (tokens, user_id))
-    conn.commit()
-    conn.close()
+def record_battle_result(user_id, won, rating_change):
+    """Bump win/loss counters and rating in place, without a read-modify-write."""
+    row = db.execute(
+        "UPDATE users SET wins = wins + ?, losses = losses + ?, rating = rating + ? WHERE id = ? RETURNING wins, losses, rating",
+        (int(won), int(not won), rating_change, user_id)
+    ).fetchone()
+    if row is not None:
+        user_cache.write_through(user_id, wins=row[0], losses=row[1], rating=row[2])
 
 def create_user(user_id, tokens):
     try:
-        conn = sqlite3.connect('game.db')
-        c = conn.cursor()
-        c.execute("INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, ?, '', 0, 0, 1000)", 
-                 (user_id, tokens))
-        conn.commit()
-        conn.close()
+        db.execute("INSERT INTO users (id, tokens, last_daily, wins, losses, rating) VALUES (?, ?, '', 0, 0, 1000)", 
+                   (user_id, tokens))
+        user_cache.write_through(user_id, tokens=tokens, rating=1000)
         return True
     except sqlite3.Error as e:
         print(f"Database error: {e}")
@@ -118,19 +103,22 @@ CHARACTER_CLASSES = {
     'warrior': {
         'name': '⚔️ Warrior',
         'description': 'Bonus token rewards from battles',
+        'effect': modifiers.BATTLE_REWARD,
         'perk': lambda reward: int(reward * 1.2),  # 20% more tokens
         'cost': 1000
     },
     'mage': {
         'name': '🔮 Mage',
         'description': 'Reduced power-up costs',
+        'effect': modifiers.POWERUP_COST,
         'perk': lambda cost: int(cost * 0.8),  # 20% cheaper power-ups
         'cost': 1000
     },
     'rogue': {
         'name': '🗡️ Rogue',
         'description': 'Chance to steal extra tokens',
-        'perk': lambda stake: random.randint(0, int(stake * 0.1)),  # Up to 10% extra tokens
+        'effect': modifiers.BATTLE_REWARD,
+        'perk': lambda reward: reward + random.randint(0, int(reward * 0.1)),  # Up to 10% extra tokens
         'cost': 1000
     }
 }
@@ -139,28 +127,32 @@ SPECIAL_EVENTS = {
     'double_rewards': {
         'name': '💰 Double Rewards Weekend',
         'description': 'All battle rewards are doubled',
+        'effect': modifiers.BATTLE_REWARD,
         'modifier': lambda reward: reward * 2,
         'duration': timedelta(days=2)
     },
     'power_hour': {
         'name': '⚡ Power Hour',
         'description': 'Power-ups are 50% off',
+        'effect': modifiers.POWERUP_COST,
         'modifier': lambda cost: cost // 2,
         'duration': timedelta(hours=1)
     },
     'tournament_frenzy': {
         'name': '🏆 Tournament Frenzy',
         'description': 'Tournament entry fees reduced by 50%',
+        'effect': modifiers.TOURNAMENT_FEE,
         'modifier': lambda fee: fee // 2,
         'duration': timedelta(hours=3)
     }
 }
 
+# Modifiers of the active events, composed with each class's perk
+event_modifiers = modifiers.ModifierPipeline(SPECIAL_EVENTS, CHARACTER_CLASSES)
+EVENT_EXPIRY_TICK_SECONDS = 1
+
 # Referral System
-REFERRAL_REWARDS = {
-    'referrer': 200,  # Tokens for referring
-    'referee': 100    # Tokens for being referred
-}
+REFERRAL_REWARDS = referrals.REFERRAL_REWARDS
 
 def show_character_classes(update: Update, context: CallbackContext) -> None:
     """Show available character classes and allow purchase."""
@@ -171,11 +163,19 @@ def show_character_classes(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("❌ Please start the bot first with /start")
         return
     
+    message, reply_markup = character_classes_view(user_data)
+    update.message.reply_text(message, reply_markup=reply_markup)
+
+def character_classes_view(user_data: dict):
+    """The class list and purchase buttons for a user; returns (message, reply_markup)."""
+    return class_list_view(user_data.get('character_class', None))
+
+@functools.lru_cache(maxsize=None)
+def class_list_view(current_class: Optional[str]):
+    """Rendered once per selected class; CHARACTER_CLASSES never changes at runtime."""
     message = "🎭 Character Classes:\n\n"
     keyboard = []
     
-    current_class = user_data.get('character_class', None)
-    
     for class_id, char_class in CHARACTER_CLASSES.items():
         status = "✅ Selected" if class_id == current_class else f"💰 Cost: {char_class['cost']} tokens"
         message += f"{char_class['name']}\n"
@@ -188,8 +188,7 @@ def show_character_classes(update: Update, context: CallbackContext) -> None:
                 callback_data=f"select_class_{class_id}"
             )])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text(message, reply_markup=reply_markup)
+    return message, render.serialize(InlineKeyboardMarkup(keyboard))
 
 def handle_class_selection(update: Update, context: CallbackContext) -> None:
     """Handle character class selection."""
@@ -210,45 +209,44 @@ def handle_class_selection(update: Update, context: CallbackContext) -> None:
         query.edit_message_text("❌ Invalid character class!")
         return
     
-    if user_data['tokens'] < char_class['cost']:
+    try:
+        purchase_class(user_id, class_id)
+    except ledger.InsufficientFunds:
         query.edit_message_text(f"❌ Not enough tokens! You need {char_class['cost']} tokens.")
         return
     
-    # Update user's tokens and character class
-    cursor = get_db().cursor()
-    cursor.execute(
-        "UPDATE users SET tokens = ?, character_class = ? WHERE id = ?",
-        (user_data['tokens'] - char_class['cost'], class_id, user_id)
-    )
-    get_db().commit()
-    
-    message = (
+    query.edit_message_text(class_selected_message(char_class), reply_markup=get_main_menu_keyboard())
+
+def purchase_class(user_id, class_id) -> None:
+    """Charge for the class and switch to it in one transaction; raises ledger.InsufficientFunds."""
+    with transaction() as c:
+        ledger.debit(user_id, CHARACTER_CLASSES[class_id]['cost'], ledger.CLASS_PURCHASE)
+        c.execute("UPDATE users SET character_class = ? WHERE id = ?", (class_id, user_id))
+        user_cache.write_through(user_id, character_class=class_id)
+        record_audit_event(user_id, 'class_selected', class_id)
+
+def class_selected_message(char_class: dict) -> str:
+    return (
         f"✨ Character class selected!\n\n"
         f"{char_class['name']}\n"
         f"{char_class['description']}\n"
         f"Use your new powers wisely!"
     )
-    query.edit_message_text(message, reply_markup=get_main_menu_keyboard())
 
-def start_special_event() -> None:
-    """Start a random special event."""
+def start_special_event(context: CallbackContext) -> None:
+    """Start a random special event (usable as a JobQueue callback)."""
     event_id = random.choice(list(SPECIAL_EVENTS.keys()))
     event = SPECIAL_EVENTS[event_id]
     
+    # The modifier is looked up in SPECIAL_EVENTS when applied, so the stored event stays plain data
     active_events[event_id] = {
         'name': event['name'],
         'description': event['description'],
         'end_time': datetime.now() + event['duration'],
-        'modifier': event['modifier']
     }
+    expire_events()
     
     # Notify all users about the event
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    c.execute("SELECT id FROM users")
-    users = c.fetchall()
-    conn.close()
-    
     message = (
         f"🎉 Special Event Started!\n\n"
         f"{event['name']}\n"
@@ -256,40 +254,27 @@ def start_special_event() -> None:
         f"Duration: {event['duration']}"
     )
     
-    for user_id in users:
-        try:
-            context.bot.send_message(user_id[0], message)
-        except:
-            continue
+    broadcast.start(context.bot, message)
 
-def check_active_events() -> dict:
-    """Check and clean up expired events."""
+def expire_events(context: CallbackContext = None) -> None:
+    """Periodic job: drop ended events and point event_modifiers at the ones still running.
+    
+    Also picks up events another process started, when state is shared.
+    """
     current_time = datetime.now()
-    expired = []
+    running = []
     
     for event_id, event in active_events.items():
         if current_time > event['end_time']:
-            expired.append(event_id)
+            active_events.pop(event_id)
+        else:
+            running.append(event_id)
     
-    for event_id in expired:
-        del active_events[event_id]
-    
-    return active_events
+    event_modifiers.refresh(running)
 
-def apply_event_modifiers(value: int, event_type: str) -> int:
-    """Apply active event modifiers to a value."""
-    events = check_active_events()
-    modified_value = value
-    
-    for event in events.values():
-        if event_type in event['name'].lower():
-            modified_value = event['modifier'](modified_value)
-    
-    return modified_value
-
-def generate_referral_code(user_id: int) -> str:
-    """Generate a unique referral code for a user."""
-    return f"REF{user_id}{random.randint(1000, 9999)}"
+def apply_event_modifiers(value: int, effect: str, class_id: str = None) -> int:
+    """Apply the active events' modifiers for effect (a modifiers.* effect), then class_id's perk if it has one."""
+    return event_modifiers.apply(value, effect, class_id)
 
 def show_referral_info(update: Update, context: CallbackContext) -> None:
     """Show user's referral code and statistics."""
@@ -302,33 +287,23 @@ def show_referral_info(update: Update, context: CallbackContext) -> None:
     
     referral_code = user_data.get('referral_code')
     if not referral_code:
-        referral_code = generate_referral_code(user_id)
-        conn = sqlite3.connect('game.db')
-        c = conn.cursor()
-        c.execute(
-            "UPDATE users SET referral_code = ? WHERE id = ?",
-            (referral_code, user_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        # Update user_data with new referral code
-        user_data['referral_code'] = referral_code
+        referral_code = referrals.ensure_code(user_id)
     
-    referrals = user_data.get('referrals', 0)
-    total_rewards = referrals * REFERRAL_REWARDS['referrer']
+    update.message.reply_text(referral_info_message(user_data, referral_code), reply_markup=get_main_menu_keyboard())
+
+def referral_info_message(user_data: dict, referral_code: str) -> str:
+    referral_count = user_data.get('referrals', 0)
+    total_rewards = referral_count * REFERRAL_REWARDS['referrer']
     
-    message = (
+    return (
         f"👥 Your Referral Information\n\n"
         f"Referral Code: {referral_code}\n"
-        f"Total Referrals: {referrals}\n"
+        f"Total Referrals: {referral_count}\n"
         f"Total Rewards Earned: {total_rewards} tokens\n\n"
         f"Share your referral code with friends!\n"
         f"They'll receive {REFERRAL_REWARDS['referee']} tokens\n"
         f"You'll receive {REFERRAL_REWARDS['referrer']} tokens"
     )
-    
-    update.message.reply_text(message, reply_markup=get_main_menu_keyboard())
 
 def handle_referral_code(update: Update, context: CallbackContext) -> None:
     """Handle referral code redemption."""
@@ -351,44 +326,72 @@ def handle_referral_code(update: Update, context: CallbackContext) -> None:
         update.message.reply_text("❌ You have already used a referral code!")
         return
     
-    # Find referrer
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE referral_code = ?", (referral_code,))
-    referrer = c.fetchone()
-    
-    if not referrer or referrer[0] == user_id:
+    # Find the referrer and reward both users in one transaction
+    outcome = referrals.redeem(user_id, referral_code)
+    if outcome == referrals.INVALID_CODE:
         update.message.reply_text("❌ Invalid referral code!")
         return
-    
-    # Update referrer
-    referrer_data = get_user_data(referrer[0])
-    update_user_data(
-        referrer[0],
-        referrer_data['tokens'] + REFERRAL_REWARDS['referrer'],
-        referrals=referrer_data.get('referrals', 0) + 1
-    )
-    
-    # Update referee
-    update_user_data(
-        user_id,
-        user_data['tokens'] + REFERRAL_REWARDS['referee'],
-        used_referral=True
-    )
+    if outcome == referrals.ALREADY_USED:
+        update.message.reply_text("❌ You have already used a referral code!")
+        return
+    record_audit_event(user_id, 'referral_redeemed', referral_code)
     
     update.message.reply_text(
         f"✨ Referral code redeemed!\n"
         f"You received {REFERRAL_REWARDS['referee']} tokens!"
     )
 
-# Game state management
-active_matches = {}
-matchmaking_queue = []
-player_states = defaultdict(dict)
-active_tournaments = {}
-tournament_queue = []
-active_events = {}
+# Keep leaderboards in step with every committed tokens/rating change
+user_cache.subscribe(leaderboard.record)
+
+# Update ingestion: 'polling' (default) or 'webhook'; workers sizes the handler executor and dispatcher pools
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '4'))
+# Handler stack: 'threads' (default) runs handlers on the dispatcher, 'asyncio' as coroutines on one event loop
+BOT_RUNTIME = os.getenv('BOT_RUNTIME', 'threads')
+# Telegram user ids allowed to run /stats, comma-separated
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Handlers run in order per user (and per match or tournament), in parallel across users
+handler_executor = keyed.KeyedExecutor(BOT_WORKERS, name='handlers')
+
+# Matchmaking job settings
+MATCHMAKING_TICK_SECONDS = 2
+QUEUE_TIMEOUT_SECONDS = 300
 
+# A match nobody finishes within this long is settled by the expiry job: a
+# lone mover wins by forfeit, otherwise a battle's stakes are refunded and a
+# tournament match is decided by a coin toss
+BATTLE_MOVE_TIMEOUT_SECONDS = int(os.getenv('BATTLE_MOVE_TIMEOUT_SECONDS', '120'))
+BATTLE_EXPIRY_TICK_SECONDS = 1
+BATTLE_EXPIRY_BATCH = 500  # expired battles settled per transaction
+
+# Game state management. Lives in this process, or in game.db with
+# STATE_BACKEND=sqlite so several bot processes share it; values read back
+# are copies, so change them with modify() rather than in place.
+active_matches = state.shared_map('matches')
+matchmaking_queue = matchmaking.SharedMatchmakingEngine() if state.store.shared else matchmaking.MatchmakingEngine()
+player_states = state.shared_map('player_states')
+active_tournaments = state.shared_map('tournaments')
+# /tournament requests waiting to be seated, as (user_id, username, entry_fee)
+tournament_queue = state.shared_queue('tournament_queue')
+active_events = state.shared_map('events')
+# Match and tournament ids come from sequences in game.db, so they never
+# collide with each other or with another process's
+match_ids = records.IdAllocator('matches')
+tournament_ids = records.IdAllocator('tournaments')
+# Move deadlines of the matches this process opened
+match_deadlines = timers.TimerWheel(tick=BATTLE_EXPIRY_TICK_SECONDS)
+
+# Tournaments still registering players, fullest first
+TOURNAMENT_ENTRY_FEE = 100
+TOURNAMENT_SIZE = 8
+TOURNAMENT_FILL_TICK_SECONDS = 1
+TOURNAMENT_FILL_BATCH = 500  # queued requests seated per tick
+tournament_lobbies = (lobby.SharedLobbyIndex(TOURNAMENT_SIZE) if state.store.shared
+                      else lobby.LobbyIndex(TOURNAMENT_SIZE))
+
+@render.once
 def get_main_menu_keyboard():
     keyboard = [
         [KeyboardButton("⚔️ Battle Mode"), KeyboardButton("💰 Check Balance")],
@@ -406,7 +409,10 @@ def start(update: Update, context: CallbackContext) -> None:
         create_user(user_id, 100)
         user_data = get_user_data(user_id)
     
-    welcome_message = (
+    update.message.reply_html(welcome_message(user, user_data), reply_markup=get_main_menu_keyboard())
+
+def welcome_message(user, user_data: dict) -> str:
+    return (
         f"🎉 Welcome to the Crypto Battle Arena, {user.mention_html()}! 🎉\n\n"
         f"You currently have {user_data['tokens']} tokens.\n"
         f"Stats: Wins: {user_data['wins']} | Losses: {user_data['losses']} | Rating: {user_data['rating']}\n\n"
@@ -416,12 +422,11 @@ def start(update: Update, context: CallbackContext) -> None:
         "/daily - Claim daily bonus\n"
         "/leaderboard - View top players\n"
         "/swap - Swap tokens for crypto\n"
-        "/tournament - Create or join a tournament\n"
+        "/tournament - Join the fullest open tournament (/tournament new to start your own)\n"
         "/referral - Redeem a referral code\n"
         "/classes - View character classes\n"
         "/referralinfo - View your referral information"
     )
-    update.message.reply_html(welcome_message, reply_markup=get_main_menu_keyboard())
 
 def handle_menu_choice(update: Update, context: CallbackContext) -> None:
     text = update.message.text
@@ -446,6 +451,31 @@ def handle_menu_choice(update: Update, context: CallbackContext) -> None:
     else:
         update.message.reply_text("Please use the menu buttons or commands.", reply_markup=get_main_menu_keyboard())
 
+def show_stats(update: Update, context: CallbackContext) -> None:
+    """Admin-only digest of handler, SQL and Bot API latencies and queue depths."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        update.message.reply_text("❌ This command is for admins only.")
+        return
+    update.message.reply_text(stats_message())
+
+def stats_message() -> str:
+    return f"📊 Bot stats\n\n{metrics.report()}"
+
+def register_gauges(async_dispatcher=None) -> None:
+    """Queue depths, read by the refresh_gauges job for /metrics and whenever /stats is asked for."""
+    if async_dispatcher is not None:
+        metrics.registry.gauge('bot_handlers_in_flight', "Updates being handled or waiting for their turn",
+                               lambda: async_dispatcher.in_flight)
+    else:
+        metrics.registry.gauge('bot_handlers_in_flight', "Updates being handled or waiting for their turn",
+                               lambda: handler_executor.stats()['depth'])
+    metrics.registry.gauge('write_behind_pending', "Rows waiting in the write-behind queue",
+                           lambda: writer.queue.stats()['pending'])
+    metrics.registry.gauge('outbox_pending', "Notifications waiting to be sent", lambda: outbox.sender.stats()['pending'])
+    metrics.registry.gauge('matchmaking_waiting', "Players waiting for an opponent", lambda: len(matchmaking_queue))
+    metrics.registry.gauge('active_matches', "Matches in progress", lambda: len(active_matches))
+    metrics.registry.gauge('active_tournaments', "Tournaments registering or in progress", lambda: len(active_tournaments))
+
 def check_balance(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     user_data = get_user_data(user_id)
@@ -477,19 +507,21 @@ def start_battle(update: Update, context: CallbackContext) -> None:
         )
         return
     
+    update.message.reply_text(
+        "⚔️ Welcome to Battle Mode!\n\n"
+        "Choose your stake amount:",
+        reply_markup=get_stake_keyboard()
+    )
+
+@render.once
+def get_stake_keyboard():
     keyboard = [
         [InlineKeyboardButton("50 tokens", callback_data="stake_50")],
         [InlineKeyboardButton("100 tokens", callback_data="stake_100")],
         [InlineKeyboardButton("200 tokens", callback_data="stake_200")],
         [InlineKeyboardButton("500 tokens", callback_data="stake_500")]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    update.message.reply_text(
-        "⚔️ Welcome to Battle Mode!\n\n"
-        "Choose your stake amount:",
-        reply_markup=reply_markup
-    )
+    return InlineKeyboardMarkup(keyboard)
 
 def handle_battle_stake(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
@@ -511,26 +543,22 @@ def handle_battle_stake(update: Update, context: CallbackContext) -> None:
         return
     
     # Add player to matchmaking queue
-    player_data = {
-        "user_id": user_id,
-        "stake": stake,
-        "username": query.from_user.username or query.from_user.first_name,
-        "rating": user_data["rating"]
-    }
+    player_data = records.QueueEntry(
+        user_id, stake, query.from_user.username or query.from_user.first_name, user_data["rating"]
+    )
     
-    # Check if there's a matching opponent
-    opponent = None
-    for i, p in enumerate(matchmaking_queue):
-        if p["stake"] == stake and p["user_id"] != user_id:
-            opponent = matchmaking_queue.pop(i)
-            break
+    # Check if there's a matching opponent at this stake and a close rating
+    opponent, queued = matchmaking_queue.pop_opponent_or_enqueue(player_data)
     
     if opponent:
         # Start battle session
         start_battle_session(query, context, player_data, opponent)
+    elif not queued:
+        query.edit_message_text(
+            f"⌛ You're already waiting for an opponent at {stake} tokens.\n"
+            "The battle will start automatically when an opponent is found."
+        )
     else:
-        # Add to queue
-        matchmaking_queue.append(player_data)
         query.edit_message_text(
             f"⌛ Waiting for an opponent...\n"
             f"Stake amount: {stake} tokens\n"
@@ -538,85 +566,141 @@ def handle_battle_stake(update: Update, context: CallbackContext) -> None:
             "The battle will start automatically when an opponent is found."
         )
 
-def start_battle_session(query: CallbackQuery, context: CallbackContext, 
-                        player1: dict, player2: dict) -> None:
-    game_id = random.randint(1000000, 9999999)
-    stake = player1["stake"]
-    
-    # Verify both players have enough tokens
-    for player in [player1, player2]:
-        user_data = get_user_data(player["user_id"])
-        if not user_data or user_data["tokens"] < stake:
-            query.edit_message_text(
-                "❌ Battle cancelled: One of the players doesn't have enough tokens."
-            )
-            return
-    
+def start_battle_session(query: Optional[CallbackQuery], context: CallbackContext, 
+                        player1: records.QueueEntry, player2: records.QueueEntry) -> None:
+    """Start a battle; query is None when the matchmaking tick paired the players."""
     try:
-        # Create game session in database
-        conn = sqlite3.connect('game.db')
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO game_sessions (player1_id, player2_id, stake, status, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (player1["user_id"], player2["user_id"], stake, "active", datetime.now().isoformat()))
-        conn.commit()
-        
-        # Deduct stakes from both players
-        for player in [player1, player2]:
-            user_data = get_user_data(player["user_id"])
-            new_balance = user_data["tokens"] - stake
-            c.execute("UPDATE users SET tokens = ? WHERE id = ?", (new_balance, player["user_id"]))
-        conn.commit()
-        conn.close()
-        
-        # Initialize game state
-        active_matches[game_id] = {
-            "player1": player1,
-            "player2": player2,
-            "stake": stake,
-            "moves": {},
-            "started_at": datetime.now().isoformat()
-        }
-        
-        # Create battle UI for both players
-        keyboard = [
-            [InlineKeyboardButton("🗿 Rock", callback_data=f"move_{game_id}_rock")],
-            [InlineKeyboardButton("📄 Paper", callback_data=f"move_{game_id}_paper")],
-            [InlineKeyboardButton("✂️ Scissors", callback_data=f"move_{game_id}_scissors")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        battle_message = (
-            f"⚔️ Battle Started! Game #{game_id}\n\n"
-            f"🆚 {player1['username']} vs {player2['username']}\n"
-            f"💰 Stake: {stake} tokens\n"
-            f"🏆 Prize Pool: {stake * 2} tokens\n\n"
-            "Make your move!"
-        )
-        
-        # Send battle UI to both players
-        context.bot.send_message(
-            player1["user_id"],
-            battle_message,
-            reply_markup=reply_markup
+        begin_battle(player1, player2, player1.stake)
+    except ledger.LedgerError:
+        report_to_players(
+            query, context, [player1, player2],
+            "❌ Battle cancelled: One of the players doesn't have enough tokens."
         )
-        context.bot.send_message(
-            player2["user_id"],
-            battle_message,
-            reply_markup=reply_markup
-        )
-        
+        return
+    
+    try:
         # Update the original message
-        query.edit_message_text(
-            f"✅ Battle started! Check your private messages with the bot."
-        )
+        if query is not None:
+            query.edit_message_text(
+                f"✅ Battle started! Check your private messages with the bot."
+            )
     except Exception as e:
         print(f"Error in start_battle_session: {e}")
-        query.edit_message_text(
+        report_to_players(
+            query, context, [player1, player2],
             "❌ An error occurred while starting the battle. Please try again."
         )
 
+def begin_battle(player1: records.QueueEntry, player2: records.QueueEntry, stake: int) -> int:
+    """Take both stakes, open the match and queue the battle UI for both players in one transaction.
+
+    Returns the new game id. Raises ledger.LedgerError, with nothing taken
+    or sent, if a stake can't be paid.
+    """
+    game_id = match_ids.next()
+    battle_message, reply_markup = battle_start_view(game_id, player1, player2, stake)
+    with transaction():
+        collect_stakes(player1, player2, stake)
+        open_match(game_id, player1, player2, stake)
+        try:
+            for player in (player1, player2):
+                outbox.add(player.user_id, battle_message, reply_markup,
+                           dedup_key=battle_notice_key(game_id, 'start', player.user_id))
+        except Exception:
+            # The in-process store doesn't roll back with the transaction
+            close_match(game_id)
+            raise
+    return game_id
+
+def battle_notice_key(game_id: int, notice: str, user_id) -> str:
+    return f"battle:{game_id}:{notice}:{user_id}"
+
+def collect_stakes(player1: records.QueueEntry, player2: records.QueueEntry, stake: int) -> None:
+    """Deduct stakes from both players; a failed debit rolls back both."""
+    with transaction():
+        for player in [player1, player2]:
+            ledger.debit(player.user_id, stake, ledger.BATTLE_STAKE)
+
+def open_match(game_id: int, player1: records.QueueEntry, player2: records.QueueEntry, stake: int) -> records.Match:
+    match = records.Match(game_id, player1, player2, stake, time.time())
+    active_matches[game_id] = match
+    match_deadlines.schedule(game_id, match.started_at + BATTLE_MOVE_TIMEOUT_SECONDS)
+    return match
+
+def close_match(game_id: int) -> Optional[records.Match]:
+    """Take a match out of play; returns it, or None if another handler or process already did."""
+    match_deadlines.cancel(game_id)
+    return active_matches.pop(game_id)
+
+def reopen_match(game_id: int, game: records.Match) -> None:
+    """Put a match that could not be settled back into play; its fresh deadline retries the settlement."""
+    active_matches[game_id] = game
+    match_deadlines.schedule(game_id, time.time() + BATTLE_MOVE_TIMEOUT_SECONDS)
+
+def arm_match_deadlines() -> int:
+    """Track the deadlines of matches already in the state store, e.g. after a restart; returns how many."""
+    armed = 0
+    for game_id, match in active_matches.items():
+        match_deadlines.schedule(game_id, match.started_at + BATTLE_MOVE_TIMEOUT_SECONDS)
+        armed += 1
+    return armed
+
+def battle_start_view(game_id: int, player1: records.QueueEntry, player2: records.QueueEntry, stake: int):
+    """The battle announcement and move buttons sent to both players; returns (message, reply_markup)."""
+    message = (
+        f"⚔️ Battle Started! Game #{game_id}\n\n"
+        f"🆚 {player1.username} vs {player2.username}\n"
+        f"💰 Stake: {stake} tokens\n"
+        f"🏆 Prize Pool: {stake * 2} tokens\n\n"
+        "Make your move!"
+    )
+    return message, battle_move_keyboard(game_id)
+
+@render.template
+def battle_move_keyboard(game_id):
+    keyboard = [
+        [InlineKeyboardButton("🗿 Rock", callback_data=f"move_{game_id}_rock")],
+        [InlineKeyboardButton("📄 Paper", callback_data=f"move_{game_id}_paper")],
+        [InlineKeyboardButton("✂️ Scissors", callback_data=f"move_{game_id}_scissors")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def report_to_players(query: Optional[CallbackQuery], context: CallbackContext, players: list, text: str) -> None:
+    """Edit the originating message, or message every player when there is none."""
+    if query is not None:
+        query.edit_message_text(text)
+    else:
+        notify_users(context, [(player.user_id, text) for player in players])
+
+def notify_users(context: CallbackContext, messages: list) -> None:
+    """Send (chat_id, text) pairs off the calling thread; failures are logged and skipped."""
+    def send_all():
+        for chat_id, text in messages:
+            try:
+                context.bot.send_message(chat_id, text)
+            except TelegramError:
+                logging.warning("Could not notify %s", chat_id, exc_info=True)
+    if messages:
+        context.dispatcher.run_async(send_all)
+
+def matchmaking_tick(context: CallbackContext) -> None:
+    """Periodic job: pair compatible queued players and expire stale queue entries."""
+    for player1, player2 in matchmaking_queue.match_batch():
+        # Queued behind anything either player is already doing
+        handler_executor.submit(
+            (('user', player1.user_id), ('user', player2.user_id)),
+            start_battle_session, None, context, player1, player2
+        )
+    
+    # Stakes are only taken when a battle starts, so expired entries have nothing to refund
+    expired = matchmaking_queue.expire(QUEUE_TIMEOUT_SECONDS)
+    notify_users(context, [
+        (player.user_id,
+         f"⌛ No opponent found for your {player.stake} token battle. "
+         "You've been removed from the queue - tap ⚔️ Battle Mode to try again.")
+        for player in expired
+    ])
+
 def handle_battle_move(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     query.answer()
@@ -626,28 +710,23 @@ def handle_battle_move(update: Update, context: CallbackContext) -> None:
     game_id = int(game_id)
     user_id = query.from_user.id
     
-    if game_id not in active_matches:
+    outcome, game = record_move(game_id, user_id, move)
+    
+    if outcome == 'ended':
         query.edit_message_text("❌ This battle has already ended or expired.")
         return
     
-    game = active_matches[game_id]
-    
-    # Verify player is in the game
-    if user_id != game["player1"]["user_id"] and user_id != game["player2"]["user_id"]:
+    if outcome == 'not_player':
         query.edit_message_text("❌ You are not a participant in this battle.")
         return
     
-    # Check if player already made a move
-    if user_id in game["moves"]:
+    if outcome == 'already_moved':
         query.edit_message_text(
-            f"✋ You've already chosen {game['moves'][user_id]}.\n"
+            f"✋ You've already chosen {game.move_of(user_id)}.\n"
             "Waiting for your opponent..."
         )
         return
     
-    # Record the move
-    game["moves"][user_id] = move
-    
     # Update UI for this player
     query.edit_message_text(
         f"✅ You chose {move}!\n"
@@ -655,129 +734,248 @@ def handle_battle_move(update: Update, context: CallbackContext) -> None:
     )
     
     # If both players have moved, resolve the battle immediately
-    if len(game["moves"]) == 2:
+    if outcome == 'both_moved':
         resolve_battle(context, game_id)
         return
 
+def record_move(game_id: int, user_id, move: str):
+    """Record a move in one atomic update; returns (outcome, game).
+
+    outcome is 'ended', 'not_player', 'already_moved', 'recorded', or
+    'both_moved' for the one move that completed the game, so exactly one
+    handler in any process goes on to resolve it.
+    """
+    outcome = None
+    
+    def apply(game):
+        nonlocal outcome
+        if not game.has_player(user_id):
+            outcome = 'not_player'
+        elif game.move_of(user_id) is not None:
+            outcome = 'already_moved'
+        else:
+            game.record_move(user_id, move)
+            outcome = 'both_moved' if game.both_moved else 'recorded'
+        return game
+    
+    try:
+        game = active_matches.modify(game_id, apply)
+    except KeyError:
+        return 'ended', None
+    return outcome, game
+
+MOVE_VALUES = {"rock": 0, "paper": 1, "scissors": 2}
+
 def resolve_battle(context: CallbackContext, game_id: int) -> None:
+    # Taken out of the shared state first, so no other handler can settle it too
+    game = close_match(game_id)
+    if game is None:
+        return
     try:
-        game = active_matches[game_id]
-        p1_id = game["player1"]["user_id"]
-        p2_id = game["player2"]["user_id"]
-        p1_move = game["moves"][p1_id]
-        p2_move = game["moves"][p2_id]
-        stake = game["stake"]
-        
-        # Determine winner
-        moves = {"rock": 0, "paper": 1, "scissors": 2}
-        p1_val = moves[p1_move]
-        p2_val = moves[p2_move]
-        
-        # Calculate result (0 = draw, 1 = p1 wins, 2 = p2 wins)
-        result = (p1_val - p2_val) % 3
-        
-        # Get user data
-        p1_data = get_user_data(p1_id)
-        p2_data = get_user_data(p2_id)
-        
-        if not p1_data or not p2_data:
-            context.bot.send_message(p1_id, "❌ Error: Could not resolve battle. Please contact support.")
-            context.bot.send_message(p2_id, "❌ Error: Could not resolve battle. Please contact support.")
-            del active_matches[game_id]
-            return
-        
-        # Update game session status
-        conn = sqlite3.connect('game.db')
-        c = conn.cursor()
+        p1_id, p2_id = game.player_ids
         
         try:
-            if result == 0:  # Draw
-                # Return stakes to both players
-                p1_tokens = p1_data["tokens"] + stake
-                p2_tokens = p2_data["tokens"] + stake
-                winner_id = None
-                result_message = (
-                    f"🤝 It's a draw!\n"
-                    f"Player 1 chose: {p1_move}\n"
-                    f"Player 2 chose: {p2_move}\n"
-                    f"Stakes have been returned."
-                )
-            else:
-                # Determine winner and loser
-                winner_id = p1_id if result == 1 else p2_id
-                loser_id = p2_id if result == 1 else p1_id
-                
-                # Calculate prize (90% of total pot)
-                total_pot = stake * 2
-                prize = int(total_pot * 0.9)
-                
-                # Update tokens
-                if winner_id == p1_id:
-                    p1_data["wins"] += 1
-                    p2_data["losses"] += 1
-                    p1_tokens = p1_data["tokens"] + prize
-                    p2_tokens = p2_data["tokens"]
-                else:
-                    p2_data["wins"] += 1
-                    p1_data["losses"] += 1
-                    p1_tokens = p1_data["tokens"]
-                    p2_tokens = p2_data["tokens"] + prize
-                
-                # Update ratings (±25 points)
-                rating_change = 25
-                if winner_id == p1_id:
-                    p1_data["rating"] += rating_change
-                    p2_data["rating"] -= rating_change
-                else:
-                    p1_data["rating"] -= rating_change
-                    p2_data["rating"] += rating_change
-                
-                result_message = (
-                    f"🏆 {game['player1' if winner_id == p1_id else 'player2']['username']} wins!\n"
-                    f"Player 1 chose: {p1_move}\n"
-                    f"Player 2 chose: {p2_move}\n"
-                    f"Prize: {prize} tokens (90% of pot)"
-                )
-            
-            # Update user data in database
-            c.execute("UPDATE users SET tokens=?, wins=?, losses=?, rating=? WHERE id=?",
-                     (p1_tokens, p1_data["wins"], p1_data["losses"], p1_data["rating"], p1_id))
-            c.execute("UPDATE users SET tokens=?, wins=?, losses=?, rating=? WHERE id=?",
-                     (p2_tokens, p2_data["wins"], p2_data["losses"], p2_data["rating"], p2_id))
-            
-            conn.commit()
-            
-            # Send result messages to both players
-            context.bot.send_message(
-                p1_id,
-                result_message + f"\n\nYour new balance is {p1_tokens} tokens.",
-                reply_markup=get_main_menu_keyboard()
-            )
-            context.bot.send_message(
-                p2_id,
-                result_message + f"\n\nYour new balance is {p2_tokens} tokens.",
-                reply_markup=get_main_menu_keyboard()
-            )
-            
+            # Results are sent by the outbox once the payout commits, not from this thread
+            settle_match(game_id, game)
         except Exception as e:
             print(f"Database error in resolve_battle: {e}")
-            conn.rollback()
+            reopen_match(game_id, game)
             context.bot.send_message(p1_id, "❌ An error occurred while resolving the battle.")
             context.bot.send_message(p2_id, "❌ An error occurred while resolving the battle.")
-        finally:
-            conn.close()
-            # Clean up the match
-            del active_matches[game_id]
             
     except Exception as e:
         print(f"Error in resolve_battle: {e}")
         try:
             context.bot.send_message(p1_id, "❌ An error occurred while resolving the battle.")
             context.bot.send_message(p2_id, "❌ An error occurred while resolving the battle.")
-            del active_matches[game_id]
         except:
             pass
 
+def settle_match(game_id: int, game: records.Match) -> None:
+    """Settle a match with both moves in: a battle's payout, or a tournament result."""
+    if game.tournament_id is None:
+        settle_and_notify_battle(game_id, game)
+    else:
+        settle_tournament_match(game_id, game, match_winner(game))
+
+def match_winner(game: records.Match) -> Optional[records.QueueEntry]:
+    """The winning side of a match with both moves in, or None for a draw."""
+    result = (MOVE_VALUES[game.move1] - MOVE_VALUES[game.move2]) % 3
+    if result == 0:
+        return None
+    return game.player1 if result == 1 else game.player2
+
+def settle_and_notify_battle(game_id: int, game: records.Match) -> None:
+    """Pay out a finished game and queue both players' results in the same transaction."""
+    with transaction():
+        result_message, p1_tokens, p2_tokens = settle_battle(game)
+        for player, tokens in ((game.player1, p1_tokens), (game.player2, p2_tokens)):
+            outbox.add(
+                player.user_id,
+                result_message + f"\n\nYour new balance is {tokens} tokens.",
+                get_main_menu_keyboard(),
+                dedup_key=battle_notice_key(game_id, 'result', player.user_id)
+            )
+
+def settle_battle(game: records.Match):
+    """Pay out a finished game and record it; returns (result_message, p1_tokens, p2_tokens)."""
+    p1_id, p2_id = game.player_ids
+    p1_move = game.move1
+    p2_move = game.move2
+    
+    # Determine winner
+    p1_val = MOVE_VALUES[p1_move]
+    p2_val = MOVE_VALUES[p2_move]
+    
+    # Calculate result (0 = draw, 1 = p1 wins, 2 = p2 wins)
+    result = (p1_val - p2_val) % 3
+    
+    # Payouts and stats go in one transaction; balances come back from the ledger
+    with transaction():
+        if result == 0:  # Draw
+            # Return stakes to both players
+            p1_tokens, p2_tokens = refund_stakes(game)
+            winner_id = None
+            result_message = (
+                f"🤝 It's a draw!\n"
+                f"Player 1 chose: {p1_move}\n"
+                f"Player 2 chose: {p2_move}\n"
+                f"Stakes have been returned."
+            )
+        else:
+            winner_id = p1_id if result == 1 else p2_id
+            prize, p1_tokens, p2_tokens = pay_winner(game, winner_id)
+            result_message = (
+                f"🏆 {(game.player1 if winner_id == p1_id else game.player2).username} wins!\n"
+                f"Player 1 chose: {p1_move}\n"
+                f"Player 2 chose: {p2_move}\n" +
+                prize_text(game, prize)
+            )
+        
+        record_game_session(game, "draw" if winner_id is None else "completed", winner_id)
+    
+    return result_message, p1_tokens, p2_tokens
+
+def refund_stakes(game: records.Match):
+    """Return both stakes; returns (p1_tokens, p2_tokens)."""
+    p1_id, p2_id = game.player_ids
+    with transaction():
+        return (ledger.credit(p1_id, game.stake, ledger.BATTLE_REFUND),
+                ledger.credit(p2_id, game.stake, ledger.BATTLE_REFUND))
+
+def prize_text(game: records.Match, prize: int) -> str:
+    """The prize line of a battle result, naming any event or class bonus paid on top of 90% of the pot."""
+    base = int(game.stake * 2 * 0.9)
+    if prize > base:
+        return f"Prize: {prize} tokens (90% of pot + {prize - base} bonus)"
+    return f"Prize: {prize} tokens (90% of pot)"
+
+def pay_winner(game: records.Match, winner_id):
+    """Pay winner_id 90% of the pot, plus event and class bonuses, and move both ELO ratings; returns (prize, p1_tokens, p2_tokens)."""
+    p1_id, p2_id = game.player_ids
+    loser_id = p2_id if winner_id == p1_id else p1_id
+    winner = get_user_data(winner_id)
+    prize = apply_event_modifiers(int(game.stake * 2 * 0.9), modifiers.BATTLE_REWARD,
+                                  winner and winner['character_class'])
+    with transaction():
+        winner_tokens = ledger.credit(winner_id, prize, ledger.BATTLE_PAYOUT)
+        loser_tokens = ledger.balance(loser_id)
+        
+        rating_change = ratings.rate_result(winner_id, loser_id)
+        record_battle_result(winner_id, True, rating_change)
+        record_battle_result(loser_id, False, -rating_change)
+    if winner_id == p1_id:
+        return prize, winner_tokens, loser_tokens
+    return prize, loser_tokens, winner_tokens
+
+def record_game_session(game: records.Match, status: str, winner_id) -> None:
+    # Record the finished game; game_sessions is append-only
+    p1_id, p2_id = game.player_ids
+    writer.submit("""
+        INSERT INTO game_sessions (player1_id, player2_id, stake, status, winner_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (p1_id, p2_id, game.stake, status, winner_id, datetime.fromtimestamp(game.started_at).isoformat()))
+
+def expire_battles(context: CallbackContext) -> None:
+    """Periodic job: settle the matches whose move deadline has passed."""
+    games = []
+    for game_id in match_deadlines.advance():
+        # Whoever takes the match out of play settles it, so a last-second move can't also resolve it
+        game = active_matches.pop(game_id)
+        if game is None:
+            continue
+        try:
+            if game.both_moved:
+                # Completed at the deadline; settled as usual
+                settle_match(game_id, game)
+            elif game.tournament_id is not None:
+                settle_tournament_match(game_id, game, expired_match_winner(game))
+            else:
+                games.append((game_id, game))
+        except Exception:
+            logging.exception("Could not settle expired match %s", game_id)
+            reopen_match(game_id, game)
+    for i in range(0, len(games), BATTLE_EXPIRY_BATCH):
+        settle_expired_battles(games[i:i + BATTLE_EXPIRY_BATCH])
+
+def expired_match_winner(game: records.Match) -> records.QueueEntry:
+    """Who advances from an expired tournament match: the only player who moved, else a coin toss."""
+    movers = [player for player in (game.player1, game.player2) if game.move_of(player.user_id) is not None]
+    return movers[0] if movers else random.choice((game.player1, game.player2))
+
+def settle_expired_battles(games: list) -> None:
+    """Settle [(game_id, game)] in one transaction, queueing both players' results with it.
+
+    If the batch fails, each game is retried in its own transaction; one
+    that still fails goes back into play with a fresh deadline.
+    """
+    try:
+        with transaction():
+            for game_id, game in games:
+                settle_and_notify_expired_battle(game_id, game)
+    except Exception:
+        if len(games) > 1:
+            for game in games:
+                settle_expired_battles([game])
+            return
+        game_id, game = games[0]
+        logging.exception("Could not settle expired battle %s", game_id)
+        reopen_match(game_id, game)
+
+def settle_and_notify_expired_battle(game_id: int, game: records.Match) -> None:
+    with transaction():
+        result_message, p1_tokens, p2_tokens = settle_expired_battle(game)
+        for player, tokens in ((game.player1, p1_tokens), (game.player2, p2_tokens)):
+            outbox.add(
+                player.user_id,
+                result_message + f"\n\nYour new balance is {tokens} tokens.",
+                get_main_menu_keyboard(),
+                dedup_key=battle_notice_key(game_id, 'result', player.user_id)
+            )
+
+def settle_expired_battle(game: records.Match):
+    """Forfeit the idle player, or refund both if neither moved; returns (result_message, p1_tokens, p2_tokens)."""
+    movers = [player for player in (game.player1, game.player2) if game.move_of(player.user_id) is not None]
+    with transaction():
+        if len(movers) == 1:
+            winner = movers[0]
+            idle = game.player2 if winner is game.player1 else game.player1
+            prize, p1_tokens, p2_tokens = pay_winner(game, winner.user_id)
+            record_game_session(game, "forfeit", winner.user_id)
+            result_message = (
+                f"⌛ {idle.username} didn't move in time.\n"
+                f"🏆 {winner.username} wins by forfeit!\n" +
+                prize_text(game, prize)
+            )
+        else:
+            p1_tokens, p2_tokens = refund_stakes(game)
+            record_game_session(game, "expired", None)
+            result_message = (
+                "⌛ Neither player moved in time.\n"
+                "Stakes have been returned."
+            )
+    return result_message, p1_tokens, p2_tokens
+
 def show_swap_options(update: Update, context: CallbackContext) -> None:
     user_data = get_user_data(update.effective_user.id)
     min_swap = 1000
@@ -789,52 +987,76 @@ def show_swap_options(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    keyboard = [
-        [InlineKeyboardButton("1000 Tokens → 0.001 ETH", callback_data="swap_1000_eth")],
-        [InlineKeyboardButton("5000 Tokens → 0.005 ETH", callback_data="swap_5000_eth")],
-        [InlineKeyboardButton("10000 Tokens → 0.01 ETH", callback_data="swap_10000_eth")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     update.message.reply_text(
         "💱 Token Swap\n\n"
         "Choose amount to swap for ETH:\n"
         "(You'll need to provide your ETH address)",
-        reply_markup=reply_markup
+        reply_markup=get_swap_keyboard()
     )
 
+@render.once
+def get_swap_keyboard():
+    keyboard = [
+        [InlineKeyboardButton("1000 Tokens → 0.001 ETH", callback_data="swap_1000_eth")],
+        [InlineKeyboardButton("5000 Tokens → 0.005 ETH", callback_data="swap_5000_eth")],
+        [InlineKeyboardButton("10000 Tokens → 0.01 ETH", callback_data="swap_10000_eth")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+DAILY_BONUS = 50
+
 def claim_daily_bonus(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    user_data = get_user_data(user_id)
+    if not get_user_data(user_id):
+        update.message.reply_text("❌ Please start the bot first with /start")
+        return
 
-    now = datetime.now().strftime('%Y-%m-%d')
-    if user_data["last_daily"] == now:
+    new_balance = claim_daily(user_id)
+    if new_balance is None:
         update.message.reply_text(
             '❌ You already claimed your daily bonus today. Come back tomorrow!',
             reply_markup=get_main_menu_keyboard()
         )
         return
 
-    bonus = 50
-    user_data["tokens"] += bonus
-    update_user_data(user_id, user_data["tokens"], now)
     update.message.reply_text(
-        f'🎁 You claimed your daily bonus of {bonus} tokens.\n\nYour new balance is {user_data["tokens"]} tokens.',
+        f'🎁 You claimed your daily bonus of {DAILY_BONUS} tokens.\n\nYour new balance is {new_balance} tokens.',
         reply_markup=get_main_menu_keyboard()
     )
 
-def show_leaderboard(update: Update, context: CallbackContext) -> None:
-    conn = sqlite3.connect('game.db')
-    c = conn.cursor()
-    c.execute("SELECT id, tokens FROM users ORDER BY tokens DESC LIMIT 5")
-    top_users = c.fetchall()
-    conn.close()
+def claim_daily(user_id):
+    """Credit today's bonus; returns the new balance, or None if it was already claimed."""
+    now = datetime.now().strftime('%Y-%m-%d')
+    # Claiming is a conditional update, so two quick taps can't both succeed
+    with transaction() as c:
+        claimed = c.execute(
+            "UPDATE users SET last_daily = ? WHERE id = ? AND last_daily != ?", (now, user_id, now)
+        ).rowcount
+        if not claimed:
+            return None
+        new_balance = ledger.credit(user_id, DAILY_BONUS, ledger.DAILY_BONUS)
+        user_cache.write_through(user_id, last_daily=now)
+    return new_balance
 
+def render_leaderboard(top_users: list, unit: str) -> str:
     message = "🏆 Top 5 Players 🏆\n\n"
-    for i, (user_id, tokens) in enumerate(top_users, 1):
-        message += f"{i}. User {user_id}: {tokens} tokens\n"
+    for i, (user_id, score) in enumerate(top_users, 1):
+        message += f"{i}. User {user_id}: {score} {unit}\n"
+    return message
+
+def show_leaderboard(update: Update, context: CallbackContext) -> None:
+    """Show the top 5 by tokens (or by rating with /leaderboard rating) and the caller's rank."""
+    column = 'rating' if context.args and context.args[0].lower() == 'rating' else 'tokens'
+    update.message.reply_text(leaderboard_message(column, update.effective_user.id), reply_markup=get_main_menu_keyboard())
 
-    update.message.reply_text(message, reply_markup=get_main_menu_keyboard())
+def leaderboard_message(column: str, user_id) -> str:
+    board = leaderboard.boards[column]
+    message = board.render(5, column, lambda top_users: render_leaderboard(top_users, column))
+
+    rank = board.rank(user_id)
+    if rank is not None:
+        message += f"\nYour rank: #{rank} of {len(board)}"
+    return message
 
 def create_tournament(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
@@ -843,55 +1065,152 @@ def create_tournament(update: Update, context: CallbackContext) -> None:
     if not user_data:
         update.message.reply_text("❌ Please start the bot first with /start")
         return
+    
+    if not (context.args and context.args[0].lower() == 'new'):
+        if user_data["tokens"] < TOURNAMENT_ENTRY_FEE:
+            update.message.reply_text("❌ You need 100 tokens to join the tournament!")
+            return
+        request_tournament_seat(user.id, user.username or user.first_name)
+        update.message.reply_text(FINDING_TOURNAMENT)
+        return
         
     if user_data["tokens"] < 200:
         update.message.reply_text("❌ You need at least 200 tokens to create a tournament!")
         return
     
-    tournament_id = len(active_tournaments) + 1
-    tournament = {
-        "id": tournament_id,
-        "creator": user.id,
-        "players": [user.id],
-        "entry_fee": 100,
-        "prize_pool": 100,
-        "status": "registering",
-        "matches": [],
-        "round": 0,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    active_tournaments[tournament_id] = tournament
+    try:
+        tournament = open_tournament(user.id, user.username or user.first_name)
+    except ledger.InsufficientFunds:
+        update.message.reply_text("❌ You need at least 200 tokens to create a tournament!")
+        return
     
-    # Create tournament announcement keyboard
-    keyboard = [
-        [InlineKeyboardButton("🎮 Join Tournament", callback_data=f"join_tournament_{tournament_id}")],
-        [InlineKeyboardButton("🚫 Cancel Tournament", callback_data=f"cancel_tournament_{tournament_id}")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    message, reply_markup = tournament_view(tournament, created=True)
+    update.message.reply_text(message, reply_markup=reply_markup)
+
+def open_tournament(user_id, username: str = None) -> records.Tournament:
+    """Charge the creator's entry fee and register a new tournament; raises ledger.InsufficientFunds."""
+    # Ids are reserved outside the transaction; one lost to a failed debit is just skipped
+    tournament_id = tournament_ids.next()
+    tournament = records.Tournament(tournament_id, user_id, 100, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), username)
     
-    # Deduct entry fee
-    update_user_data(user.id, user_data["tokens"] - 100)
+    # The fee and the registration commit together, so neither outlives the other
+    try:
+        with transaction():
+            ledger.debit(user_id, 100, ledger.TOURNAMENT_FEE)
+            active_tournaments[tournament_id] = tournament
+            tournament_lobbies.add(tournament_id, tournament.entry_fee, len(tournament.players))
+    except Exception:
+        # The in-memory state store doesn't roll back with game.db
+        active_tournaments.pop(tournament_id)
+        tournament_lobbies.remove(tournament_id)
+        raise
+    record_audit_event(user_id, 'tournament_created', str(tournament_id))
+    return tournament
+
+FINDING_TOURNAMENT = (
+    "⌛ Finding you a tournament...\n"
+    "You'll be seated in the fullest open one in a moment."
+)
+
+def request_tournament_seat(user_id, username: str = None) -> None:
+    """Queue user_id for the next fill_tournament_lobbies pass."""
+    tournament_queue.append((user_id, username, TOURNAMENT_ENTRY_FEE))
+
+def fill_tournament_lobbies(context: CallbackContext = None) -> int:
+    """Periodic job: hand queued players to the handler executor to be seated; returns how many.
+
+    Filling the fullest lobby first, instead of opening one per request,
+    gets each bracket to 8 players and started as soon as possible.
+    """
+    batch, queued = [], set()
+    while len(batch) < TOURNAMENT_FILL_BATCH:
+        request = tournament_queue.pop()
+        if request is None:
+            break
+        # A double tap seats the player once
+        if request[0] not in queued:
+            queued.add(request[0])
+            batch.append(request)
+    
+    for user_id, username, entry_fee in batch:
+        # Queued behind the player's own updates and the joins on the lobby they are likely to get
+        handler_executor.submit(seating_keys(user_id, entry_fee), seat_and_start, user_id, username, entry_fee)
+    return len(batch)
+
+def seating_keys(user_id, entry_fee: int) -> tuple:
+    """Ordering keys for seating a queued player: them, the lobbies at their fee, and the fullest of those."""
+    keys = [('user', user_id), ('lobbies', entry_fee)]
+    candidates = tournament_lobbies.fullest(entry_fee, limit=1)
+    if candidates:
+        keys.append(('tournament', candidates[0]))
+    return tuple(keys)
+
+def seat_and_start(user_id, username: str, entry_fee: int) -> Optional[int]:
+    """Seat a queued player and start their tournament if that filled it; returns the id if it started."""
+    try:
+        tournament_id = seat_queued_player(user_id, username, entry_fee)
+        if tournament_id is not None and claim_tournament_start(tournament_id):
+            start_tournament_round(tournament_id)
+            return tournament_id
+    except Exception:
+        logging.exception("Could not seat %s in a tournament", user_id)
+    return None
+
+def seat_queued_player(user_id, username: str, entry_fee: int) -> Optional[int]:
+    """Seat user_id in the fullest lobby that takes them, or open a new one; returns its id.
+
+    Returns None, after telling the player, if they can't pay the entry fee.
+    """
+    tournament = None
+    try:
+        for tournament_id in tournament_lobbies.fullest(entry_fee):
+            refusal = reserve_tournament_seat(tournament_id, user_id, username)
+            if refusal is None:
+                tournament = join_tournament(tournament_id, user_id)
+                break
+            if refusal != ALREADY_JOINED:
+                # Started or gone since it was listed
+                tournament_lobbies.remove(tournament_id)
+        created = tournament is None
+        if created:
+            tournament = open_tournament(user_id, username)
+    except ledger.InsufficientFunds:
+        outbox.add(user_id, "❌ You need 100 tokens to join the tournament!")
+        return None
     
+    message, reply_markup = tournament_view(tournament, created=created)
+    outbox.add(user_id, message, reply_markup, dedup_key=f"tournament:{tournament.id}:seated:{user_id}")
+    return tournament.id
+
+def tournament_view(tournament: records.Tournament, created: bool = False):
+    """The tournament announcement and join/cancel buttons; returns (message, reply_markup)."""
+    tournament_id = tournament.id
+    title = f"🏆 New Tournament Created #{tournament_id}" if created else f"🏆 Tournament #{tournament_id}"
     message = (
-        f"🏆 New Tournament Created #{tournament_id}\n\n"
+        f"{title}\n\n"
         f"Entry Fee: 100 tokens\n"
-        f"Current Prize Pool: 100 tokens\n"
-        f"Players: 1/8\n\n"
+        f"Current Prize Pool: {tournament.prize_pool} tokens\n"
+        f"Players: {len(tournament.players)}/8\n\n"
         f"Tournament will start when 8 players join!\n"
         f"Winner takes 70% of prize pool\n"
         f"Runner-up takes 20% of prize pool\n"
         f"Semi-finalists share 10% of prize pool"
     )
-    
-    update.message.reply_text(message, reply_markup=reply_markup)
+    return message, tournament_keyboard(tournament_id)
+
+@render.template
+def tournament_keyboard(tournament_id):
+    keyboard = [
+        [InlineKeyboardButton("🎮 Join Tournament", callback_data=f"join_tournament_{tournament_id}")],
+        [InlineKeyboardButton("🚫 Cancel Tournament", callback_data=f"cancel_tournament_{tournament_id}")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
 
 def handle_tournament_join(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     query.answer()
     
-    _, tournament_id = query.data.split('_')
-    tournament_id = int(tournament_id)
+    tournament_id = int(query.data.split('_')[-1])
     user = query.from_user
     user_data = get_user_data(user.id)
     
@@ -903,169 +1222,371 @@ def handle_tournament_join(update: Update, context: CallbackContext) -> None:
         query.edit_message_text("❌ You need 100 tokens to join the tournament!")
         return
     
-    tournament = active_tournaments.get(tournament_id)
-    if not tournament:
-        query.edit_message_text("❌ Tournament not found or already ended!")
-        return
-        
-    if user.id in tournament["players"]:
-        query.edit_message_text("❌ You're already in this tournament!")
-        return
-        
-    if len(tournament["players"]) >= 8:
-        query.edit_message_text("❌ Tournament is full!")
+    refusal = reserve_tournament_seat(tournament_id, user.id, user.username or user.first_name)
+    if refusal:
+        query.edit_message_text(refusal)
         return
     
-    # Add player and update prize pool
-    tournament["players"].append(user.id)
-    tournament["prize_pool"] += 100
-    update_user_data(user.id, user_data["tokens"] - 100)
-    
-    # Update tournament message
-    keyboard = [
-        [InlineKeyboardButton("🎮 Join Tournament", callback_data=f"join_tournament_{tournament_id}")],
-        [InlineKeyboardButton("🚫 Cancel Tournament", callback_data=f"cancel_tournament_{tournament_id}")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    message = (
-        f"🏆 Tournament #{tournament_id}\n\n"
-        f"Entry Fee: 100 tokens\n"
-        f"Current Prize Pool: {tournament['prize_pool']} tokens\n"
-        f"Players: {len(tournament['players'])}/8\n\n"
-        f"Tournament will start when 8 players join!\n"
-        f"Winner takes 70% of prize pool\n"
-        f"Runner-up takes 20% of prize pool\n"
-        f"Semi-finalists share 10% of prize pool"
-    )
+    try:
+        tournament = join_tournament(tournament_id, user.id)
+    except ledger.InsufficientFunds:
+        query.edit_message_text("❌ You need 100 tokens to join the tournament!")
+        return
     
+    message, reply_markup = tournament_view(tournament)
     query.edit_message_text(message, reply_markup=reply_markup)
     
     # Start tournament if 8 players joined
-    if len(tournament["players"]) == 8:
-        start_tournament_round(context, tournament_id)
+    if claim_tournament_start(tournament_id):
+        start_tournament_round(tournament_id)
+
+ALREADY_JOINED = "❌ You're already in this tournament!"
 
-def start_tournament_round(context: CallbackContext, tournament_id: int) -> None:
-    tournament = active_tournaments[tournament_id]
-    tournament["round"] += 1
-    players = tournament["players"]
+def tournament_join_refusal(tournament: Optional[records.Tournament], user_id) -> Optional[str]:
+    """Why user_id can't join tournament, or None if they can."""
+    if not tournament:
+        return "❌ Tournament not found or already ended!"
+    if tournament.status != "registering":
+        return "❌ Tournament has already started!"
+    if user_id in tournament.players:
+        return ALREADY_JOINED
+    if len(tournament.players) >= 8:
+        return "❌ Tournament is full!"
+    return None
+
+def reserve_tournament_seat(tournament_id: int, user_id, username: str = None) -> Optional[str]:
+    """Hold a seat for user_id while the fee is charged; returns a refusal, or None once seated.
+
+    Checked and taken in one atomic update, so concurrent joins can't overfill the tournament.
+    """
+    refusal = None
+    
+    def seat(tournament):
+        nonlocal refusal
+        refusal = tournament_join_refusal(tournament, user_id)
+        if refusal is None:
+            tournament.players.append(user_id)
+            if username:
+                tournament.names[user_id] = username
+        return tournament
     
-    if len(players) == 1:
-        # Tournament ended, distribute prizes
-        end_tournament(context, tournament_id)
-        return
+    try:
+        active_tournaments.modify(tournament_id, seat)
+    except KeyError:
+        return tournament_join_refusal(None, user_id)
+    return refusal
+
+def join_tournament(tournament_id: int, user_id) -> records.Tournament:
+    """Charge the entry fee for a reserved seat and grow the prize pool; returns the tournament.
+
+    Gives the seat back and raises ledger.InsufficientFunds if the fee can't be paid.
+    """
+    try:
+        ledger.debit(user_id, 100, ledger.TOURNAMENT_FEE)
+    except ledger.InsufficientFunds:
+        tournament = active_tournaments.modify(tournament_id, lambda tournament: release_seat(tournament, user_id))
+        tournament_lobbies.update(tournament_id, len(tournament.players))
+        raise
+    
+    def add_fee(tournament):
+        tournament.prize_pool += 100
+        return tournament
+    tournament = active_tournaments.modify(tournament_id, add_fee)
+    tournament_lobbies.update(tournament_id, len(tournament.players))
+    return tournament
+
+def release_seat(tournament: records.Tournament, user_id) -> records.Tournament:
+    tournament.players.remove(user_id)
+    tournament.names.pop(user_id, None)
+    return tournament
+
+def claim_tournament_start(tournament_id: int) -> bool:
+    """Mark a full, fully paid tournament as running; True only for the one caller that did.
+
+    A seat is reserved before its fee is charged, so a bracket of 8 can
+    still be waiting on a debit; whoever pays the last fee starts it.
+    """
+    claimed = False
+    
+    def start(tournament):
+        nonlocal claimed
+        if (len(tournament.players) == TOURNAMENT_SIZE and tournament.status == "registering"
+                and tournament.prize_pool == tournament.entry_fee * TOURNAMENT_SIZE):
+            tournament.status = "running"
+            claimed = True
+        return tournament
     
-    # Pair players randomly
-    random.shuffle(players)
+    try:
+        active_tournaments.modify(tournament_id, start)
+    except KeyError:
+        return False
+    if claimed:
+        tournament_lobbies.remove(tournament_id)
+    return claimed
+
+def start_tournament_round(tournament_id: int) -> list:
+    """Pair the tournament's next round and queue each match's move buttons; returns the new matches."""
+    matches = pair_tournament_round(tournament_id)
+    tournament = active_tournaments.get(tournament_id)
+    # A failed send leaves the matches to the move deadline, which still decides them
+    with transaction():
+        for match in matches:
+            message, reply_markup = tournament_match_view(tournament, match)
+            for user_id in match.player_ids:
+                outbox.add(user_id, message, reply_markup, dedup_key=f"tournament:{tournament_id}:match:{match.id}:{user_id}")
+    return matches
+
+def pair_tournament_round(tournament_id: int) -> list:
+    """Advance to the next round and pair its players; returns the new matches."""
+    # Ids are reserved before the atomic update, which must not touch the id sequence
+    match_id_block = [match_ids.next() for _ in range(bracket.matches_needed(active_tournaments[tournament_id]))]
     matches = []
     
-    for i in range(0, len(players), 2):
-        if i + 1 < len(players):
-            match_id = len(active_matches) + 1
-            match = {
-                "id": match_id,
-                "tournament_id": tournament_id,
-                "player1": {"user_id": players[i]},
-                "player2": {"user_id": players[i + 1]},
-                "moves": {},
-                "status": "active",
-                "round": tournament["round"]
-            }
-            matches.append(match)
-            active_matches[match_id] = match
-    
-    tournament["matches"].extend(matches)
-    
-    # Notify players and start matches
+    def pair(tournament):
+        matches.extend(bracket.pair_round(tournament, match_id_block, time.time()))
+        return tournament
+    
+    active_tournaments.modify(tournament_id, pair)
     for match in matches:
-        p1_data = get_user_data(match["player1"]["user_id"])
-        p2_data = get_user_data(match["player2"]["user_id"])
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("🗿 Rock", callback_data=f"move_{match['id']}_rock"),
-                InlineKeyboardButton("📄 Paper", callback_data=f"move_{match['id']}_paper"),
-                InlineKeyboardButton("✂️ Scissors", callback_data=f"move_{match['id']}_scissors")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        message = (
-            f"🏆 Tournament Round {tournament['round']}\n"
-            f"Make your move!\n\n"
-            f"You vs Opponent\n"
-            f"Rating: {p1_data['rating']} vs {p2_data['rating']}"
-        )
-        
-        context.bot.send_message(
-            match["player1"]["user_id"],
-            message,
-            reply_markup=reply_markup
-        )
-        context.bot.send_message(
-            match["player2"]["user_id"],
-            message,
-            reply_markup=reply_markup
-        )
+        open_tournament_match(match)
+    return matches
 
-def end_tournament(context: CallbackContext, tournament_id: int) -> None:
-    tournament = active_tournaments[tournament_id]
-    prize_pool = tournament["prize_pool"]
-    
-    # Get winner (last remaining player)
-    winner_id = tournament["players"][0]
-    winner_data = get_user_data(winner_id)
-    
-    # Calculate prizes
-    winner_prize = int(prize_pool * 0.7)  # 70% to winner
-    runner_up_prize = int(prize_pool * 0.2)  # 20% to runner-up
-    semifinal_prize = int(prize_pool * 0.1 / 2)  # 10% split between semi-finalists
-    
-    # Update winner's tokens and send message
-    update_user_data(winner_id, winner_data["tokens"] + winner_prize)
+def open_tournament_match(match: records.Match) -> None:
+    active_matches[match.id] = match
+    match_deadlines.schedule(match.id, match.started_at + BATTLE_MOVE_TIMEOUT_SECONDS)
+
+def tournament_match_view(tournament: records.Tournament, match: records.Match):
+    """The round announcement and move buttons for a tournament match; returns (message, reply_markup)."""
+    p1_data = get_user_data(match.player1.user_id)
+    p2_data = get_user_data(match.player2.user_id)
     
     message = (
-        f"🎊 Tournament #{tournament_id} Ended!\n\n"
-        f"🏆 Winner: {winner_data['username']}\n"
-        f"💰 Prize: {winner_prize} tokens\n\n"
-        f"Thank you for participating!"
+        f"🏆 Tournament #{tournament.id} Round {match.round}\n"
+        f"Make your move!\n\n"
+        f"{match.player1.username} vs {match.player2.username}\n"
+        f"Rating: {p1_data['rating']} vs {p2_data['rating']}"
     )
+    return message, tournament_move_keyboard(match.id)
+
+@render.template
+def tournament_move_keyboard(match_id):
+    keyboard = [
+        [
+            InlineKeyboardButton("🗿 Rock", callback_data=f"move_{match_id}_rock"),
+            InlineKeyboardButton("📄 Paper", callback_data=f"move_{match_id}_paper"),
+            InlineKeyboardButton("✂️ Scissors", callback_data=f"move_{match_id}_scissors")
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def settle_tournament_match(game_id: int, game: records.Match, winner: Optional[records.QueueEntry]) -> None:
+    """Report a finished tournament match to its bracket; a draw (no winner) is replayed.
+
+    The one result that completes a round pairs the next, and the final
+    result settles the tournament, so rounds advance as soon as their last
+    match ends, independently of every other tournament.
+    """
+    tournament_id = game.tournament_id
+    if winner is None:
+        replay_tournament_match(game_id, game)
+        return
+    loser = game.player2 if winner is game.player1 else game.player1
+    outcome = None
+    
+    def report(tournament):
+        nonlocal outcome
+        outcome = bracket.record_result(tournament, game_id, winner.user_id, loser.user_id)
+        return tournament
     
-    # Notify all players
-    for player_id in set(p["user_id"] for match in tournament["matches"] for p in [match["player1"], match["player2"]]):
+    with transaction():
         try:
-            context.bot.send_message(player_id, message, reply_markup=get_main_menu_keyboard())
-        except:
-            continue
+            active_tournaments.modify(tournament_id, report)
+        except KeyError:
+            return
+        if outcome == bracket.STALE:
+            return
+        rating_change = ratings.rate_result(winner.user_id, loser.user_id)
+        record_battle_result(winner.user_id, True, rating_change)
+        record_battle_result(loser.user_id, False, -rating_change)
+        record_game_session(game, "completed", winner.user_id)
+        notices = [(loser.user_id, f"❌ {winner.username} knocked you out of Tournament #{tournament_id} in round {game.round}.")]
+        if outcome != bracket.FINISHED:
+            notices.append((winner.user_id, f"✅ You beat {loser.username} in round {game.round}! Waiting for the next round..."))
+        for user_id, text in notices:
+            outbox.add(user_id, text, dedup_key=f"tournament:{tournament_id}:result:{game_id}:{user_id}")
+    
+    if outcome == bracket.ROUND_COMPLETE:
+        start_tournament_round(tournament_id)
+    elif outcome == bracket.FINISHED:
+        settle_tournament(tournament_id)
+
+def replay_tournament_match(game_id: int, game: records.Match) -> None:
+    """Put a drawn tournament match back into play under a new id."""
+    replay = records.Match(match_ids.next(), game.player1, game.player2, 0, time.time(),
+                           tournament_id=game.tournament_id, round=game.round)
+    replaced = False
+    
+    def replace(tournament):
+        nonlocal replaced
+        replaced = bracket.replace_match(tournament, game_id, replay.id)
+        return tournament
     
-    # Clean up
-    del active_tournaments[tournament_id]
+    try:
+        tournament = active_tournaments.modify(game.tournament_id, replace)
+    except KeyError:
+        return
+    if not replaced:
+        return
+    open_tournament_match(replay)
+    message, reply_markup = tournament_match_view(tournament, replay)
+    with transaction():
+        for user_id in replay.player_ids:
+            outbox.add(user_id, "🤝 It's a draw! Play again.\n\n" + message, reply_markup,
+                       dedup_key=f"tournament:{game.tournament_id}:match:{replay.id}:{user_id}")
+
+def settle_tournament(tournament_id: int) -> None:
+    """Pay the winner, runner-up and semi-finalists and queue everyone's results in one transaction."""
+    # Removed before paying out, so only one caller in any process settles it
+    tournament = active_tournaments.pop(tournament_id)
+    if tournament is None:
+        return
+    prizes = bracket.payouts(tournament)
+    message = tournament_result_message(tournament, prizes)
+    try:
+        with transaction():
+            for user_id, prize, _ in prizes:
+                ledger.credit(user_id, prize, ledger.TOURNAMENT_PRIZE)
+            for user_id in tournament.entrants:
+                outbox.add(user_id, message, get_main_menu_keyboard(), dedup_key=f"tournament:{tournament_id}:end:{user_id}")
+    except Exception:
+        # Back in the store, so the payout can be retried
+        active_tournaments[tournament_id] = tournament
+        raise
+
+def tournament_result_message(tournament: records.Tournament, prizes: list) -> str:
+    places = {1: "🏆 Winner", 2: "🥈 Runner-up", 3: "🥉 Semi-finalist"}
+    lines = [f"{places[place]}: {tournament.name_of(user_id)} (+{prize} tokens)" for user_id, prize, place in prizes]
+    return (
+        f"🎊 Tournament #{tournament.id} Ended!\n\n"
+        + "\n".join(lines)
+        + "\n\nThank you for participating!"
+    )
+
+def handler_keys(update: Update) -> tuple:
+    """Ordering keys for an update: its user, plus the match or tournament a button acts on."""
+    if update.effective_user:
+        keys = [('user', update.effective_user.id)]
+    elif update.effective_chat:
+        keys = [('chat', update.effective_chat.id)]
+    else:
+        keys = [('update', update.update_id)]
+    data = update.callback_query.data if update.callback_query else None
+    if data and data.startswith('move_'):
+        keys.append(('match', int(data.split('_')[1])))
+    elif data and data.startswith('join_tournament_'):
+        keys.append(('tournament', int(data.split('_')[-1])))
+    return tuple(keys)
+
+def serialized(callback):
+    """Hand callback to the keyed executor instead of running it on the dispatcher thread."""
+    timed = metrics.timed_handler(callback)
+
+    def submit(update: Update, context: CallbackContext) -> None:
+        if timed is callback:
+            handler_executor.submit(handler_keys(update), callback, update, context)
+        else:
+            handler_executor.submit(handler_keys(update), timed, update, context, time.perf_counter())
+    submit.__name__ = callback.__name__
+    return submit
+
+def register_handlers(dispatcher, wrap=serialized) -> None:
+    """Add every handler; wrap decides where callbacks run (the keyed executor by default)."""
+    dispatcher.add_handler(CommandHandler("start", wrap(start)))
+    dispatcher.add_handler(CommandHandler("battle", wrap(start_battle)))
+    dispatcher.add_handler(CommandHandler("balance", wrap(check_balance)))
+    dispatcher.add_handler(CommandHandler("daily", wrap(claim_daily_bonus)))
+    dispatcher.add_handler(CommandHandler("leaderboard", wrap(show_leaderboard)))
+    dispatcher.add_handler(CommandHandler("swap", wrap(show_swap_options)))
+    dispatcher.add_handler(CommandHandler("tournament", wrap(create_tournament)))
+    dispatcher.add_handler(CommandHandler("referral", wrap(handle_referral_code)))
+    dispatcher.add_handler(CommandHandler("classes", wrap(show_character_classes)))
+    dispatcher.add_handler(CommandHandler("referralinfo", wrap(show_referral_info)))
+    dispatcher.add_handler(CommandHandler("stats", wrap(show_stats)))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(handle_battle_stake), pattern='^stake_[0-9]+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(handle_battle_move), pattern='^move_[0-9]+_[a-z]+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(handle_tournament_join), pattern='^join_tournament_[0-9]+$'))
+    dispatcher.add_handler(CallbackQueryHandler(wrap(handle_class_selection), pattern='^select_class_[a-z]+$'))
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, wrap(handle_menu_choice)))
+
 
 def main() -> None:
     setup_database()
+    leaderboard.load_all_in_background()
+    writer.queue.start()
     load_dotenv()
     TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    updater = Updater(token=TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
-
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("battle", start_battle))
-    dispatcher.add_handler(CommandHandler("balance", check_balance))
-    dispatcher.add_handler(CommandHandler("daily", claim_daily_bonus))
-    dispatcher.add_handler(CommandHandler("leaderboard", show_leaderboard))
-    dispatcher.add_handler(CommandHandler("swap", show_swap_options))
-    dispatcher.add_handler(CommandHandler("tournament", create_tournament))
-    dispatcher.add_handler(CommandHandler("referral", handle_referral_code))
-    dispatcher.add_handler(CommandHandler("classes", show_character_classes))
-    dispatcher.add_handler(CommandHandler("referralinfo", show_referral_info))
-    dispatcher.add_handler(CallbackQueryHandler(handle_battle_stake, pattern='^stake_[0-9]+$'))
-    dispatcher.add_handler(CallbackQueryHandler(handle_battle_move, pattern='^move_[0-9]+_[a-z]+$'))
-    dispatcher.add_handler(CallbackQueryHandler(handle_tournament_join, pattern='^join_tournament_[0-9]+$'))
-    dispatcher.add_handler(CallbackQueryHandler(handle_class_selection, pattern='^select_class_[a-z]+$'))
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_menu_choice))
-
-    updater.start_polling()
-    updater.idle()
+    updater = Updater(token=TOKEN, use_context=True, workers=BOT_WORKERS)
+    metrics.instrument_bot(updater.bot)
+    async_dispatcher = None
+    if BOT_RUNTIME == 'asyncio':
+        # async_handlers reads game state from the run module, which is __main__ when started as a script
+        sys.modules.setdefault('run', sys.modules[__name__])
+        import async_handlers
+        async_dispatcher = aio.AsyncDispatcher(aio.AsyncBot(TOKEN), keys=handler_keys)
+        async_handlers.register(async_dispatcher)
+        async_dispatcher.start()
+        async_dispatcher.attach(updater.dispatcher)
+    else:
+        register_handlers(updater.dispatcher)
+    outbox.sender.start(updater.bot, async_dispatcher)
+    register_gauges(async_dispatcher)
+    metrics_server = metrics.serve()
+    if metrics_server is not None:
+        updater.job_queue.run_repeating(metrics.refresh_gauges, interval=metrics.METRICS_GAUGE_REFRESH_SECONDS, first=0)
+
+    updater.job_queue.run_repeating(matchmaking_tick, interval=MATCHMAKING_TICK_SECONDS, first=MATCHMAKING_TICK_SECONDS)
+    logging.info("Tracking move deadlines of %d open matches", arm_match_deadlines())
+    updater.job_queue.run_repeating(expire_events, interval=EVENT_EXPIRY_TICK_SECONDS, first=0)
+    updater.job_queue.run_repeating(expire_battles, interval=BATTLE_EXPIRY_TICK_SECONDS, first=BATTLE_EXPIRY_TICK_SECONDS)
+    updater.job_queue.run_repeating(fill_tournament_lobbies, interval=TOURNAMENT_FILL_TICK_SECONDS,
+                                    first=TOURNAMENT_FILL_TICK_SECONDS)
+    updater.job_queue.run_repeating(analytics.refresh_analytics, interval=analytics.ANALYTICS_REFRESH_SECONDS, first=0)
+    if leaderboard.LEADERBOARD_REFRESH_SECONDS:
+        updater.job_queue.run_repeating(leaderboard.refresh_boards, interval=leaderboard.LEADERBOARD_REFRESH_SECONDS,
+                                        first=leaderboard.LEADERBOARD_REFRESH_SECONDS)
+    broadcast.resume_pending(updater.bot)
+
+    if BOT_MODE == 'webhook':
+        server = webhook.WebhookServer(
+            updater.bot, updater.dispatcher.update_queue,
+            listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+            port=int(os.getenv('WEBHOOK_PORT', '8443')),
+            url_path=os.getenv('WEBHOOK_PATH', 'webhook'),
+            secret_token=os.getenv('WEBHOOK_SECRET') or None,
+            max_batch=int(os.getenv('WEBHOOK_MAX_BATCH', '100')),
+        )
+        webhook.run(updater, server, webhook_url=os.getenv('WEBHOOK_URL') or None,
+                    max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')))
+    else:
+        updater.start_polling()
+        updater.idle()
+    
+    # Before the event loop it may be sending on goes away
+    outbox.sender.stop()
+    logging.info("Outbox stats: %s", outbox.sender.stats())
+    if async_dispatcher is not None:
+        async_dispatcher.stop()
+        adb.database.shutdown()
+        logging.info("Async handler ordering stats: %s", async_dispatcher.ordering_stats())
+    handler_executor.stop()
+    logging.info("Handler executor stats: %s", handler_executor.stats())
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    
+    # Flush queued inserts before the connections go away
+    writer.queue.stop()
+    logging.info("User cache stats: %s", user_cache.cache.stats())
+    db.pool.close_all()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
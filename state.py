@@ -0,0 +1,299 @@
+import json
+import os
+import pickle
+import threading
+from collections import deque
+
+import db
+
+# memory = this process only; sqlite = shared through game.db by every bot
+# process pointed at the same GAME_DB_PATH
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+
+
+class MemoryStore:
+    """Process-local game state: plain dicts and deques behind one lock."""
+
+    shared = False
+
+    def __init__(self):
+        self._maps = {}
+        self._queues = {}
+        self._lock = threading.RLock()
+
+    def _map(self, namespace: str) -> dict:
+        return self._maps.setdefault(namespace, {})
+
+    def get(self, namespace: str, key, default=None):
+        with self._lock:
+            return self._map(namespace).get(key, default)
+
+    def put(self, namespace: str, key, value) -> None:
+        with self._lock:
+            self._map(namespace)[key] = value
+
+    def put_if_absent(self, namespace: str, key, value) -> bool:
+        with self._lock:
+            entries = self._map(namespace)
+            if key in entries:
+                return False
+            entries[key] = value
+            return True
+
+    def pop(self, namespace: str, key, default=None):
+        with self._lock:
+            return self._map(namespace).pop(key, default)
+
+    def modify(self, namespace: str, key, fn):
+        """Atomically replace the value at key with fn(value); returns the new value.
+
+        Raises KeyError if key is missing.
+        """
+        with self._lock:
+            entries = self._map(namespace)
+            value = fn(entries[key])
+            entries[key] = value
+            return value
+
+    def items(self, namespace: str) -> list:
+        with self._lock:
+            return list(self._map(namespace).items())
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return len(self._map(namespace))
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            self._map(namespace).clear()
+            self._queues.pop(namespace, None)
+
+    def push(self, namespace: str, value) -> None:
+        with self._lock:
+            self._queues.setdefault(namespace, deque()).append(value)
+
+    def pop_front(self, namespace: str, default=None):
+        with self._lock:
+            pending = self._queues.get(namespace)
+            return pending.popleft() if pending else default
+
+    def remove_where(self, namespace: str, predicate) -> list:
+        """Drop queued values matching predicate; returns them."""
+        with self._lock:
+            pending = self._queues.get(namespace, deque())
+            removed = [value for value in pending if predicate(value)]
+            if removed:
+                self._queues[namespace] = deque(value for value in pending if not predicate(value))
+            return removed
+
+    def values_in_order(self, namespace: str) -> list:
+        with self._lock:
+            return list(self._queues.get(namespace, ()))
+
+
+class SQLiteStore:
+    """Game state in game.db, so several bot processes see the same matches and queues.
+
+    Values are pickled. Every read-modify-write runs in one write
+    transaction, which SQLite serializes across processes, so modify() is
+    a compare-and-set that can't lose an update.
+    """
+
+    shared = True
+
+    def __init__(self, pool=None):
+        self.pool = pool or db.pool
+
+    @staticmethod
+    def _key(key) -> str:
+        return json.dumps(key)
+
+    def get(self, namespace: str, key, default=None):
+        row = self.pool.connection().execute(
+            "SELECT value FROM shared_state WHERE namespace = ? AND key = ?", (namespace, self._key(key))
+        ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def put(self, namespace: str, key, value) -> None:
+        self.pool.connection().execute(
+            "INSERT OR REPLACE INTO shared_state (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, self._key(key), pickle.dumps(value))
+        )
+
+    def put_if_absent(self, namespace: str, key, value) -> bool:
+        return self.pool.connection().execute(
+            "INSERT OR IGNORE INTO shared_state (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, self._key(key), pickle.dumps(value))
+        ).rowcount == 1
+
+    def pop(self, namespace: str, key, default=None):
+        row = self.pool.connection().execute(
+            "DELETE FROM shared_state WHERE namespace = ? AND key = ? RETURNING value", (namespace, self._key(key))
+        ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def modify(self, namespace: str, key, fn):
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM shared_state WHERE namespace = ? AND key = ?", (namespace, self._key(key))
+            ).fetchone()
+            if row is None:
+                raise KeyError(key)
+            value = fn(pickle.loads(row[0]))
+            conn.execute(
+                "UPDATE shared_state SET value = ? WHERE namespace = ? AND key = ?",
+                (pickle.dumps(value), namespace, self._key(key))
+            )
+        return value
+
+    def items(self, namespace: str) -> list:
+        rows = self.pool.connection().execute(
+            "SELECT key, value FROM shared_state WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        return [(json.loads(key), pickle.loads(value)) for key, value in rows]
+
+    def count(self, namespace: str) -> int:
+        return self.pool.connection().execute(
+            "SELECT COUNT(*) FROM shared_state WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+
+    def clear(self, namespace: str) -> None:
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM shared_state WHERE namespace = ?", (namespace,))
+            conn.execute("DELETE FROM shared_queues WHERE namespace = ?", (namespace,))
+
+    def push(self, namespace: str, value) -> None:
+        self.pool.connection().execute(
+            "INSERT INTO shared_queues (namespace, value) VALUES (?, ?)", (namespace, pickle.dumps(value))
+        )
+
+    def pop_front(self, namespace: str, default=None):
+        # One statement, so two processes can never pop the same entry
+        row = self.pool.connection().execute(
+            """DELETE FROM shared_queues WHERE seq =
+                   (SELECT MIN(seq) FROM shared_queues WHERE namespace = ?)
+               RETURNING value""", (namespace,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def remove_where(self, namespace: str, predicate) -> list:
+        with self.pool.transaction() as conn:
+            rows = conn.execute(
+                "SELECT seq, value FROM shared_queues WHERE namespace = ? ORDER BY seq", (namespace,)
+            ).fetchall()
+            removed = [(seq, pickle.loads(value)) for seq, value in rows]
+            removed = [(seq, value) for seq, value in removed if predicate(value)]
+            conn.executemany("DELETE FROM shared_queues WHERE seq = ?", ((seq,) for seq, _ in removed))
+        return [value for _, value in removed]
+
+    def values_in_order(self, namespace: str) -> list:
+        rows = self.pool.connection().execute(
+            "SELECT value FROM shared_queues WHERE namespace = ? ORDER BY seq", (namespace,)
+        ).fetchall()
+        return [pickle.loads(value) for value, in rows]
+
+
+class StateMap:
+    """Dict-style view of one namespace of a store.
+
+    Values read from a shared store are copies: change them through
+    modify() or by assigning them back, never by mutating in place.
+    """
+
+    def __init__(self, store, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def __setitem__(self, key, value) -> None:
+        self.store.put(self.namespace, key, value)
+
+    def setdefault(self, key, value):
+        """Store value unless key is taken; returns whichever value is stored."""
+        if self.store.put_if_absent(self.namespace, key, value):
+            return value
+        return self[key]
+
+    def __delitem__(self, key) -> None:
+        if self.store.pop(self.namespace, key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        return self.store.pop(self.namespace, key, default)
+
+    def modify(self, key, fn):
+        return self.store.modify(self.namespace, key, fn)
+
+    def __contains__(self, key) -> bool:
+        return self.store.get(self.namespace, key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self.store.count(self.namespace)
+
+    def items(self) -> list:
+        return self.store.items(self.namespace)
+
+    def keys(self) -> list:
+        return [key for key, _ in self.items()]
+
+    def values(self) -> list:
+        return [value for _, value in self.items()]
+
+    def clear(self) -> None:
+        self.store.clear(self.namespace)
+
+
+class StateQueue:
+    """FIFO view of one namespace of a store; pop() is atomic across processes."""
+
+    def __init__(self, store, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def append(self, value) -> None:
+        self.store.push(self.namespace, value)
+
+    def pop(self, default=None):
+        return self.store.pop_front(self.namespace, default)
+
+    def remove_where(self, predicate) -> list:
+        return self.store.remove_where(self.namespace, predicate)
+
+    def __iter__(self):
+        return iter(self.store.values_in_order(self.namespace))
+
+    def __len__(self) -> int:
+        return len(self.store.values_in_order(self.namespace))
+
+    def clear(self) -> None:
+        self.store.clear(self.namespace)
+
+
+_MISSING = object()
+
+
+def create_store(backend: str = STATE_BACKEND):
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'sqlite':
+        return SQLiteStore()
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+store = create_store()
+
+
+def shared_map(namespace: str) -> StateMap:
+    return StateMap(store, namespace)
+
+
+def shared_queue(namespace: str) -> StateQueue:
+    return StateQueue(store, namespace)
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Before any test module imports db, so no test touches a game.db in the working directory
+_tmp = tempfile.TemporaryDirectory()
+os.environ['GAME_DB_PATH'] = os.path.join(_tmp.name, 'game.db')
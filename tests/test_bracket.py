@@ -0,0 +1,52 @@
+import random
+
+import bracket
+from records import Tournament
+
+
+def play(players: int, seed: int) -> Tournament:
+    rng = random.Random(seed)
+    tournament = Tournament(1, 1, 100, '2026-01-01T00:00:00')
+    tournament.players = list(range(1, players + 1))
+    tournament.prize_pool = 100 * players
+    next_id = iter(range(1000, 2000))
+    matches = bracket.pair_round(tournament, [next(next_id) for _ in range(bracket.matches_needed(tournament))],
+                                 0.0, rng)
+    while True:
+        outcome = None
+        for match in matches:
+            winner, loser = rng.sample(match.player_ids, 2)
+            outcome = bracket.record_result(tournament, match.id, winner, loser)
+            assert bracket.record_result(tournament, match.id, winner, loser) == bracket.STALE
+        if outcome == bracket.FINISHED:
+            return tournament
+        assert outcome == bracket.ROUND_COMPLETE
+        matches = bracket.pair_round(tournament, [next(next_id) for _ in range(bracket.matches_needed(tournament))],
+                                     0.0, rng)
+
+
+def test_every_bracket_size_finishes_with_one_winner():
+    for players in range(2, 17):
+        tournament = play(players, players)
+        assert tournament.status == "finished"
+        assert len(tournament.players) == 1
+        losers = [user_id for eliminated in tournament.eliminated for user_id in eliminated]
+        assert sorted(losers + tournament.players) == list(range(1, players + 1))
+
+
+def test_payouts_stay_within_the_prize_pool():
+    for players in (2, 3, 4, 8, 11):
+        tournament = play(players, 0)
+        prizes = bracket.payouts(tournament)
+        assert prizes[0] == (tournament.players[0], int(tournament.prize_pool * bracket.WINNER_SHARE), 1)
+        assert sum(prize for _, prize, _ in prizes) <= tournament.prize_pool
+        assert [place for _, _, place in prizes].count(2) == 1
+
+
+def test_replaced_match_result_is_stale():
+    tournament = Tournament(1, 1, 100, '2026-01-01T00:00:00')
+    tournament.players = [1, 2, 3, 4]
+    first, _ = bracket.pair_round(tournament, [10, 11], 0.0, random.Random(1))
+    assert bracket.replace_match(tournament, first.id, 12)
+    assert bracket.record_result(tournament, first.id, *first.player_ids) == bracket.STALE
+    assert bracket.record_result(tournament, 12, *first.player_ids) == bracket.RECORDED
@@ -0,0 +1,44 @@
+import random
+import threading
+import time
+
+import keyed
+
+
+def test_tasks_run_in_submission_order_per_key():
+    executor = keyed.KeyedExecutor(workers=8)
+    lock = threading.Lock()
+    ran = {}
+    submitted = {}
+
+    def task(keys, n):
+        time.sleep(random.random() / 1000)
+        with lock:
+            for key in keys:
+                ran.setdefault(key, []).append(n)
+
+    for n in range(500):
+        # Mostly single-key tasks, some spanning two keys like a battle between two users
+        keys = random.sample(range(10), random.choice((1, 1, 1, 2)))
+        for key in keys:
+            submitted.setdefault(key, []).append(n)
+        executor.submit(keys, task, keys, n)
+    executor.stop()
+
+    assert ran == submitted
+    assert executor.stats()['completed'] == 500
+
+
+def test_failed_task_releases_its_keys():
+    executor = keyed.KeyedExecutor(workers=2)
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    executor.submit(['a'], fail)
+    executor.submit(['a'], ran.append, 'after')
+    assert executor.wait_idle(timeout=5)
+    executor.stop()
+    assert ran == ['after']
+    assert executor.stats()['failed'] == 1
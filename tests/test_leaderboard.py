@@ -0,0 +1,34 @@
+import random
+
+import leaderboard
+
+
+def test_rank_and_first_match_a_sorted_list():
+    rng = random.Random(5)
+    tree = leaderboard.OrderStatisticTree()
+    keys = []
+    for _ in range(2000):
+        if keys and rng.random() < 0.3:
+            key = keys.pop(rng.randrange(len(keys)))
+            tree.delete(key)
+        else:
+            key = (-rng.randrange(10000), rng.randrange(10 ** 9))
+            keys.append(key)
+            tree.insert(key)
+    keys.sort()
+    assert len(tree) == len(keys)
+    assert tree.first(25) == keys[:25]
+    for index in rng.sample(range(len(keys)), 100):
+        assert tree.rank(keys[index]) == index
+
+
+def test_build_then_insert_keeps_order():
+    tree = leaderboard.OrderStatisticTree()
+    keys = list(range(0, 1000, 2))
+    tree.build(keys)
+    for key in range(1, 1000, 20):
+        tree.insert(key)
+        keys.append(key)
+    keys.sort()
+    assert tree.first(len(keys)) == keys
+    assert tree.rank(501) == keys.index(501)
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import db
+import ledger
+import run
+import user_cache
+
+
+@pytest.fixture
+def user():
+    run.setup_database()
+    user_cache.cache.clear()
+    run.create_user(1, 100)
+    yield 1
+    db.execute("DELETE FROM users WHERE id = 1")
+    user_cache.cache.clear()
+
+
+def test_debit_never_overdraws(user):
+    with pytest.raises(ledger.InsufficientFunds):
+        ledger.debit(user, 101, ledger.BATTLE_STAKE)
+    assert ledger.balance(user) == 100
+
+
+def test_debit_unknown_user():
+    run.setup_database()
+    with pytest.raises(ledger.UnknownUser):
+        ledger.debit(404, 1, ledger.BATTLE_STAKE)
+
+
+def test_concurrent_debits_never_go_negative(user):
+    start = threading.Barrier(20)
+    outcomes = []
+
+    def spend():
+        start.wait()
+        try:
+            outcomes.append(ledger.debit(user, 30, ledger.BATTLE_STAKE))
+        except ledger.InsufficientFunds:
+            outcomes.append(None)
+        finally:
+            db.pool.close_thread()
+
+    threads = [threading.Thread(target=spend) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    balances = [outcome for outcome in outcomes if outcome is not None]
+    assert sorted(balances) == [10, 40, 70]
+    assert ledger.balance(user) == 10
@@ -0,0 +1,71 @@
+import os
+import random
+import tempfile
+
+import pytest
+
+import db
+import matchmaking
+import migrations
+from records import QueueEntry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def engines():
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = db.ConnectionPool(os.path.join(tmp, 'game.db'))
+        migrations.migrate(pool)
+        clock = Clock()
+        yield clock, matchmaking.MatchmakingEngine(clock=clock), matchmaking.SharedMatchmakingEngine(clock=clock,
+                                                                                                     pool=pool)
+        pool.close_all()
+
+
+def ids(pair):
+    return None if pair is None else tuple(player.user_id for player in pair)
+
+
+def test_engines_pair_identically(engines):
+    clock, memory, shared = engines
+    rng = random.Random(7)
+    ratings = rng.sample(range(500, 2500), 400)  # distinct, so neither engine has to break a rating tie
+    paired = 0
+    for user_id, rating in enumerate(ratings, start=1):
+        clock.now += rng.uniform(0, 5)
+        stake = rng.choice((10, 50, 100))
+        if rng.random() < 0.8:
+            (opponent, queued), (shared_opponent, shared_queued) = (
+                engine.pop_opponent_or_enqueue(QueueEntry(user_id, stake, rating=rating)) for engine in (memory, shared)
+            )
+            assert (opponent and opponent.user_id, queued) == (shared_opponent and shared_opponent.user_id,
+                                                               shared_queued)
+            paired += opponent is not None
+        else:
+            assert memory.enqueue(QueueEntry(user_id, stake, rating=rating)) == \
+                   shared.enqueue(QueueEntry(user_id, stake, rating=rating))
+        if user_id % 25 == 0:
+            batch = sorted(map(ids, memory.match_batch()))
+            assert batch == sorted(map(ids, shared.match_batch()))
+            paired += len(batch)
+            assert len(memory) == len(shared)
+        if user_id % 60 == 0:
+            assert sorted(p.user_id for p in memory.expire(120)) == sorted(p.user_id for p in shared.expire(120))
+    assert paired > 50
+
+
+def test_window_widens_with_waiting(engines):
+    clock, memory, shared = engines
+    for engine in (memory, shared):
+        engine.enqueue(QueueEntry(1, 10, rating=1000))
+        assert engine.pop_opponent(QueueEntry(2, 10, rating=1300)) is None
+    clock.now += 30  # window is now 100 + 30 * 10 = 400 points
+    for engine in (memory, shared):
+        assert engine.pop_opponent(QueueEntry(2, 10, rating=1300)).user_id == 1
@@ -0,0 +1,23 @@
+import metrics
+
+
+def test_render_serves_the_last_gauge_refresh():
+    registry = metrics.Registry()
+    reads = []
+    registry.gauge('queue_depth', "Items waiting", lambda: reads.append(1) or len(reads))
+
+    assert 'queue_depth' not in registry.render()
+    registry.refresh_gauges()
+    for _ in range(3):
+        assert 'queue_depth 1\n' in registry.render()
+    assert len(reads) == 1
+    assert registry.read_gauges() == {'queue_depth': {(): 2}}
+
+
+def test_sampled_histogram_estimates_counts():
+    histogram = metrics.Histogram(bounds=(0.001, 0.01))
+    histogram.observe(0.0005, weight=20)
+    histogram.observe(0.005)
+    counts, total = histogram.snapshot()
+    assert counts == [20, 1, 0]
+    assert abs(total - 0.015) < 1e-12
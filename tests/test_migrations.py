@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import db
+import migrations
+
+# users as created before the schema was versioned (user_version 0)
+BASELINE = '''CREATE TABLE users
+    (id INTEGER PRIMARY KEY,
+     tokens INTEGER DEFAULT 100,
+     last_daily TEXT DEFAULT '',
+     wins INTEGER DEFAULT 0,
+     losses INTEGER DEFAULT 0,
+     rating INTEGER DEFAULT 1000,
+     character_class TEXT,
+     referral_code TEXT,
+     referrals INTEGER DEFAULT 0,
+     used_referral INTEGER DEFAULT 0)'''
+
+
+def test_baseline_database_upgrades_to_latest():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'game.db')
+        conn = sqlite3.connect(path)
+        conn.execute(BASELINE)
+        conn.execute("INSERT INTO users (id, tokens, referral_code) VALUES (1, 250, 'ABC')")
+        conn.commit()
+        conn.close()
+
+        pool = db.ConnectionPool(path)
+        try:
+            assert migrations.current_version(pool) == 0
+            assert migrations.migrate(pool) == [version for version, _, _ in migrations.MIGRATIONS]
+            assert migrations.current_version(pool) == migrations.LATEST_VERSION
+            assert migrations.migrate(pool) == []
+            assert pool.connection().execute("SELECT tokens, referral_code FROM users WHERE id = 1").fetchone() == (
+                250, 'ABC')
+        finally:
+            pool.close_all()
+
+
+def test_newer_schema_is_refused():
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = db.ConnectionPool(os.path.join(tmp, 'game.db'))
+        try:
+            pool.connection().execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+            with pytest.raises(RuntimeError):
+                migrations.migrate(pool)
+        finally:
+            pool.close_all()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from telegram.error import NetworkError, Unauthorized
+
+import db
+import migrations
+import outbox
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Bot:
+    def __init__(self):
+        self.errors = {}  # chat_id -> exception to raise
+        self.sent = []
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+
+@pytest.fixture
+def sender():
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = db.ConnectionPool(os.path.join(tmp, 'game.db'))
+        migrations.migrate(pool)
+        sender = outbox.OutboxSender(pool=pool, clock=Clock(), max_attempts=3)
+        sender.bot = Bot()
+        sender._executor = ThreadPoolExecutor(max_workers=2)
+        yield sender
+        sender._executor.shutdown()
+        pool.close_all()
+
+
+def add(sender, chat_id, dedup_key=None):
+    with sender.pool.transaction():
+        return outbox.add(chat_id, f"hello {chat_id}", dedup_key=dedup_key, pool=sender.pool)
+
+
+def status(sender, chat_id):
+    return sender.pool.connection().execute(
+        "SELECT status, attempts, next_attempt_at FROM outbox WHERE chat_id = ?", (chat_id,)
+    ).fetchone()
+
+
+def test_dedup_key_queues_once(sender):
+    assert add(sender, 1, dedup_key='battle:1')
+    assert not add(sender, 1, dedup_key='battle:1')
+    sender.clock.now = 2e9
+    assert sender.drain() == 1
+    assert sender.bot.sent == [1]
+
+
+def test_claimed_rows_are_leased(sender):
+    add(sender, 1)
+    sender.clock.now = 2e9
+    assert len(sender.claim()) == 1
+    assert sender.claim() == []  # another sender finds nothing while the lease runs
+    sender.clock.now += outbox.CLAIM_LEASE_SECONDS
+    assert len(sender.claim()) == 1  # the lease ran out before the send was recorded
+
+
+def test_transient_errors_back_off_then_give_up(sender):
+    add(sender, 1)
+    sender.bot.errors[1] = NetworkError("timed out")
+    sender.clock.now = 2e9
+    for attempt in (1, 2):
+        assert sender.drain() == 1
+        state, attempts, next_attempt_at = status(sender, 1)
+        assert (state, attempts) == (outbox.PENDING, attempt)
+        delay = next_attempt_at - sender.clock.now
+        assert outbox.BACKOFF_BASE * 2 ** (attempt - 1) / 2 <= delay <= outbox.BACKOFF_BASE * 2 ** (attempt - 1)
+        assert sender.drain() == 0  # not due yet
+        sender.clock.now = next_attempt_at
+    assert sender.drain() == 1
+    assert status(sender, 1)[:2] == (outbox.FAILED, 3)
+
+
+def test_blocked_user_is_not_retried(sender):
+    add(sender, 1)
+    add(sender, 2)
+    sender.bot.errors[1] = Unauthorized("bot was blocked by the user")
+    sender.clock.now = 2e9
+    assert sender.drain() == 2
+    assert status(sender, 1)[:2] == (outbox.FAILED, 1)
+    assert status(sender, 2)[:2] == (outbox.SENT, 1)
+    assert sender.stats() == {'pending': 0, 'sent': 1, 'retried': 0, 'failed': 1}
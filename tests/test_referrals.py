@@ -0,0 +1,43 @@
+import pytest
+
+import db
+import ledger
+import referrals
+import run
+import user_cache
+
+
+@pytest.fixture
+def users():
+    run.setup_database()
+    user_cache.cache.clear()
+    for user_id in (1, 2):
+        run.create_user(user_id, 100)
+    yield 1, 2
+    db.execute("DELETE FROM users WHERE id IN (1, 2)")
+    user_cache.cache.clear()
+
+
+def test_codes_are_unique_and_checked():
+    codes = {referrals.generate_referral_code(user_id) for user_id in range(1, 5000)}
+    assert len(codes) == 4999
+    assert all(referrals.looks_valid(code) for code in codes)
+    code = referrals.generate_referral_code(1234)
+    typo = code[:-1] + ('0' if code[-1] != '0' else '1')
+    assert not referrals.looks_valid(typo)
+
+
+def test_redeem_credits_both_sides_once(users):
+    referrer, referee = users
+    code = referrals.ensure_code(referrer)
+    assert referrals.ensure_code(referrer) == code
+    assert referrals.redeem(referee, code.lower()) == referrals.REDEEMED
+    assert referrals.redeem(referee, code) == referrals.ALREADY_USED
+    assert ledger.balance(referrer) == 100 + referrals.REFERRAL_REWARDS['referrer']
+    assert ledger.balance(referee) == 100 + referrals.REFERRAL_REWARDS['referee']
+
+
+def test_own_code_is_rejected(users):
+    referrer, _ = users
+    assert referrals.redeem(referrer, referrals.ensure_code(referrer)) == referrals.INVALID_CODE
+    assert ledger.balance(referrer) == 100
@@ -0,0 +1,35 @@
+import random
+
+import timers
+
+
+def test_keys_expire_on_time_never_early():
+    now = [0.0]
+    wheel = timers.TimerWheel(tick=1.0, slots=8, levels=3, clock=lambda: now[0])
+    rng = random.Random(3)
+    deadlines = {key: rng.uniform(0, 600) for key in range(300)}  # well past the lowest levels' span
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    cancelled = set(rng.sample(sorted(deadlines), 30))
+    for key in cancelled:
+        assert wheel.cancel(key)
+
+    while now[0] < 700:
+        previous = now[0]
+        now[0] += rng.uniform(0, 3)
+        for key in wheel.advance():
+            # Not early, and not held back by an earlier advance more than a tick past its deadline
+            assert previous < deadlines[key] + 1 and deadlines[key] <= now[0]
+            del deadlines[key]
+    assert set(deadlines) == cancelled
+    assert len(wheel) == 0
+
+
+def test_reschedule_replaces_deadline():
+    now = [0.0]
+    wheel = timers.TimerWheel(clock=lambda: now[0])
+    wheel.schedule('game', 5)
+    wheel.schedule('game', 50)
+    assert wheel.advance(10) == []
+    assert wheel.advance(51) == ['game']
+    assert 'game' not in wheel
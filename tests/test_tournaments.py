@@ -0,0 +1,57 @@
+import pytest
+
+import db
+import ledger
+import run
+import user_cache
+
+PLAYERS = range(1, run.TOURNAMENT_SIZE + 1)
+
+
+@pytest.fixture
+def players():
+    run.setup_database()
+    user_cache.cache.clear()
+    for user_id in PLAYERS:
+        run.create_user(user_id, 1000)
+    yield list(PLAYERS)
+    db.execute(f"DELETE FROM users WHERE id <= {run.TOURNAMENT_SIZE}")
+    user_cache.cache.clear()
+
+
+def test_unpaid_seat_holds_the_start(players):
+    tournament = run.open_tournament(players[0])
+    for user_id in players[1:-1]:
+        assert run.reserve_tournament_seat(tournament.id, user_id) is None
+        run.join_tournament(tournament.id, user_id)
+    last = players[-1]
+    assert run.reserve_tournament_seat(tournament.id, last) is None
+
+    # Eight seats, but the last fee hasn't been charged yet
+    assert not run.claim_tournament_start(tournament.id)
+    db.execute("UPDATE users SET tokens = 0 WHERE id = ?", (last,))
+    user_cache.cache.clear()
+    with pytest.raises(ledger.InsufficientFunds):
+        run.join_tournament(tournament.id, last)
+    assert run.active_tournaments[tournament.id].status == "registering"
+    assert last not in run.active_tournaments[tournament.id].players
+
+    ledger.credit(last, 100, 'test')
+    assert run.reserve_tournament_seat(tournament.id, last) is None
+    run.join_tournament(tournament.id, last)
+    assert run.claim_tournament_start(tournament.id)
+    assert not run.claim_tournament_start(tournament.id)
+
+
+def test_open_tournament_charges_only_if_registered(players, monkeypatch):
+    creator = players[0]
+
+    def fail(*args):
+        raise RuntimeError("lobby index unavailable")
+
+    monkeypatch.setattr(run.tournament_lobbies, 'add', fail)
+    with pytest.raises(RuntimeError):
+        run.open_tournament(creator)
+    assert ledger.balance(creator) == 1000
+    assert not any(tournament.creator == creator and tournament.status == "registering"
+                   for _, tournament in run.active_tournaments.items())
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+import pytest
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ['GAME_DB_PATH'] = os.path.join(_tmp.name, 'game.db')
+
+import db  # noqa: E402
+import ledger  # noqa: E402
+import run  # noqa: E402
+import user_cache  # noqa: E402
+
+
+@pytest.fixture
+def user():
+    run.setup_database()
+    user_cache.cache.clear()
+    run.create_user(1, 100)
+    yield 1
+    db.execute("DELETE FROM users WHERE id = 1")
+    user_cache.cache.clear()
+
+
+def test_read_inside_rolled_back_transaction_is_not_cached(user):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            ledger.credit(user, 500, 'test')
+            assert run.get_user_data(user)['tokens'] == 600
+            raise RuntimeError("roll back")
+
+    assert db.fetchone("SELECT tokens FROM users WHERE id = ?", (user,))[0] == 100
+    assert run.get_user_data(user)['tokens'] == 100
+
+
+@pytest.mark.skipif(not user_cache.cache.ttl, reason="the user cache is off (USER_CACHE_TTL=0 or a shared state store)")
+def test_read_after_commit_is_cached(user):
+    ledger.credit(user, 500, 'test')
+    assert run.get_user_data(user)['tokens'] == 600
+    assert user_cache.cache.get(user)['tokens'] == 600
+
+
+def test_zero_ttl_never_caches():
+    cache = user_cache.UserCache(ttl=0)
+    loads = []
+    for _ in range(2):
+        cache.load(1, lambda: loads.append(1) or {'id': 1, 'tokens': 100})
+    assert len(loads) == 2
@@ -0,0 +1,96 @@
+import math
+import threading
+import time
+
+
+class TimerWheel:
+    """Hierarchical timing wheel: deadlines by key, O(1) to schedule, cancel and expire.
+
+    Level 0 has one slot per tick; each higher level covers `slots` times
+    the span of the one below, and a slot is redistributed downwards when
+    the wheel reaches it. With the defaults (1 s ticks, 64 slots, 4
+    levels) deadlines up to ~190 days out are placed directly; later
+    ones wait in the top level and are re-placed as it turns.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, clock=time.time):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._where = {}  # key -> the slot dict holding it
+        self._now = math.floor(clock() / tick)  # last tick processed
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key) -> bool:
+        return key in self._where
+
+    def schedule(self, key, deadline: float) -> None:
+        """Expire key at deadline (a clock() time), replacing any earlier deadline for it."""
+        with self._lock:
+            self._cancel(key)
+            self._place(key, max(math.ceil(deadline / self.tick), self._now + 1))
+
+    def cancel(self, key) -> bool:
+        with self._lock:
+            return self._cancel(key)
+
+    def _cancel(self, key) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    def _place(self, key, due: int) -> None:
+        delta = due - self._now
+        level = 0
+        while level < self.levels - 1 and delta >= 1 << (self._bits * (level + 1)):
+            level += 1
+        slot = self._wheels[level][(due >> (self._bits * level)) & self._mask]
+        slot[key] = due
+        self._where[key] = slot
+
+    def advance(self, now: float = None) -> list:
+        """Turn the wheel up to now; returns the keys whose deadline has passed.
+
+        Keys never expire early, and at most one tick late.
+        """
+        target = math.floor((self.clock() if now is None else now) / self.tick)
+        expired = []
+        with self._lock:
+            while self._now < target:
+                if not self._where:
+                    self._now = target
+                    break
+                self._now += 1
+                self._cascade()
+                slot_index = self._now & self._mask
+                slot = self._wheels[0][slot_index]
+                if slot:
+                    self._wheels[0][slot_index] = {}
+                    for key in slot:
+                        del self._where[key]
+                    expired.extend(slot)
+        return expired
+
+    def _cascade(self) -> None:
+        # Highest level first, so entries can fall through several levels in one tick
+        for level in range(self.levels - 1, 0, -1):
+            span_bits = self._bits * level
+            if self._now & ((1 << span_bits) - 1):
+                continue
+            slot_index = (self._now >> span_bits) & self._mask
+            slot = self._wheels[level][slot_index]
+            if slot:
+                self._wheels[level][slot_index] = {}
+                for key, due in slot.items():
+                    self._place(key, due)
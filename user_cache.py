@@ -0,0 +1,108 @@
+import os
+import threading
+
+from cachetools import TTLCache
+
+import db
+import state
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '50000'))
+# Write-through only sees this process's writes, so with a shared state
+# store (several processes on one game.db) rows aren't cached by default
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '0' if state.store.shared else '300'))
+
+
+class UserCache:
+    """Bounded LRU/TTL cache of users rows, kept current by write-through; a ttl of 0 turns it off."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._epoch = 0  # bumped on every write so in-flight loads can't store stale rows
+
+    def get(self, user_id):
+        """Return a copy of the cached row, or None on a miss."""
+        with self._lock:
+            row = self._cache.get(user_id)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(row)
+
+    def load(self, user_id, loader):
+        """Return the row for user_id, calling loader() and caching its result on a miss.
+
+        Inside a transaction the loader may see writes that later roll back,
+        so the row is returned but not cached.
+        """
+        row = self.get(user_id)
+        if row is not None:
+            return row
+        epoch = self._epoch
+        row = loader()
+        if row is not None and self.ttl > 0 and not db.pool.in_transaction():
+            with self._lock:
+                if epoch == self._epoch:
+                    self._cache[user_id] = dict(row)
+        return row
+
+    def update(self, user_id, fields: dict) -> None:
+        """Apply written fields to a cached row; uncached users are left alone."""
+        with self._lock:
+            row = self._cache.get(user_id)
+            if row is not None:
+                row.update(fields)
+                self._cache[user_id] = row
+            self.writes += 1
+            self._epoch += 1
+
+    def invalidate(self, user_id) -> None:
+        with self._lock:
+            self._cache.pop(user_id, None)
+            self._epoch += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+cache = UserCache()
+_listeners = []
+
+
+def subscribe(listener) -> None:
+    """Call listener(user_id, fields) for every committed write-through."""
+    _listeners.append(listener)
+
+
+def write_through(user_id, **fields) -> None:
+    """Record fields just written to users; applied when the enclosing transaction commits."""
+    db.after_commit(lambda: _apply(user_id, fields))
+
+
+def _apply(user_id, fields: dict) -> None:
+    cache.update(user_id, fields)
+    for listener in _listeners:
+        listener(user_id, fields)
+
+
+def invalidate(user_id) -> None:
+    db.after_commit(lambda: cache.invalidate(user_id))
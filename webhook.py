@@ -0,0 +1,129 @@
+import json
+import logging
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path.rstrip('/') != webhook.path:
+            self._reply(404)
+            return
+        if webhook.secret_token and self.headers.get(SECRET_HEADER) != webhook.secret_token:
+            webhook.reject()
+            self._reply(403)
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            payload = json.loads(body)
+        except (ValueError, TypeError):
+            webhook.reject()
+            self._reply(400)
+            return
+        # Telegram posts one update per request; a front proxy or replayer may post a list
+        items = payload if isinstance(payload, list) else [payload]
+        if len(items) > webhook.max_batch:
+            webhook.reject()
+            self._reply(413)
+            return
+        webhook.enqueue(items)
+        self._reply(200)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class WebhookServer:
+    """Local HTTP endpoint that feeds posted updates into the dispatcher's queue.
+
+    This is the same queue start_polling fills, so handlers run exactly as
+    they do in polling mode.
+    """
+
+    def __init__(self, bot, update_queue, listen: str = '127.0.0.1', port: int = 8443,
+                 url_path: str = 'webhook', secret_token: str = None, max_batch: int = 100):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.listen = listen
+        self.port = port
+        self.path = '/' + url_path.strip('/')
+        self.secret_token = secret_token
+        self.max_batch = max_batch
+        self.requests = 0
+        self.updates = 0
+        self.rejected = 0
+        self._counter_lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def enqueue(self, items: list) -> None:
+        updates = [Update.de_json(item, self.bot) for item in items]
+        updates = [update for update in updates if update is not None]
+        for update in updates:
+            self.update_queue.put(update)
+        with self._counter_lock:
+            self.requests += 1
+            self.updates += len(updates)
+
+    def reject(self) -> None:
+        with self._counter_lock:
+            self.rejected += 1
+
+    def start(self) -> None:
+        self._httpd = ThreadingHTTPServer((self.listen, self.port), _WebhookHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.webhook = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='webhook', daemon=True)
+        self._thread.start()
+        logger.info("Webhook listening on %s:%d%s", self.listen, self.port, self.path)
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'updates': self.updates, 'rejected': self.rejected}
+
+
+def run(updater, server: WebhookServer, webhook_url: str = None, max_connections: int = 40) -> None:
+    """Serve updates through server until SIGINT/SIGTERM; the webhook counterpart of start_polling() + idle()."""
+    updater.job_queue.start()
+    dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True)
+    dispatcher_thread.start()
+    server.start()
+
+    if webhook_url:
+        api_kwargs = {'secret_token': server.secret_token} if server.secret_token else None
+        updater.bot.set_webhook(url=webhook_url, max_connections=max_connections, api_kwargs=api_kwargs)
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    while not stopping.wait(1):
+        pass
+
+    logger.info("Stopping webhook server: %s", server.stats())
+    server.stop()
+    updater.dispatcher.stop()
+    dispatcher_thread.join()
+    updater.job_queue.stop()
@@ -0,0 +1,136 @@
+import logging
+import os
+import sqlite3
+import threading
+from itertools import groupby
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Durability modes:
+#   sync    - rows are written inline, inside the caller's transaction
+#   batched - rows are group-committed by a background thread; a crash can
+#             lose up to one flush interval of append-only rows
+SYNC = 'sync'
+BATCHED = 'batched'
+
+DURABILITY = os.getenv('WRITE_BEHIND_MODE', BATCHED)
+FLUSH_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_FLUSH_MS', '50'))
+MAX_BATCH_ROWS = int(os.getenv('WRITE_BEHIND_MAX_ROWS', '500'))
+
+
+class WriteBehindQueue:
+    """Collects append-only inserts and flushes them with executemany in one commit."""
+
+    def __init__(self, pool=None, durability: str = DURABILITY,
+                 flush_interval_ms: int = FLUSH_INTERVAL_MS, max_batch_rows: int = MAX_BATCH_ROWS):
+        if durability not in (SYNC, BATCHED):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.pool = pool or db.pool
+        self.durability = durability
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_rows = max_batch_rows
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.rows_written = 0
+        self.batches = 0
+        self.failed_rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, sql: str, params=()) -> None:
+        """Queue one insert. Written inline when in sync mode or when the writer isn't running.
+
+        Rows submitted inside a transaction are only queued once it commits,
+        so a rollback never leaves an orphaned journal or audit row.
+        """
+        if self.durability == SYNC or not self.running:
+            self.pool.connection().execute(sql, params)
+            return
+        self.pool.after_commit(lambda: self._enqueue(sql, params))
+
+    def _enqueue(self, sql: str, params) -> None:
+        with self._lock:
+            self._pending.append((sql, params))
+            full = len(self._pending) >= self.max_batch_rows
+        if full:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self.durability == SYNC or self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and flush whatever is still queued."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+
+    def flush(self) -> int:
+        """Write all queued rows in one transaction; returns the number of rows flushed."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                with self.pool.transaction() as conn:
+                    for sql, rows in groupby(batch, key=lambda item: item[0]):
+                        conn.executemany(sql, [params for _, params in rows])
+            except sqlite3.Error as e:
+                logger.warning("Batch of %d rows failed (%s); retrying row by row", len(batch), e)
+                self._write_individually(batch)
+            else:
+                self.rows_written += len(batch)
+            self.batches += 1
+            return len(batch)
+
+    def _write_individually(self, batch) -> None:
+        conn = self.pool.connection()
+        for sql, params in batch:
+            try:
+                conn.execute(sql, params)
+                self.rows_written += 1
+            except sqlite3.Error as e:
+                self.failed_rows += 1
+                logger.error("Dropping write-behind row %r %r: %s", sql, params, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'durability': self.durability,
+            'pending': pending,
+            'rows_written': self.rows_written,
+            'batches': self.batches,
+            'failed_rows': self.failed_rows,
+        }
+
+
+queue = WriteBehindQueue()
+
+
+def submit(sql: str, params=()) -> None:
+    queue.submit(sql, params)